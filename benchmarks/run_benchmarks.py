@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the moodle_mod_tools operations.
+
+Each operation runs in a fresh process against a synthetic backup and
+records wall time, peak RSS and the number of files it created or modified.
+Results are written as JSON; pass --compare with an earlier results file to
+see the relative change per operation and size.
+
+    python benchmarks/run_benchmarks.py --sizes 10,1000,10000 --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from synthetic_backup import generate_backup
+
+OPERATIONS = ("add_page", "add_section", "bulk_add", "package_mbz", "decompress_mbz", "decompress_mbz_threads")
+
+
+def _snapshot(root: str) -> dict:
+    state = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            state[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+    return state
+
+
+def _run_operation(operation: str, workdir: str, queue) -> None:
+    """Child process body: runs one operation and reports wall time, peak RSS and files written."""
+    import resource
+    from moodle_mod_tools.page_adder import add_page_to_backup
+    from moodle_mod_tools.section_adder import add_section_to_backup
+    from moodle_mod_tools.bulk_adder import bulk_add_from_json
+    from moodle_mod_tools.mbz_packager import package_mbz, decompress_mbz
+
+    backup = os.path.join(workdir, "backup")
+    archive = os.path.join(workdir, "backup.mbz")
+    extracted = os.path.join(workdir, "extracted")
+    calls = {
+        "add_page": lambda: add_page_to_backup(backup, "1", "Benchmark page", page_content="<p>benchmark</p>"),
+        "add_section": lambda: add_section_to_backup(backup, backup, "Benchmark section"),
+        "bulk_add": lambda: bulk_add_from_json(backup, backup, os.path.join(workdir, "config.json")),
+        "package_mbz": lambda: package_mbz(backup, archive),
+        "decompress_mbz": lambda: decompress_mbz(archive, extracted),
+        "decompress_mbz_threads": lambda: decompress_mbz(archive, extracted, threads=8),
+    }
+
+    before = _snapshot(workdir)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        calls[operation]()
+        wall = time.perf_counter() - start
+    after = _snapshot(workdir)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    written = sum(1 for path, state in after.items() if before.get(path) != state)
+    queue.put({"wall_s": wall, "peak_rss_kb": peak, "files_written": written})
+
+
+def _prepare(operation: str, template: str, workdir: str, bulk_pages: int) -> None:
+    from moodle_mod_tools.mbz_packager import package_mbz
+
+    shutil.copytree(template, os.path.join(workdir, "backup"))
+    if operation == "bulk_add":
+        sections = max(1, bulk_pages // 10)
+        config = [
+            {"section_name": f"Bulk section {s}", "pages": [{"page_title": f"Bulk page {s}.{p}", "page_content": "<p>bulk</p>"} for p in range(10)]}
+            for s in range(sections)
+        ]
+        with open(os.path.join(workdir, "config.json"), "w") as f:
+            json.dump(config, f)
+    elif operation.startswith("decompress_mbz"):
+        package_mbz(os.path.join(workdir, "backup"), os.path.join(workdir, "backup.mbz"))
+        shutil.rmtree(os.path.join(workdir, "backup"))
+
+
+def run_benchmarks(sizes, operations=OPERATIONS, repeat: int = 3, files: int = 10, file_size: int = 64 * 1024, bulk_pages: int = 100) -> dict:
+    """Runs every operation at every size (activity count) and returns the results document."""
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for size in sizes:
+            template = generate_backup(os.path.join(scratch, f"template_{size}"), sections=max(1, size // 100), activities=size, files=files, file_size=file_size)
+            for operation in operations:
+                samples = []
+                for _ in range(repeat):
+                    workdir = tempfile.mkdtemp(dir=scratch)
+                    _prepare(operation, template, workdir, bulk_pages)
+                    queue = ctx.Queue()
+                    process = ctx.Process(target=_run_operation, args=(operation, workdir, queue))
+                    process.start()
+                    samples.append(queue.get())
+                    process.join()
+                    shutil.rmtree(workdir)
+                result = {
+                    "operation": operation,
+                    "size": size,
+                    "wall_s": statistics.median(s["wall_s"] for s in samples),
+                    "peak_rss_kb": max(s["peak_rss_kb"] for s in samples),
+                    "files_written": samples[0]["files_written"],
+                    "samples": [s["wall_s"] for s in samples],
+                }
+                results.append(result)
+                print(f"{operation:<22} {size:>7}  {result['wall_s']:9.4f}s  {result['peak_rss_kb']:>9} KB  {result['files_written']:>7} files")
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": list(sizes), "repeat": repeat, "files": files, "file_size": file_size, "bulk_pages": bulk_pages},
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.10) -> int:
+    """Prints per-operation changes against baseline and returns the number of regressions."""
+    previous = {(r["operation"], r["size"]): r for r in baseline["results"]}
+    regressions = 0
+    for result in current["results"]:
+        old = previous.get((result["operation"], result["size"]))
+        if old is None:
+            continue
+        change = (result["wall_s"] - old["wall_s"]) / old["wall_s"] if old["wall_s"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{result['operation']:<22} {result['size']:>7}  {old['wall_s']:9.4f}s -> {result['wall_s']:9.4f}s  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark moodle_mod_tools operations on synthetic backups.")
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma-separated activity counts")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="Comma-separated operations to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--files", type=int, default=10, help="File blobs per synthetic backup")
+    parser.add_argument("--file_size", type=int, default=64 * 1024)
+    parser.add_argument("--bulk_pages", type=int, default=100, help="Pages added by the bulk_add operation")
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    operations = [operation for operation in args.operations.split(",") if operation]
+    current = run_benchmarks(sizes, operations, args.repeat, args.files, args.file_size, args.bulk_pages)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic Moodle backups for benchmarking.
+
+The layout mirrors what the adders read and write: moodle_backup.xml,
+sections/section_N/, activities/<modname>_N/ and a files/ content store.
+Output is deterministic for a given set of arguments.
+"""
+
+import argparse
+import os
+import random
+import shutil
+
+from moodle_mod_tools.mbz_packager import package_mbz
+
+MODNAMES = ("page", "quiz", "resource")
+
+
+def _write(path: str, content) -> None:
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def generate_backup(output_dir: str, sections: int = 10, activities: int = 100, files: int = 0, file_size: int = 64 * 1024, seed: int = 0) -> str:
+    """Writes a synthetic extracted backup to output_dir and returns its path.
+
+    activities are spread round-robin over sections and cycle through page,
+    quiz and resource modules. files blobs of file_size bytes go under files/.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+
+    sequences = {sid: [] for sid in range(1, sections + 1)}
+    activity_blocks = []
+    for n in range(activities):
+        module_id = 1000 + n
+        section_id = n % sections + 1
+        modname = MODNAMES[n % len(MODNAMES)]
+        directory = f"activities/{modname}_{module_id}"
+        path = os.path.join(output_dir, directory)
+        os.makedirs(path)
+        body = "".join(rng.choices("abcdefghij ", k=200))
+        _write(os.path.join(path, f"{modname}.xml"), f'<?xml version="1.0" encoding="UTF-8"?>\n<activity id="{module_id}" moduleid="{module_id}" modulename="{modname}" contextid="{5000 + n}">\n  <{modname} id="{module_id}">\n    <name>{modname} {n}</name>\n    <intro>{body}</intro>\n  </{modname}>\n</activity>\n')
+        _write(os.path.join(path, "module.xml"), f'<?xml version="1.0" encoding="UTF-8"?>\n<module id="{module_id}" version="2024100700">\n  <modulename>{modname}</modulename>\n  <sectionid>{section_id}</sectionid>\n</module>\n')
+        sequences[section_id].append(str(module_id))
+        activity_blocks.append(f"        <activity>\n          <moduleid>{module_id}</moduleid>\n          <sectionid>{section_id}</sectionid>\n          <modulename>{modname}</modulename>\n          <title>{modname} {n}</title>\n          <directory>{directory}</directory>\n          <insubsection></insubsection>\n        </activity>")
+
+    section_blocks = []
+    setting_blocks = ["      <setting>\n        <level>root</level>\n        <name>filename</name>\n        <value>synthetic.mbz</value>\n      </setting>"]
+    for sid, sequence in sequences.items():
+        path = os.path.join(output_dir, "sections", f"section_{sid}")
+        os.makedirs(path)
+        _write(os.path.join(path, "section.xml"), f'<?xml version="1.0" encoding="UTF-8"?>\n<section id="{sid}">\n  <number>{sid}</number>\n  <name>Section {sid}</name>\n  <summary></summary>\n  <summaryformat>1</summaryformat>\n  <sequence>{",".join(sequence)}</sequence>\n  <visible>1</visible>\n</section>\n')
+        _write(os.path.join(path, "inforef.xml"), '<?xml version="1.0" encoding="UTF-8"?>\n<inforef>\n</inforef>\n')
+        section_blocks.append(f"        <section>\n          <sectionid>{sid}</sectionid>\n          <title>Section {sid}</title>\n          <directory>sections/section_{sid}</directory>\n          <parentcmid></parentcmid>\n          <modname></modname>\n        </section>")
+        setting_blocks.append(f"      <setting>\n        <level>section</level>\n        <section>section_{sid}</section>\n        <name>section_{sid}_included</name>\n        <value>1</value>\n      </setting>")
+
+    for n in range(files):
+        digest = f"{rng.getrandbits(160):040x}"
+        path = os.path.join(output_dir, "files", digest[:2])
+        os.makedirs(path, exist_ok=True)
+        _write(os.path.join(path, digest), bytes(rng.getrandbits(8) for _ in range(256)) * (file_size // 256))
+
+    os.makedirs(os.path.join(output_dir, "course"))
+    _write(os.path.join(output_dir, "course", "course.xml"), '<?xml version="1.0" encoding="UTF-8"?>\n<course id="2" contextid="20">\n</course>\n')
+    _write(os.path.join(output_dir, "files.xml"), '<?xml version="1.0" encoding="UTF-8"?>\n<files>\n</files>\n')
+
+    nl = "\n"
+    _write(os.path.join(output_dir, "moodle_backup.xml"), f"""<?xml version="1.0" encoding="UTF-8"?>
+<moodle_backup>
+  <information>
+    <name>synthetic.mbz</name>
+    <moodle_version>2024100700</moodle_version>
+    <original_course_contextid>20</original_course_contextid>
+    <contents>
+      <activities>
+{nl.join(activity_blocks)}
+      </activities>
+      <sections>
+{nl.join(section_blocks)}
+      </sections>
+      <course>
+        <courseid>2</courseid>
+        <title>Synthetic course</title>
+        <directory>course</directory>
+      </course>
+    </contents>
+    <settings>
+{nl.join(setting_blocks)}
+    </settings>
+  </information>
+</moodle_backup>
+""")
+    return output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Moodle backup.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--activities", type=int, default=100)
+    parser.add_argument("--files", type=int, default=0)
+    parser.add_argument("--file_size", type=int, default=64 * 1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--archive", default=None, help="Also package the backup into this .mbz file")
+    args = parser.parse_args()
+
+    generate_backup(args.output_dir, args.sections, args.activities, args.files, args.file_size, args.seed)
+    if args.archive:
+        package_mbz(args.output_dir, args.archive)
+
+
+if __name__ == "__main__":
+    main()
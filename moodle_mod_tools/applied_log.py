@@ -0,0 +1,86 @@
+"""Record of the bulk config entries already applied to a backup, so re-runs apply only the delta."""
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+from .backup_session import APPLIED_LOG, BackupSession
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of the file at path, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def entry_hash(entry: dict, parent: str) -> str:
+    """Content hash of a section or page entry, ignoring "type" and nested "pages".
+
+    parent identifies where the entry goes: "" for a section, the section
+    entry's key or "id:<section_id>" for a page. A page therefore counts as
+    new when the section entry it belongs to changes. Files named by
+    "*_file" fields contribute a hash of their content, so touching a file
+    without changing it does not make the entry new.
+    """
+    fields = {name: value for name, value in entry.items() if name not in ("type", "pages")}
+    for name, value in entry.items():
+        if name.endswith("_file") and isinstance(value, str) and os.path.isfile(value):
+            fields[f"{name}:sha256"] = file_hash(value)
+    data = json.dumps([parent, fields], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class EntryKeys:
+    """Assigns log keys to entries in config order.
+
+    The key is entry_hash, suffixed with "#n" for the n-th repeat of an
+    identical entry, so a config that adds the same page twice still gets two.
+    """
+
+    def __init__(self):
+        self._seen: Dict[str, int] = {}
+
+    def key(self, entry: dict, parent: str) -> str:
+        digest = entry_hash(entry, parent)
+        repeat = self._seen.get(digest, 0)
+        self._seen[digest] = repeat + 1
+        return f"{digest}#{repeat}" if repeat else digest
+
+
+class AppliedLog:
+    """The IDs created for each applied entry, stored in the backup as moodle_mod_tools_applied.json.
+
+    entries maps a key from EntryKeys to {"type": "section" | "page", "id": n}.
+    A changed entry gets a new key and is applied again; what it created
+    before is left in place.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, dict]] = None):
+        self.entries: Dict[str, dict] = entries if entries is not None else {}
+        self._dirty = False
+
+    @classmethod
+    def load(cls, session: BackupSession) -> "AppliedLog":
+        """Reads the log from the session's backup; an empty log if it has none."""
+        if not session.workspace.isfile(APPLIED_LOG):
+            return cls()
+        data = json.loads(session.workspace.read(APPLIED_LOG).decode("utf-8"))
+        return cls(data.get("applied", {}))
+
+    def get(self, key: str) -> Optional[int]:
+        """The ID created for key, or None if it has not been applied."""
+        entry = self.entries.get(key)
+        return entry["id"] if entry is not None else None
+
+    def record(self, key: str, kind: str, created_id: int) -> None:
+        self.entries[key] = {"type": kind, "id": created_id}
+        self._dirty = True
+
+    def save(self, session: BackupSession) -> None:
+        """Queues the log on session; it is written after everything else when the session commits."""
+        if self._dirty:
+            session.queue_file(APPLIED_LOG, json.dumps({"version": 1, "applied": self.entries}, indent=1, sort_keys=True).encode("utf-8"))
+            self._dirty = False
@@ -0,0 +1,72 @@
+"""Cached lookup index over a backup's moodle_backup.xml."""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+from .backup_session import MANIFEST
+from .inspector import parse_manifest
+
+# Indexes keyed by backup directory, each with the manifest stat it was built from.
+_CACHE: Dict[str, Tuple[tuple, "BackupIndex"]] = {}
+
+
+class BackupIndex:
+    """Section and activity lookups built from one pass over moodle_backup.xml.
+
+    Holds section title -> ID, section ID -> directory and section ID ->
+    course module IDs (in manifest order). All lookups are dict accesses.
+    """
+
+    def __init__(self, manifest: dict):
+        self.ids_by_title: Dict[str, List[int]] = {}
+        self.directories: Dict[int, str] = {}
+        self.activities: Dict[int, List[int]] = {}
+        for section in manifest["sections"]:
+            if not section.get("sectionid", "").isdigit():
+                continue
+            section_id = int(section["sectionid"])
+            self.ids_by_title.setdefault(section.get("title", ""), []).append(section_id)
+            self.directories[section_id] = section.get("directory", "")
+            self.activities.setdefault(section_id, [])
+        for activity in manifest["activities"]:
+            section_id = activity.get("sectionid", "")
+            module_id = activity.get("moduleid", "")
+            if section_id.isdigit() and module_id.isdigit():
+                self.activities.setdefault(int(section_id), []).append(int(module_id))
+
+    @classmethod
+    def for_backup(cls, backup_dir: str) -> Optional["BackupIndex"]:
+        """Returns the index for an extracted backup, or None if it has no moodle_backup.xml.
+
+        The index is cached per directory and rebuilt only when the manifest's
+        mtime, size or inode changes.
+        """
+        manifest_path = os.path.join(backup_dir, MANIFEST)
+        try:
+            st = os.stat(manifest_path)
+        except OSError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        key = os.path.realpath(backup_dir)
+        cached = _CACHE.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        index = cls(parse_manifest(manifest_path))
+        _CACHE[key] = (signature, index)
+        return index
+
+    def section_id(self, title: str) -> int:
+        """ID of the first section titled title, or -1."""
+        ids = self.ids_by_title.get(title)
+        return ids[0] if ids else -1
+
+    def section_ids(self, titles: Iterable[str]) -> Dict[str, int]:
+        """Maps each title to its first section ID, or -1."""
+        return {title: self.section_id(title) for title in titles}
+
+    def section_directories(self, section_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """Maps each section ID to its backup directory, or None."""
+        return {section_id: self.directories.get(section_id) for section_id in section_ids}
+
+    def section_activities(self, section_ids: Iterable[int]) -> Dict[int, List[int]]:
+        """Maps each section ID to the course module IDs the manifest lists for it."""
+        return {section_id: list(self.activities.get(section_id, [])) for section_id in section_ids}
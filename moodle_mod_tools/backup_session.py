@@ -0,0 +1,364 @@
+"""Transactional in-memory editing of an extracted Moodle backup."""
+
+import io
+import re
+import time
+import xml.etree.ElementTree as ET
+from typing import TYPE_CHECKING, BinaryIO, ContextManager, Dict, Iterable, List, Optional, Tuple, Union
+from xml.sax.saxutils import escape
+from . import metrics
+from .exceptions import BackupError
+from .id_allocator import IdAllocator
+from .manifest_splicer import ManifestSplicer
+from .streamed_content import ContentSource, StreamedText, as_content
+from .workspace import DirectoryWorkspace, MemoryWorkspace, Workspace
+
+if TYPE_CHECKING:
+    from .backup_index import BackupIndex
+
+
+PAGE_PLACEHOLDERS = {
+    "inforef.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<inforef>\n  <fileref/>\n  <graderef/>\n  <groupref/>\n  <groupingref/>\n  <userref/>\n</inforef>\n""",
+    "roles.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<roles></roles>\n""",
+    "grades.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<activity_grade_graders></activity_grade_graders>\n""",
+    "grade_history.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<activity_grade_history></activity_grade_history>\n"""
+}
+
+MANIFEST = "moodle_backup.xml"
+# Written by bulk runs to record what they have applied; see applied_log.
+APPLIED_LOG = "moodle_mod_tools_applied.json"
+
+SECTION_INFOREF_XML = """<?xml version="1.0" encoding="UTF-8"?>\n<inforef>\n</inforef>\n"""
+
+# A page description or content: a str, or a ContentSource streamed in when the page is written.
+PageText = Union[str, ContentSource]
+
+
+def render_section(new_id, section_number, section_name: str, now) -> Tuple[Dict[str, str], str, str]:
+    """Renders a new section's files (by backup path), manifest section block and settings block."""
+    section_rel = f"sections/section_{new_id}"
+    files = {
+        f"{section_rel}/section.xml": f"""<?xml version="1.0" encoding="UTF-8"?>\n<section id="{new_id}">\n  <number>{section_number}</number>\n  <name>{section_name}</name>\n  <summary></summary>\n  <summaryformat>1</summaryformat>\n  <sequence></sequence>\n  <visible>1</visible>\n  <availabilityjson>$@NULL@$</availabilityjson>\n  <component>$@NULL@$</component>\n  <itemid>$@NULL@$</itemid>\n  <timemodified>{now}</timemodified>\n</section>\n""",
+        f"{section_rel}/inforef.xml": SECTION_INFOREF_XML,
+    }
+    section_block = f"""
+        <section>\n          <sectionid>{new_id}</sectionid>\n          <title>{section_name}</title>\n          <directory>sections/section_{new_id}</directory>\n          <parentcmid></parentcmid>\n          <modname></modname>\n        </section>\n    """.strip()
+    settings_block = f"""
+      <setting>\n        <level>section</level>\n        <section>section_{new_id}</section>\n        <name>section_{new_id}_included</name>\n        <value>1</value>\n      </setting>\n      <setting>\n        <level>section</level>\n        <section>section_{new_id}</section>\n        <name>section_{new_id}_userinfo</name>\n        <value>0</value>\n      </setting>\n    """.strip()
+    return files, section_block, settings_block
+
+
+def _page_xml(new_module_id, cm_id, context_id, page_title, page_description, page_content) -> str:
+    return f'''<?xml version="1.0" encoding="UTF-8"?>\n<activity id="{new_module_id}" moduleid="{cm_id}" modulename="page" contextid="{context_id}">\n  <page id="{new_module_id}">\n    <name>{page_title}</name>\n    <intro>{page_description}</intro>\n    <introformat>1</introformat>\n    <content>{page_content}</content>\n    <contentformat>1</contentformat>\n    <legacyfiles>0</legacyfiles>\n    <legacyfileslast>$@NULL@$</legacyfileslast>\n    <display>5</display>\n    <displayoptions>a:2:{{s:10:"printintro";s:1:"0";s:17:"printlastmodified";s:1:"1";}}</displayoptions>\n    <revision>1</revision>\n    <timemodified>1743729253</timemodified>\n  </page>\n</activity>\n'''
+
+
+def render_page(new_module_id, cm_id, context_id, section_id, page_title: str, page_description: PageText, page_content: PageText) -> Tuple[Dict[str, Union[str, StreamedText]], str]:
+    """Renders a new page's files (by backup path) and its manifest activity block.
+
+    The title, description and content are XML-escaped however they are
+    given, so the same HTML yields the same page.xml from a str, a
+    ContentFile or a ContentStream. A str is escaped here; a source is
+    escaped and copied in when page.xml is written, which makes page.xml a
+    StreamedText.
+    """
+    if isinstance(page_description, str):
+        page_description = escape(page_description)
+    if isinstance(page_content, str):
+        page_content = escape(page_content)
+    page_rel = f"activities/page_{new_module_id}"
+    files = {
+        f"{page_rel}/page.xml": StreamedText.render(
+            _page_xml, new_module_id=new_module_id, cm_id=cm_id, context_id=context_id,
+            page_title=escape(page_title), page_description=page_description, page_content=page_content
+        ),
+        f"{page_rel}/module.xml": f'''<?xml version="1.0" encoding="UTF-8"?>\n<module id="{cm_id}" version="2024100700">\n  <modulename>page</modulename>\n  <sectionid>{section_id}</sectionid>\n  <sectionnumber>1</sectionnumber>\n  <idnumber></idnumber>\n  <added>1743729253</added>\n  <score>0</score>\n  <indent>0</indent>\n  <visible>1</visible>\n  <visibleoncoursepage>1</visibleoncoursepage>\n  <visibleold>1</visibleold>\n  <groupmode>0</groupmode>\n  <groupingid>0</groupingid>\n  <completion>0</completion>\n  <completiongradeitemnumber>$@NULL@$</completiongradeitemnumber>\n  <completionpassgrade>0</completionpassgrade>\n  <completionview>0</completionview>\n  <completionexpected>0</completionexpected>\n  <availability>$@NULL@$</availability>\n  <showdescription>0</showdescription>\n  <downloadcontent>1</downloadcontent>\n  <lang></lang>\n  <tags></tags>\n</module>\n''',
+    }
+    for filename, content in PAGE_PLACEHOLDERS.items():
+        files[f"{page_rel}/{filename}"] = content
+    activity_block = f"""
+        <activity>\n          <moduleid>{cm_id}</moduleid>\n          <sectionid>{section_id}</sectionid>\n          <modulename>page</modulename>\n          <title>{escape(page_title)}</title>\n          <directory>activities/page_{new_module_id}</directory>\n          <insubsection></insubsection>\n        </activity>\n    """.strip()
+    return files, activity_block
+
+
+class BackupSession:
+    """Loads an extracted backup once and applies additions in memory.
+
+    moodle_backup.xml and the section.xml files are read at most once per
+    session, and new IDs come from a cached IdAllocator. Nothing is written
+    until commit(), which flushes every touched file exactly once, except
+    new activity files passed to flush_new_files early. Used as a context
+    manager, the session commits on a clean exit and rolls back on error,
+    so a failed session leaves the backup as it was after the last commit.
+    """
+
+    def __init__(self, backup_dir: Union[str, Workspace], backup_name: Optional[str] = None, allocator: Optional[IdAllocator] = None):
+        self.workspace = backup_dir if isinstance(backup_dir, Workspace) else DirectoryWorkspace(backup_dir)
+        self.backup_dir = backup_dir
+        self.backup_name = backup_name
+        self._section_trees: Dict[str, ET.ElementTree] = {}
+        self._dirty_sections: List[str] = []
+        self._new_files: Dict[str, Union[str, StreamedText]] = {}
+        self._activity_blocks: List[str] = []
+        self._section_blocks: List[str] = []
+        self._settings_blocks: List[str] = []
+        self._late_files: Dict[str, bytes] = {}
+        self._flushed: List[str] = []
+        self._ids = allocator
+        self._index: Optional["BackupIndex"] = None
+
+    def __enter__(self) -> "BackupSession":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def _read_file(self, rel: str) -> bytes:
+        return self.workspace.read(rel)
+
+    def _isfile(self, rel: str) -> bool:
+        return self.workspace.isfile(rel)
+
+    def _isdir(self, rel: str) -> bool:
+        return self.workspace.isdir(rel)
+
+    def _open_file(self, rel: str) -> BinaryIO:
+        return self.workspace.open(rel)
+
+    def _open_for_write(self, rel: str) -> ContextManager[BinaryIO]:
+        return self.workspace.open_for_write(rel)
+
+    def _write_file(self, rel: str, data: bytes) -> None:
+        self.workspace.write(rel, data)
+
+    def _write_new_file(self, rel: str, content: Union[str, StreamedText]) -> None:
+        if isinstance(content, StreamedText):
+            with self._open_for_write(rel) as f:
+                content.write_to(f)
+            return
+        self._write_file(rel, content.encode("UTF-8"))
+
+    def _section_dir_exists(self, section_id) -> bool:
+        rel = f"sections/section_{section_id}"
+        xml_rel = f"{rel}/section.xml"
+        if xml_rel in self._new_files or xml_rel in self._section_trees:
+            return True
+        return self._isdir(rel)
+
+    def _load_section_tree(self, section_id) -> ET.ElementTree:
+        rel = f"sections/section_{section_id}/section.xml"
+        tree = self._section_trees.get(rel)
+        if tree is None:
+            if rel in self._new_files:
+                data = self._new_files.pop(rel).encode("UTF-8")
+            else:
+                if not self._isfile(rel):
+                    raise BackupError("section.xml not found.")
+                data = self._read_file(rel)
+            metrics.incr("xml_parses")
+            with metrics.span("xml_parse"):
+                tree = ET.ElementTree(ET.fromstring(data))
+            self._section_trees[rel] = tree
+        if rel not in self._dirty_sections:
+            self._dirty_sections.append(rel)
+        return tree
+
+    def _remember_ids(self) -> None:
+        if self._ids is not None:
+            self.workspace.remember_ids(self._ids)
+
+    @property
+    def ids(self) -> IdAllocator:
+        """The ID allocator for this backup, scanned at most once."""
+        if self._ids is None:
+            self._ids = self.workspace.allocator()
+        return self._ids
+
+    def add_section(self, section_name: str, section_id: int = None) -> int:
+        """Queues a new section and its manifest entries. Returns the new section ID."""
+        new_id = self.ids.next_section_id()
+        now = int(time.time())
+        section_number = new_id - 8  # naive guess
+        files, section_block, settings_block = render_section(new_id, section_number, section_name, now)
+        return self.queue_section(new_id, section_name, files, section_block, settings_block)
+
+    def queue_section(self, new_id: int, section_name: str, files: Dict[str, str], section_block: str, settings_block: str) -> int:
+        """Queues a section already rendered by render_section (or a compiled bulk plan)."""
+        self._new_files.update(files)
+        self._section_blocks.append(section_block)
+        self._settings_blocks.append(settings_block)
+
+        print(f"Section created with ID {new_id} and name '{section_name}'")
+        return new_id
+
+    def add_page(self, section_id, page_title: str, page_description: PageText = "Placeholder description", page_content: PageText = "Placeholder content") -> int:
+        """Queues a new page in the given section. Returns the new page ID.
+
+        page_description and page_content may also be a ContentFile or a
+        readable stream. Either way they are XML-escaped, so pass HTML as
+        is; see render_page. A stream must stay open until the page's files
+        are flushed or committed.
+        """
+        page_description = as_content(page_description)
+        page_content = as_content(page_content)
+        self._sequence_element(section_id)
+        new_module_id = self.ids.next_module_id()
+        cm_id = self.ids.next_module_id()
+        context_id = self.ids.next_context_id()
+        files, activity_block = render_page(new_module_id, cm_id, context_id, section_id, page_title, page_description, page_content)
+        return self.queue_page(section_id, new_module_id, page_title, files, activity_block)
+
+    def queue_page(self, section_id, new_module_id: int, page_title: str, files: Dict[str, Union[str, StreamedText]], activity_block: str) -> int:
+        """Queues a page already rendered by render_page (or a compiled bulk plan) and adds it to the section's sequence."""
+        seq_elem = self._sequence_element(section_id)
+        self._new_files.update(files)
+        self._activity_blocks.append(activity_block)
+
+        existing_seq = seq_elem.text.strip() if seq_elem.text else ""
+        if existing_seq:
+            seq_elem.text = f"{existing_seq},{new_module_id}"
+        else:
+            seq_elem.text = str(new_module_id)
+
+        print(f"Added page with ID={new_module_id}, Title='{page_title}', Section={section_id}.")
+        return new_module_id
+
+    def _sequence_element(self, section_id) -> ET.Element:
+        if not self._section_dir_exists(section_id):
+            raise BackupError(f"section {section_id} does not exist.")
+
+        s_root = self._load_section_tree(section_id).getroot()
+        seq_elem = s_root.find("sequence")
+        if seq_elem is None:
+            raise BackupError("no <sequence> found in section.xml")
+        return seq_elem
+
+    def find_section_id_by_name(self, name: str) -> int:
+        """Returns the ID of the section titled name, or -1 if not found.
+
+        Sections queued in this session are visible before commit; the
+        manifest itself is looked up through backup_index.BackupIndex.
+        """
+        pattern = re.compile(r"<section>\s*<sectionid>(\d+)</sectionid>\s*<title>([^<]*)</title>")
+        for block in self._section_blocks:
+            match = pattern.search(block)
+            if match and match.group(2) == name:
+                return int(match.group(1))
+        if self._index is None:
+            if not self._isfile(MANIFEST):
+                return -1
+            from .backup_index import BackupIndex
+            from .inspector import parse_manifest
+            if isinstance(self.workspace, DirectoryWorkspace):
+                # Shares the per-directory cache with the other lookups.
+                self._index = BackupIndex.for_backup(self.workspace.path)
+            else:
+                with self._open_file(MANIFEST) as f:
+                    self._index = BackupIndex(parse_manifest(f))
+        return self._index.section_id(name)
+
+    def _write_manifest(self) -> None:
+        """Streams moodle_backup.xml into its replacement, splicing in the queued blocks.
+
+        Memory stays constant in the size of the manifest; see ManifestSplicer.
+        """
+        if not self._isfile(MANIFEST):
+            raise BackupError("moodle_backup.xml not found.")
+        splicer = ManifestSplicer()
+        if self._section_blocks and self.backup_name:
+            name = self.backup_name.encode("UTF-8")
+            splicer.replace_first(rb'<name>[^<]*</name>', b'<name>' + name + b'</name>')
+            splicer.replace_first(rb'<value>[^<]*.mbz</value>', b'<value>' + name + b'</value>')
+        activities = None
+        if self._activity_blocks:
+            activities = splicer.insert_activities(("\n".join(self._activity_blocks) + "\n").encode("UTF-8"))
+        if self._section_blocks:
+            splicer.insert_before(b"</sections>", ("\n".join(self._section_blocks) + "\n").encode("UTF-8"))
+        if self._settings_blocks:
+            splicer.insert_before(b"</settings>", ("\n".join(self._settings_blocks) + "\n").encode("UTF-8"))
+
+        with self._open_file(MANIFEST) as src, self._open_for_write(MANIFEST) as dst:
+            unmatched = splicer.splice(src, dst)
+        if activities in unmatched:
+            print("Warning: <information> block not found in moodle_backup.xml, skipping activity insertion.")
+
+    def flush_new_files(self) -> None:
+        """Writes queued activity files now so they stop occupying memory.
+
+        Activity files are never rewritten by later additions, so flushing
+        them early keeps the write-once guarantee; moodle_backup.xml and
+        section.xml files still wait for commit(). Until then the flushed
+        files are staged: rollback() deletes them again.
+        """
+        with metrics.span("write"):
+            for rel in [rel for rel in self._new_files if rel.startswith("activities/")]:
+                self._write_new_file(rel, self._new_files.pop(rel))
+                self._flushed.append(rel)
+
+    def commit(self) -> None:
+        """Flushes all pending changes, writing each touched file once."""
+        with metrics.span("write"):
+            for rel, content in self._new_files.items():
+                self._write_new_file(rel, content)
+
+            for rel in self._dirty_sections:
+                buffer = io.BytesIO()
+                self._section_trees[rel].write(buffer, encoding="UTF-8", xml_declaration=True, short_empty_elements=False)
+                self._write_file(rel, buffer.getvalue())
+
+            if self._activity_blocks or self._section_blocks or self._settings_blocks:
+                self._write_manifest()
+                self._index = None
+
+            for rel, data in self._late_files.items():
+                self._write_file(rel, data)
+
+        self._remember_ids()
+
+        self._new_files = {}
+        self._dirty_sections = []
+        self._activity_blocks = []
+        self._section_blocks = []
+        self._settings_blocks = []
+        self._late_files = {}
+        self._flushed = []
+
+    def rollback(self) -> None:
+        """Discards pending changes and deletes the files flushed since the last commit."""
+        for rel in reversed(self._flushed):
+            self.workspace.remove(rel)
+        self._new_files = {}
+        self._section_trees = {}
+        self._dirty_sections = []
+        self._activity_blocks = []
+        self._section_blocks = []
+        self._settings_blocks = []
+        self._late_files = {}
+        self._flushed = []
+
+    def queue_file(self, rel: str, data: bytes) -> None:
+        """Queues rel to be replaced with data at the end of the next commit, after every other file."""
+        self._late_files[rel] = data
+
+
+class MemoryBackupSession(BackupSession):
+    """A BackupSession over a MemoryWorkspace built from files and dirs.
+
+    files maps member names (e.g. "sections/section_3/section.xml") to their
+    content and only needs to hold the metadata the session reads; dirs lists
+    the directories known to exist. Committed files are recorded in written,
+    in the order they were flushed.
+    """
+
+    def __init__(self, files: Dict[str, bytes], dirs: Iterable[str], allocator: IdAllocator, backup_name: Optional[str] = None):
+        super().__init__(MemoryWorkspace(files, dirs), backup_name=backup_name, allocator=allocator)
+
+    @property
+    def files(self) -> Dict[str, bytes]:
+        return self.workspace.files
+
+    @property
+    def written(self) -> Dict[str, bytes]:
+        return self.workspace.written
@@ -0,0 +1,108 @@
+"""Apply one bulk config to many .mbz archives in parallel."""
+
+import contextlib
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional
+from .bulk_plan import BulkPlan, apply_plan_to_tar, compile_plan
+from .exceptions import BackupError
+
+
+def expand_inputs(patterns: Iterable[str] = (), manifest: Optional[str] = None) -> List[str]:
+    """Resolves glob patterns and an optional manifest (one archive path per line) to archive paths.
+
+    Blank lines and lines starting with '#' in the manifest are ignored.
+    Duplicates are dropped, keeping the first occurrence.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    paths.append(line)
+    return list(dict.fromkeys(paths))
+
+
+def _bulk_add_one(input_tar: str, output_tar: str, plan: BulkPlan, streaming: bool, in_memory: bool, pipelined: bool) -> Dict:
+    """Worker entry point: applies the plan to one archive and reports its outcome instead of raising."""
+    start = time.perf_counter()
+    result = {"input": input_tar, "output": output_tar, "status": "ok", "error": None}
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            apply_plan_to_tar(plan, input_tar, output_tar, streaming=streaming, in_memory=in_memory, pipelined=pipelined)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def check_outputs(input_tars: List[str], outputs: List[str]) -> None:
+    """Raises BackupError if two archives would be written to the same output, or one over its own input."""
+    claimed = {}
+    for input_tar, output_tar in zip(input_tars, outputs):
+        key = os.path.normcase(os.path.realpath(output_tar))
+        if key in claimed:
+            raise BackupError(f"'{input_tar}' and '{claimed[key]}' would both be written to '{output_tar}'.")
+        claimed[key] = input_tar
+        if key == os.path.normcase(os.path.realpath(input_tar)) or (os.path.exists(output_tar) and os.path.samefile(input_tar, output_tar)):
+            raise BackupError(f"'{input_tar}' would be overwritten by its own output; choose another --output_dir.")
+
+
+def _run_isolated(input_tar: str, output_tar: str, plan: BulkPlan, streaming: bool, in_memory: bool, pipelined: bool) -> Dict:
+    """Runs one archive in a pool of its own, so a worker crash is attributed to that archive alone."""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(_bulk_add_one, input_tar, output_tar, plan, streaming, in_memory, pipelined).result()
+        except BrokenProcessPool as e:
+            # The worker process itself died (e.g. killed or out of memory).
+            return {"input": input_tar, "output": output_tar, "status": "error", "error": f"{type(e).__name__}: {e}", "seconds": None}
+
+
+def bulk_add_many(config_file: str, input_tars: Iterable[str], output_dir: str, workers: Optional[int] = None, streaming: bool = False, in_memory: bool = False, pipelined: bool = False) -> List[Dict]:
+    """Applies config_file to every archive in input_tars on a process pool.
+
+    The config is compiled once into a BulkPlan of pre-rendered fragments, so
+    each worker only allocates IDs, fills them in and writes the result.
+    Each result is written to output_dir under the input's file name; inputs
+    whose outputs would collide, or land on an input, are rejected with
+    BackupError before anything runs. Returns one result dict per archive
+    (input, output, status, error, seconds), in input order. A failing
+    archive is recorded as an error and does not stop the rest of the batch.
+    If a worker process dies, the pool is unusable for every archive still
+    pending, so each of those is rerun in a pool of its own.
+    """
+    input_tars = list(input_tars)
+    outputs = [os.path.join(output_dir, os.path.basename(path)) for path in input_tars]
+    check_outputs(input_tars, outputs)
+    plan = compile_plan(config_file)
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_bulk_add_one, input_tar, output_tar, plan, streaming, in_memory, pipelined)
+            for input_tar, output_tar in zip(input_tars, outputs)
+        ]
+        for input_tar, output_tar, future in zip(input_tars, outputs, futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                result = _run_isolated(input_tar, output_tar, plan, streaming, in_memory, pipelined)
+            except Exception as e:
+                result = {"input": input_tar, "output": output_tar, "status": "error", "error": f"{type(e).__name__}: {e}", "seconds": None}
+            results.append(result)
+            seconds = f"{result['seconds']:.2f}s" if result["seconds"] is not None else "-"
+            line = f"{result['status']:<5} {seconds:>9}  {input_tar} -> {output_tar}"
+            if result["error"]:
+                line += f"  ({result['error']})"
+            print(line)
+    return results
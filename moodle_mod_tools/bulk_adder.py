@@ -1,51 +1,192 @@
 """Bulk adder module for Moodle backups."""
 
 import json
-from .section_adder import add_section_to_backup
-from .page_adder import add_page_to_backup
+import os
+from typing import Iterable, Iterator, Optional
+from . import metrics
+from .applied_log import AppliedLog, EntryKeys
+from .backup_session import BackupSession, PageText
+from .exceptions import BackupError
+from .streamed_content import ContentFile
+from .tree_clone import clone_tree
+
+
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
 
 
 def bulk_add_from_tar(
     input_tar: str,
     output_tar: str,
-    config_file: str
+    config_file: str,
+    streaming: bool = False,
+    in_memory: bool = False,
+    pipelined: bool = False
 ) -> None:
+    """Applies a bulk config to a .mbz archive, writing the result to output_tar.
+
+    With streaming=True the archive is rewritten member by member; with
+    pipelined=True it is decompressed and recompressed concurrently in a
+    single pass (see pipeline.with_pipelined_tar); with in_memory=True it is
+    loaded into a MemoryWorkspace (see mbz_packager.with_memory_tar);
+    otherwise only its metadata is extracted to a temporary directory.
+    """
+    if pipelined:
+        from .pipeline import with_pipelined_tar
+        with with_pipelined_tar(input_tar, output_tar, backup_name=os.path.basename(output_tar)) as session, metrics.span("bulk_add"):
+            apply_bulk_records(session, iter_config_records(config_file))
+        return
+
+    if in_memory:
+        from .mbz_packager import with_memory_tar
+        with with_memory_tar(input_tar, output_tar) as workspace:
+            with BackupSession(workspace, backup_name=os.path.basename(output_tar)) as session, metrics.span("bulk_add"):
+                apply_bulk_records(session, iter_config_records(config_file))
+        return
+
+    if streaming:
+        from .mbz_packager import with_streamed_tar
+        with with_streamed_tar(input_tar, output_tar, backup_name=os.path.basename(output_tar)) as session, metrics.span("bulk_add"):
+            apply_bulk_records(session, iter_config_records(config_file))
+        return
+
     from .mbz_packager import with_extracted_tar
-    with with_extracted_tar(input_tar, output_tar) as extracted_dir:
+    with with_extracted_tar(input_tar, output_tar, lazy=True) as extracted_dir:
         bulk_add_from_json(
             input_backup=extracted_dir,
             output_backup=extracted_dir,
-            config_file=config_file
+            config_file=config_file,
+            backup_name=os.path.basename(output_tar)
         )
 
-def bulk_add_from_json(input_backup, output_backup, config_file):
-    """Adds sections/pages in bulk from a JSON config."""
+def bulk_add_from_json(input_backup, output_backup, config_file, copy_mode="auto", checkpoint_every=None, backup_name=None):
+    """Adds sections/pages in bulk from a JSON or JSONL config.
+
+    All additions go through a single BackupSession, so moodle_backup.xml and
+    each touched section.xml are parsed and written once per run. See
+    iter_config_records for the accepted config formats. A missing
+    output_backup is cloned from input_backup; see tree_clone.clone_tree.
+    Entries already applied to output_backup by an earlier run are skipped;
+    see apply_bulk_records for this and for checkpoint_every. backup_name is
+    the archive name recorded in moodle_backup.xml when sections are added;
+    it defaults to output_backup's directory name plus ".mbz".
+    """
+    records = iter_config_records(config_file)
+
+    if not os.path.exists(output_backup):
+        with metrics.span("copy"):
+            clone_tree(input_backup, output_backup, copy_mode)
+
+    if backup_name is None:
+        backup_name = os.path.basename(output_backup) + ".mbz"
+    with metrics.span("bulk_add"), BackupSession(output_backup, backup_name=backup_name) as session:
+        apply_bulk_records(session, records, checkpoint_every=checkpoint_every)
+
+
+def iter_config_records(config_file: str) -> Iterator[dict]:
+    """Yields bulk config records one at a time.
+
+    A .jsonl/.ndjson file holds one record per line and is read lazily, so
+    memory is bounded by the largest record. A record is a section
+    ({"section_name": ..., "section_id": ..., "pages": [...]}) or a page
+    ({"page_title": ..., "page_description": ..., "page_content": ...}),
+    optionally tagged with "type": "section" or "page". Page records go into
+    their "section_id" if given, otherwise into the last section record.
+    A page may give "page_content_file" / "page_description_file" (paths
+    relative to the working directory) instead; those files are streamed
+    into page.xml rather than loaded. Both forms are XML-escaped.
+
+    Any other file is the original JSON list of sections with nested pages,
+    yielded one section at a time after json.load.
+    """
+    if config_file.endswith(JSONL_SUFFIXES):
+        with open(config_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise BackupError(f"{config_file}:{line_number}: invalid JSON record: {e}")
+        return
+
     with open(config_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
+    yield from data
 
-    for section in data:
-        section_name = section.get('section_name')
-        section_id = section.get('section_id')
 
-        # If no explicit section_id, create a new section by passing None
-        created_section_id = add_section_to_backup(
-            input_backup=input_backup,
-            output_backup=output_backup,
-            section_name=section_name,
-            section_id=section_id
-        )
-        
-        # Fall back to the newly created ID if original was None
-        if not section_id:
-            section_id = created_section_id
-
-        # Add pages
-        for page in section.get('pages', []):
-            add_page_to_backup(
-                extracted_backup_dir=output_backup,
-                section_id=str(section_id),
-                page_title=page.get('page_title', 'Untitled Page'),
-                page_description=page.get('page_description', ''),
-                page_content=page.get('page_content', ''),
-                output_dir=None
-            )
+def apply_bulk_records(session: BackupSession, records: Iterable[dict], idempotent: bool = True, checkpoint_every: Optional[int] = None) -> None:
+    """Queues section and page records on session as they arrive.
+
+    New activity files are flushed after every record, so only the manifest
+    and section.xml changes are held until the session commits. If a record
+    fails, the session's rollback deletes the files flushed since its last
+    commit, so the backup is left as it was at that commit.
+
+    With idempotent=True, every applied section and page is recorded in the
+    backup's AppliedLog, and entries already recorded there are skipped, so
+    re-running a config (or an extended one) applies only new or changed
+    entries. With checkpoint_every=n the session also commits after every n
+    records, so work done before a failure is kept and skipped on the re-run.
+    """
+    log = AppliedLog.load(session) if idempotent else None
+    keys = EntryKeys()
+    current_section_id = None
+    current_parent = None
+    for count, record in enumerate(records, 1):
+        kind = record.get('type') or ('section' if 'section_name' in record else 'page')
+        if kind == 'page':
+            section_id = record.get('section_id', current_section_id)
+            if section_id is None:
+                raise BackupError(f"page '{record.get('page_title')}' has no section_id and follows no section record.")
+            parent = f"id:{record['section_id']}" if 'section_id' in record else current_parent
+            _add_page_record(session, section_id, record, log, keys.key(record, parent))
+        else:
+            section_name = record.get('section_name')
+            section_id = record.get('section_id')
+            key = keys.key(record, "")
+
+            created_section_id = log.get(key) if log is not None else None
+            if created_section_id is None:
+                # If no explicit section_id, create a new section by passing None
+                created_section_id = session.add_section(section_name, section_id)
+                if log is not None:
+                    log.record(key, "section", created_section_id)
+
+            # Fall back to the newly created ID if original was None
+            if not section_id:
+                section_id = created_section_id
+            current_section_id = section_id
+            current_parent = key
+
+            # Add pages
+            for page in record.get('pages', []):
+                _add_page_record(session, section_id, page, log, keys.key(page, key))
+        session.flush_new_files()
+        if checkpoint_every and count % checkpoint_every == 0:
+            if log is not None:
+                log.save(session)
+            session.commit()
+    if log is not None:
+        log.save(session)
+
+
+def page_text(page: dict, field: str, default: str = '') -> PageText:
+    """A page record's description or content: a ContentFile if it names "<field>_file", else the "<field>" string."""
+    path = page.get(f'{field}_file')
+    if path is not None:
+        return ContentFile(path)
+    return page.get(field, default)
+
+
+def _add_page_record(session: BackupSession, section_id, page: dict, log: Optional[AppliedLog] = None, key: Optional[str] = None) -> None:
+    if log is not None and log.get(key) is not None:
+        return
+    module_id = session.add_page(
+        section_id=str(section_id),
+        page_title=page.get('page_title', 'Untitled Page'),
+        page_description=page_text(page, 'page_description'),
+        page_content=page_text(page, 'page_content')
+    )
+    if log is not None:
+        log.record(key, "page", module_id)
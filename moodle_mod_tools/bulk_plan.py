@@ -0,0 +1,196 @@
+"""Bulk configs compiled once into pre-rendered XML fragments and applied to many backups."""
+
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from . import metrics
+from .applied_log import AppliedLog, EntryKeys
+from .backup_session import BackupSession, render_page, render_section
+from .bulk_adder import iter_config_records, page_text
+from .exceptions import BackupError
+from .streamed_content import StreamedText
+
+
+# Renders never contain NUL, so "\0name\0" marks a slot filled in when the plan is applied.
+_SLOT = "\0"
+
+# (text, is_template): a template is filled with "%" formatting, anything else is used as is.
+Fragment = Tuple[Union[str, StreamedText], bool]
+
+
+def _slot(name: str) -> str:
+    return f"{_SLOT}{name}{_SLOT}"
+
+
+def _template(text: str) -> str:
+    """Turns slots into %(name)s fields so filling is a single C-level format."""
+    return "".join(f"%({part})s" if i % 2 else part.replace("%", "%%") for i, part in enumerate(text.split(_SLOT)))
+
+
+def _compile(text: Union[str, StreamedText]) -> Fragment:
+    if isinstance(text, StreamedText):
+        # StreamedText supports "%" too, filling its literal parts.
+        return text.map_text(_template), True
+    if _SLOT not in text:
+        return text, False
+    return _template(text), True
+
+
+def _fill(fragment: Fragment, values: Dict[str, str]) -> str:
+    text, is_template = fragment
+    return text % values if is_template else text
+
+
+class BulkPlan:
+    """A bulk config rendered once, with slots for the IDs each backup assigns.
+
+    records holds one list of steps per config record. A step is
+    ("section", name, files, section_block, settings_block, key) or
+    ("page", target, title, files, activity_block, key), where files is a
+    list of (path fragment, content fragment) pairs and key is the entry's
+    AppliedLog key. A page target is
+    ("id", section_id) for an existing section or ("step", n) for the section
+    created by the n-th step overall. The plan is plain data, so it can be
+    pickled to worker processes.
+    """
+
+    def __init__(self, records: List[List[tuple]]):
+        self.records = records
+
+    @classmethod
+    def compile(cls, records: Iterable[dict]) -> "BulkPlan":
+        """Compiles bulk config records with the same semantics as apply_bulk_records."""
+        compiled = []
+        count = 0
+        current = None
+        current_parent = None
+        keys = EntryKeys()
+        with metrics.span("plan.compile"):
+            for record in records:
+                steps = []
+                kind = record.get('type') or ('section' if 'section_name' in record else 'page')
+                if kind == 'page':
+                    section_id = record.get('section_id')
+                    target = ("id", str(section_id)) if section_id is not None else current
+                    if target is None:
+                        raise BackupError(f"page '{record.get('page_title')}' has no section_id and follows no section record.")
+                    parent = f"id:{record['section_id']}" if 'section_id' in record else current_parent
+                    steps.append(cls._page_step(target, record, keys.key(record, parent)))
+                else:
+                    section_name = record.get('section_name')
+                    key = keys.key(record, "")
+                    files, section_block, settings_block = render_section(_slot("section_id"), _slot("section_number"), section_name, _slot("now"))
+                    steps.append(("section", section_name, _compile_files(files), _compile(section_block), _compile(settings_block), key))
+                    # As in apply_bulk_records, an explicit section_id still receives the pages.
+                    section_id = record.get('section_id')
+                    current = ("id", str(section_id)) if section_id else ("step", count)
+                    current_parent = key
+                    for page in record.get('pages', []):
+                        steps.append(cls._page_step(current, page, keys.key(page, key)))
+                compiled.append(steps)
+                count += len(steps)
+        return cls(compiled)
+
+    @staticmethod
+    def _page_step(target: Tuple[str, object], page: dict, key: str) -> tuple:
+        title = page.get('page_title', 'Untitled Page')
+        files, activity_block = render_page(
+            _slot("module_id"), _slot("cm_id"), _slot("context_id"), _slot("section_id"),
+            title, page_text(page, 'page_description'), page_text(page, 'page_content')
+        )
+        return ("page", target, title, _compile_files(files), _compile(activity_block), key)
+
+    def apply(self, session: BackupSession, idempotent: bool = True) -> List[int]:
+        """Allocates IDs on session and queues every step. Returns the IDs created, in step order.
+
+        With idempotent=True, steps already recorded in the backup's
+        AppliedLog are skipped (their recorded IDs are returned) and the rest
+        are recorded, as in apply_bulk_records.
+        """
+        created: List[int] = []
+        log = AppliedLog.load(session) if idempotent else None
+        with metrics.span("plan.apply"):
+            for steps in self.records:
+                self._apply_steps(session, steps, created, log)
+                session.flush_new_files()
+        if log is not None:
+            log.save(session)
+        return created
+
+    @staticmethod
+    def _apply_steps(session: BackupSession, steps: List[tuple], created: List[int], log: Optional[AppliedLog]) -> None:
+        for step in steps:
+            key = step[-1]
+            applied_id = log.get(key) if log is not None else None
+            if applied_id is not None:
+                created.append(applied_id)
+                continue
+            if step[0] == "section":
+                _, name, files, section_block, settings_block, _ = step
+                new_id = session.ids.next_section_id()
+                values = {"section_id": str(new_id), "section_number": str(new_id - 8), "now": str(int(time.time()))}
+                session.queue_section(new_id, name, _fill_files(files, values), _fill(section_block, values), _fill(settings_block, values))
+                created.append(new_id)
+            else:
+                _, target, title, files, activity_block, _ = step
+                section_id = target[1] if target[0] == "id" else str(created[target[1]])
+                module_id = session.ids.next_module_id()
+                cm_id = session.ids.next_module_id()
+                context_id = session.ids.next_context_id()
+                values = {"module_id": str(module_id), "cm_id": str(cm_id), "context_id": str(context_id), "section_id": section_id}
+                session.queue_page(section_id, module_id, title, _fill_files(files, values), _fill(activity_block, values))
+                created.append(module_id)
+            if log is not None:
+                log.record(key, step[0], created[-1])
+
+
+def _compile_files(files: Dict[str, Union[str, StreamedText]]) -> List[Tuple[Fragment, Fragment]]:
+    return [(_compile(rel), _compile(content)) for rel, content in files.items()]
+
+
+def _fill_files(files: List[Tuple[Fragment, Fragment]], values: Dict[str, str]) -> Dict[str, str]:
+    # _fill inlined: this runs for every file of every page of every backup.
+    return {
+        (rel if not rel_is_template else rel % values): (content if not content_is_template else content % values)
+        for (rel, rel_is_template), (content, content_is_template) in files
+    }
+
+
+def compile_plan(config_file: str) -> BulkPlan:
+    """Compiles a JSON or JSONL bulk config (see iter_config_records) into a BulkPlan."""
+    return BulkPlan.compile(iter_config_records(config_file))
+
+
+def apply_plan_to_tar(plan: BulkPlan, input_tar: str, output_tar: str, streaming: bool = False, in_memory: bool = False, pipelined: bool = False) -> None:
+    """Applies plan to a .mbz archive, writing the result to output_tar; see bulk_add_from_tar."""
+    if pipelined:
+        from .pipeline import with_pipelined_tar
+        with with_pipelined_tar(input_tar, output_tar, backup_name=os.path.basename(output_tar)) as session:
+            plan.apply(session)
+        return
+
+    if in_memory:
+        from .mbz_packager import with_memory_tar
+        with with_memory_tar(input_tar, output_tar) as workspace:
+            with BackupSession(workspace, backup_name=os.path.basename(output_tar)) as session:
+                plan.apply(session)
+        return
+
+    if streaming:
+        from .mbz_packager import with_streamed_tar
+        with with_streamed_tar(input_tar, output_tar, backup_name=os.path.basename(output_tar)) as session:
+            plan.apply(session)
+        return
+
+    from .mbz_packager import with_extracted_tar
+    with with_extracted_tar(input_tar, output_tar, lazy=True) as extracted_dir:
+        with BackupSession(extracted_dir, backup_name=os.path.basename(output_tar)) as session:
+            plan.apply(session)
+
+
+def apply_plan_to_dir(plan: BulkPlan, backup_dir: str, backup_name: Optional[str] = None) -> None:
+    """Applies plan to an extracted backup in place."""
+    if backup_name is None:
+        backup_name = os.path.basename(os.path.normpath(backup_dir)) + ".mbz"
+    with BackupSession(backup_dir, backup_name=backup_name) as session:
+        plan.apply(session)
@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 """CLI tool to unify all moodle_mod_tools functionality"""
 import argparse
+import json
+import os
 import sys
+from . import metrics
+from .exceptions import BackupError
+from .bulk_adder import page_text
 from .page_adder import add_page_to_backup
 from .section_adder import add_section_to_backup
+from .tree_clone import COPY_MODES
 
 def main():
     parser = argparse.ArgumentParser(description="CLI for Moodle mod tools")
+    parser.add_argument("--metrics-json", dest="metrics_json", default=None, help="Write per-stage timings and counters to this JSON file")
+    parser.add_argument("--profile", action="store_true", help="Print per-stage timings and counters to stderr")
+    parser.add_argument("--daemon", default=None, metavar="URL", help="Send add-page, add-section, package-mbz, commit and section lookups to a running daemon (e.g. http://127.0.0.1:8765)")
+    parser.add_argument("--daemon_token_file", default=None, help="File holding the daemon's token (default: the one 'serve' writes for the port in --daemon)")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Subcommand adding page
@@ -14,9 +24,12 @@ def main():
     parser_page.add_argument("extracted_backup_dir")
     parser_page.add_argument("section_id")
     parser_page.add_argument("page_title")
-    parser_page.add_argument("--page_description", default="Placeholder description")
-    parser_page.add_argument("--page_content", default="Placeholder content")
+    parser_page.add_argument("--page_description", default="Placeholder description", help="Description HTML (XML-escaped into page.xml)")
+    parser_page.add_argument("--page_content", default="Placeholder content", help="Content HTML (XML-escaped into page.xml)")
+    parser_page.add_argument("--page_description_file", default=None, help="Read the description from this file (escaped and streamed into page.xml)")
+    parser_page.add_argument("--page_content_file", default=None, help="Read the content from this file (escaped and streamed into page.xml)")
     parser_page.add_argument("--output_dir", default=None)
+    parser_page.add_argument("--copy_mode", choices=COPY_MODES, default="auto", help="How --output_dir is cloned from the input: reflinks, hardlinks or plain copies (auto picks the cheapest that works)")
 
     # Subcommand adding section
     parser_section = subparsers.add_parser("add-section", help="Add a new section")
@@ -24,54 +37,231 @@ def main():
     parser_section.add_argument("--output", required=True)
     parser_section.add_argument("--section_name", required=True)
     parser_section.add_argument("--section_id", type=int, default=None)
+    parser_section.add_argument("--copy_mode", choices=COPY_MODES, default="auto", help="How a missing --output is cloned from --input")
 
     # Subcommand packaging MBZ
     parser_package = subparsers.add_parser("package-mbz", help="Package directory into MBZ archive")
     parser_package.add_argument("source_dir", help="Directory to package")
     parser_package.add_argument("output_file", help="Desired .mbz archive file name")
+    parser_package.add_argument("--threads", type=int, default=None, help="Compress on this many threads (0 = one per CPU)")
+    parser_package.add_argument("--compresslevel", type=int, default=9, help="gzip compression level (1-9)")
+    parser_package.add_argument("--block_cache", default=None, help="Reuse compressed members cached in this directory from earlier runs")
+    parser_package.add_argument("--verify", action="store_true", help="Check the backup with 'verify' first and refuse to package it if that fails")
+    parser_package.add_argument("--format", choices=("tar", "zip"), default="tar", help="Archive format; Moodle restores both, and a ZIP can later be updated in place")
 
     # Subcommand depackaging MBZ
     parser_depackage = subparsers.add_parser("depackage-mbz", help="Extract MBZ archive into directory")
     parser_depackage.add_argument("archive_path", help="Path to the .mbz archive")
     parser_depackage.add_argument("output_dir", help="Directory to extract the archive into")
+    parser_depackage.add_argument("--threads", type=int, default=None, help="Write files on this many threads (0 = one per CPU)")
+    parser_depackage.add_argument("--queue_depth", type=int, default=64, help="Most files waiting to be written with --threads")
+    parser_depackage.add_argument("--memory_cap", type=int, default=64, help="Most MiB of file content waiting to be written with --threads")
 
     # Subcommand bulk add
     parser_bulk_add = subparsers.add_parser("bulk-add", help="Bulk add sections and pages from config")
     parser_bulk_add.add_argument("--input_tar", required=True, help="Input tar archive")
     parser_bulk_add.add_argument("--output_tar", required=True, help="Output tar archive")
     parser_bulk_add.add_argument("--config_file", required=True, help="JSON configuration file for bulk adding")
+    parser_bulk_add.add_argument("--streaming", action="store_true", help="Rewrite the archive member by member instead of extracting it")
+    parser_bulk_add.add_argument("--pipelined", action="store_true", help="Decompress and recompress concurrently in one pass, appending the edited metadata last")
+    parser_bulk_add.add_argument("--in_memory", action="store_true", help="Load the archive into memory instead of a temporary directory (spills to disk above 50 MiB)")
+
+    # Subcommand bulk add over many archives
+    parser_bulk_many = subparsers.add_parser("bulk-add-many", help="Apply one bulk config to many archives in parallel")
+    parser_bulk_many.add_argument("inputs", nargs="*", help="Input archives or glob patterns")
+    parser_bulk_many.add_argument("--manifest", default=None, help="File listing input archives, one per line")
+    parser_bulk_many.add_argument("--output_dir", required=True, help="Directory for the output archives")
+    parser_bulk_many.add_argument("--config_file", required=True, help="JSON configuration file for bulk adding")
+    parser_bulk_many.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser_bulk_many.add_argument("--streaming", action="store_true", help="Rewrite each archive member by member instead of extracting it")
+    parser_bulk_many.add_argument("--pipelined", action="store_true", help="Decompress and recompress each archive concurrently in one pass")
+    parser_bulk_many.add_argument("--in_memory", action="store_true", help="Load each archive into memory instead of a temporary directory (spills to disk above 50 MiB)")
+    parser_bulk_many.add_argument("--report_json", default=None, help="Write per-archive results to this JSON file")
+
+    # Subcommand inspecting an archive
+    parser_inspect = subparsers.add_parser("inspect-mbz", help="List sections, activities and settings without extracting")
+    parser_inspect.add_argument("path", help="Path to the .mbz archive or an extracted backup directory")
+    parser_inspect.add_argument("--section_name", default=None, help="Print only the ID of the section with this title (-1 if absent)")
+    parser_inspect.add_argument("--json", action="store_true", help="Print the parsed manifest as JSON")
+
+    # Subcommand verifying a backup
+    parser_verify = subparsers.add_parser("verify", help="Cross-check manifest, section sequences and module.xml files")
+    parser_verify.add_argument("path", help="Path to the .mbz archive or an extracted backup directory")
+
+    # Subcommand running a script of operations
+    parser_script = subparsers.add_parser("run-script", help="Run a file of mixed operations against one backup in one process")
+    parser_script.add_argument("input", help="Input .mbz archive or extracted backup directory (edited in place)")
+    parser_script.add_argument("script_file", help="JSON or JSONL file of operations")
+    parser_script.add_argument("--output", default=None, help="Package the result into this .mbz after the last operation")
+
+    # Subcommand running the daemon
+    parser_serve = subparsers.add_parser("serve", help="Keep backups open in a local daemon for fast repeated edits")
+    parser_serve.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser_serve.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser_serve.add_argument("--token_file", default=None, help="Write the request token here (default: ~/.moodle_mod_tools/daemon-PORT.token)")
+
+    # Subcommand writing back a backup held by the daemon
+    parser_commit = subparsers.add_parser("commit", help="With --daemon, write the daemon's pending changes back to a backup it holds open")
+    parser_commit.add_argument("path", help="The .mbz archive (repacked in place) or extracted backup directory")
 
     args = parser.parse_args()
+    if args.metrics_json or args.profile:
+        metrics.enable()
+    try:
+        if args.daemon and args.command in DAEMON_COMMANDS:
+            run_daemon_command(args)
+        else:
+            run_command(args)
+    except BackupError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.profile:
+            print(metrics.format_report(), file=sys.stderr)
+
+
+def run_command(args) -> None:
     if args.command == "add-page":
         add_page_to_backup(
             extracted_backup_dir=args.extracted_backup_dir,
             section_id=args.section_id,
             page_title=args.page_title,
-            page_description=args.page_description,
-            page_content=args.page_content,
-            output_dir=args.output_dir
+            page_description=page_text(vars(args), "page_description"),
+            page_content=page_text(vars(args), "page_content"),
+            output_dir=args.output_dir,
+            copy_mode=args.copy_mode
         )
     elif args.command == "add-section":
         add_section_to_backup(
             input_backup=args.input,
             output_backup=args.output,
             section_name=args.section_name,
-            section_id=args.section_id
+            section_id=args.section_id,
+            copy_mode=args.copy_mode
         )
     elif args.command == "package-mbz":
         from .mbz_packager import package_mbz
-        package_mbz(args.source_dir, args.output_file)
+        package_mbz(args.source_dir, args.output_file, threads=args.threads, compresslevel=args.compresslevel, block_cache=args.block_cache, verify=args.verify, format=args.format)
     elif args.command == "depackage-mbz":
         from .mbz_packager import decompress_mbz
-        decompress_mbz(args.archive_path, args.output_dir)
+        decompress_mbz(args.archive_path, args.output_dir, threads=args.threads, queue_depth=args.queue_depth, memory_cap=args.memory_cap << 20)
     elif args.command == "bulk-add":
         from .bulk_adder import bulk_add_from_tar
         bulk_add_from_tar(
             input_tar=args.input_tar,
             output_tar=args.output_tar,
-            config_file=args.config_file
+            config_file=args.config_file,
+            streaming=args.streaming,
+            in_memory=args.in_memory,
+            pipelined=args.pipelined
         )
-    
+    elif args.command == "inspect-mbz":
+        from .inspector import find_section_ids, inspect_mbz
+        manifest = inspect_mbz(args.path)
+        if args.section_name is not None:
+            matches = find_section_ids(manifest, args.section_name)
+            print(matches[0] if matches else -1)
+        elif args.json:
+            print(json.dumps(manifest, indent=2))
+        else:
+            print_manifest_summary(manifest)
+    elif args.command == "bulk-add-many":
+        from .batch_runner import bulk_add_many, expand_inputs
+        input_tars = expand_inputs(args.inputs, args.manifest)
+        results = bulk_add_many(
+            config_file=args.config_file,
+            input_tars=input_tars,
+            output_dir=args.output_dir,
+            workers=args.workers,
+            streaming=args.streaming,
+            in_memory=args.in_memory,
+            pipelined=args.pipelined
+        )
+        if args.report_json:
+            with open(args.report_json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        failed = sum(1 for result in results if result["status"] != "ok")
+        print(f"{len(results) - failed} succeeded, {failed} failed")
+        if failed:
+            sys.exit(1)
+    elif args.command == "verify":
+        from .verifier import verify_backup
+        problems = verify_backup(args.path)
+        for problem in problems:
+            print(problem)
+        if problems:
+            print(f"{len(problems)} problem(s) found in '{args.path}'.")
+            sys.exit(1)
+        print(f"'{args.path}' is consistent.")
+    elif args.command == "run-script":
+        from .script_runner import run_script
+        run_script(args.input, args.script_file, output_file=args.output)
+    elif args.command == "serve":
+        from .daemon import serve
+        serve(args.host, args.port, args.token_file)
+    elif args.command == "commit":
+        raise BackupError("commit needs --daemon; without it every command writes its changes immediately.")
+
+
+DAEMON_COMMANDS = ("add-page", "add-section", "package-mbz", "inspect-mbz", "commit")
+
+
+def run_daemon_command(args) -> None:
+    """Runs a subcommand as a thin client of the daemon at args.daemon.
+
+    The daemon edits the backup it holds open, so commands that would copy
+    the backup to a separate output are refused. Changes reach disk when the
+    commit subcommand writes them back to the backup, when package-mbz
+    writes an archive, or when the daemon stops.
+    """
+    from .daemon import daemon_request
+    if args.command == "add-page":
+        if args.output_dir:
+            raise BackupError("--output_dir is not supported with --daemon.")
+        reply = daemon_request(args.daemon, "add-page", {
+            "path": os.path.abspath(args.extracted_backup_dir),
+            "section_id": args.section_id,
+            "page_title": args.page_title,
+            "page_description": args.page_description,
+            "page_content": args.page_content,
+            "page_description_file": args.page_description_file and os.path.abspath(args.page_description_file),
+            "page_content_file": args.page_content_file and os.path.abspath(args.page_content_file),
+        }, args.daemon_token_file)
+        print(reply["output"], end="")
+    elif args.command == "add-section":
+        if args.output != args.input:
+            raise BackupError("--output must equal --input with --daemon.")
+        reply = daemon_request(args.daemon, "add-section", {
+            "path": os.path.abspath(args.input),
+            "section_name": args.section_name,
+            "section_id": args.section_id,
+        }, args.daemon_token_file)
+        print(reply["output"], end="")
+    elif args.command == "package-mbz":
+        daemon_request(args.daemon, "package", {"path": os.path.abspath(args.source_dir), "output": os.path.abspath(args.output_file), "verify": args.verify, "format": args.format}, args.daemon_token_file)
+    elif args.command == "inspect-mbz":
+        if args.section_name is None:
+            run_command(args)
+            return
+        reply = daemon_request(args.daemon, "lookup", {"path": os.path.abspath(args.path), "section_name": args.section_name}, args.daemon_token_file)
+        print(reply["section_id"])
+    elif args.command == "commit":
+        daemon_request(args.daemon, "commit", {"path": os.path.abspath(args.path)}, args.daemon_token_file)
+
+
+def print_manifest_summary(manifest: dict) -> None:
+    information = manifest["information"]
+    print(f"Backup: {information.get('name', '?')} (Moodle {information.get('moodle_version', '?')})")
+    print(f"Sections ({len(manifest['sections'])}):")
+    for section in manifest["sections"]:
+        print(f"  {section.get('sectionid', ''):>6}  {section.get('title', '')}  ({section.get('directory', '')})")
+    print(f"Activities ({len(manifest['activities'])}):")
+    for activity in manifest["activities"]:
+        print(f"  {activity.get('moduleid', ''):>6}  {activity.get('modulename', ''):<10} section {activity.get('sectionid', ''):<6} {activity.get('title', '')}")
+    print(f"Settings: {len(manifest['settings'])}")
+
 
 if __name__ == "__main__":
     main()
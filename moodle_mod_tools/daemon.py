@@ -0,0 +1,305 @@
+"""Long-running local server that keeps backup workspaces extracted and parsed between commands.
+
+The server speaks JSON over HTTP on localhost. Every request is a POST to
+/<command> with a JSON object body and Content-Type: application/json;
+responses are JSON objects, with an "error" key and a 4xx or 5xx status when
+the command fails. Commands:
+
+    open         {"path"}                              open a .mbz or extracted directory
+    add-page     {"path", "section_id", "page_title", "page_description", "page_content",
+                  "page_description_file", "page_content_file"}
+    add-section  {"path", "section_name", "section_id"}
+    lookup       {"path", "section_name"}              section ID by title, or -1
+    commit       {"path"}                              write pending changes back to the backup itself
+    package      {"path", "output", "verify", "format"}
+                                                       commit, optionally verify, and write a .mbz
+    close        {"path", "discard"}                   commit unless discard is true, then release it
+    shutdown     {}                                    close every backup and stop
+
+Commands that take "path" open the workspace on first use. Changes made
+since the last commit or package are never dropped silently: close and
+shutdown (or Ctrl-C) commit them, writing a directory's files or repacking
+an archive in place, unless close is sent with "discard": true.
+
+The server binds to 127.0.0.1 by default. Each run generates a random
+token, written to a file only the current user can read (token_path), and
+every request must carry it as "Authorization: Bearer <token>". Requests
+with an Origin header are refused, so a web page cannot drive the daemon
+from a browser.
+"""
+
+import contextlib
+import hmac
+import io
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from .backup_session import BackupSession
+from .bulk_adder import page_text
+from .exceptions import BackupError
+from .mbz_packager import LazyExtractedDir, extract_metadata, package_mbz, repack_lazy
+from .verifier import check_backup
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def token_path(port: int) -> str:
+    """Default file holding the token of the daemon listening on port."""
+    return os.path.join(os.path.expanduser("~"), ".moodle_mod_tools", f"daemon-{port}.token")
+
+
+def write_token(path: str) -> str:
+    """Writes a fresh random token to path, readable by the current user only, and returns it."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+    token = secrets.token_urlsafe(32)
+    # O_EXCL so the file is created here with mode 0600, never reused with looser permissions.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
+
+
+class OpenBackup:
+    """A backup held open by the daemon, with one long-lived BackupSession.
+
+    An archive is extracted lazily (metadata only) into a temporary
+    directory; a directory is edited in place. unsaved is True while changes
+    made since the last save() or package() exist only in the daemon.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.unsaved = False
+        self._temp_dir = None
+        if os.path.isdir(path):
+            self.backup_dir = path
+            backup_name = os.path.basename(os.path.normpath(path)) + ".mbz"
+        elif os.path.isfile(path):
+            self._temp_dir = tempfile.mkdtemp()
+            self.backup_dir = LazyExtractedDir(self._temp_dir, path, extract_metadata(path, self._temp_dir))
+            backup_name = os.path.basename(path)
+        else:
+            raise BackupError(f"'{path}' does not exist.")
+        self.session = BackupSession(self.backup_dir, backup_name=backup_name)
+
+    def save(self) -> None:
+        """Commits pending changes to the backup itself: into the directory, or by repacking the archive in place."""
+        self.session.commit()
+        if self._temp_dir is not None:
+            self._repack(self.path)
+        self.unsaved = False
+
+    def package(self, output: str, verify: bool = False, format: str = "tar") -> None:
+        self.session.commit()
+        if verify:
+            # A lazy workspace holds all of sections/ and activities/, which is all check_backup reads.
+            check_backup(self.backup_dir)
+        if self._temp_dir is not None:
+            # An archive keeps its own format; format only applies to directories.
+            self._repack(output)
+        else:
+            package_mbz(self.backup_dir, output, format=format)
+        self.unsaved = False
+
+    def _repack(self, output: str) -> None:
+        # repack_lazy writes through a temporary file, so output may be the open archive.
+        repack_lazy(self.backup_dir, output)
+        if os.path.samefile(output, self.path):
+            # The archive now holds the files created so far; the workspace
+            # copies must still win over those members in the next repack.
+            for root, dirs, files in os.walk(self.backup_dir):
+                for entry in dirs + files:
+                    self.backup_dir.materialized.add(os.path.relpath(os.path.join(root, entry), self.backup_dir).replace(os.sep, "/"))
+
+    def close(self, discard: bool = False) -> None:
+        """Saves unsaved changes unless discard is True, then removes any temporary workspace."""
+        try:
+            if self.unsaved and not discard:
+                self.save()
+        finally:
+            self._cleanup()
+
+    def _cleanup(self) -> None:
+        if self._temp_dir is not None:
+            self.backup_dir.close()
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+
+class BackupDaemon:
+    """Dispatches daemon commands against open backups. Commands run one at a time."""
+
+    def __init__(self):
+        self.backups: Dict[str, OpenBackup] = {}
+        self.lock = threading.Lock()
+
+    def _backup(self, payload: dict) -> OpenBackup:
+        path = payload.get("path")
+        if not path:
+            raise BackupError("missing 'path'.")
+        key = os.path.realpath(path)
+        backup = self.backups.get(key)
+        if backup is None:
+            backup = OpenBackup(path)
+            self.backups[key] = backup
+        return backup
+
+    def handle(self, command: str, payload: dict) -> dict:
+        with self.lock, contextlib.redirect_stdout(io.StringIO()) as output:
+            result = self._dispatch(command, payload)
+        result["output"] = output.getvalue()
+        return result
+
+    def _dispatch(self, command: str, payload: dict) -> dict:
+        if command == "open":
+            return {"backup_dir": str(self._backup(payload).backup_dir)}
+        if command == "add-page":
+            backup = self._backup(payload)
+            page_id = backup.session.add_page(
+                str(payload["section_id"]),
+                payload["page_title"],
+                page_text(payload, "page_description", "Placeholder description"),
+                page_text(payload, "page_content", "Placeholder content"),
+            )
+            backup.unsaved = True
+            return {"page_id": page_id}
+        if command == "add-section":
+            backup = self._backup(payload)
+            section_id = backup.session.add_section(payload["section_name"], payload.get("section_id"))
+            backup.unsaved = True
+            return {"section_id": section_id}
+        if command == "lookup":
+            return {"section_id": self._backup(payload).session.find_section_id_by_name(payload["section_name"])}
+        if command == "commit":
+            self._backup(payload).save()
+            return {}
+        if command == "package":
+            self._backup(payload).package(payload["output"], bool(payload.get("verify")), payload.get("format", "tar"))
+            return {"output_file": payload["output"]}
+        if command == "close":
+            backup = self.backups.pop(os.path.realpath(payload.get("path", "")), None)
+            if backup is not None:
+                backup.close(bool(payload.get("discard")))
+            return {}
+        raise BackupError(f"unknown command '{command}'.")
+
+    def close_all(self) -> None:
+        """Closes every backup, saving unsaved changes; a failure is reported and the rest still close."""
+        with self.lock:
+            backups, self.backups = list(self.backups.values()), {}
+            for backup in backups:
+                try:
+                    backup.close()
+                except Exception as e:
+                    print(f"Error: could not save '{backup.path}': {e}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    daemon_state: BackupDaemon = None
+    token: str = None
+
+    def _refusal(self) -> Optional[Tuple[int, str]]:
+        """The status and message to refuse this request with, or None if it may run."""
+        if self.headers.get("Origin") is not None:
+            return 403, "requests from web pages are not accepted."
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            return 415, "Content-Type must be application/json."
+        authorization = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {self.token}".encode("utf-8")):
+            return 401, "missing or wrong daemon token."
+        return None
+
+    def do_POST(self):
+        command = self.path.strip("/")
+        refusal = self._refusal()
+        if refusal is not None:
+            self._reply(refusal[0], {"error": refusal[1]})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise BackupError("the request body must be a JSON object.")
+            if command == "shutdown":
+                self._reply(200, {})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            self._reply(200, self.daemon_state.handle(command, payload))
+        except (BackupError, KeyError, ValueError) as e:
+            message = f"missing '{e.args[0]}'." if isinstance(e, KeyError) else str(e)
+            self._reply(400, {"error": message})
+        except Exception as e:
+            # Unreadable backups, XML errors, I/O failures: report them rather than dropping the connection.
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, token_file: Optional[str] = None) -> None:
+    """Runs the daemon until a shutdown command or KeyboardInterrupt.
+
+    The token is written to token_file, by default token_path(port), and
+    removed again on exit.
+    """
+    state = BackupDaemon()
+    handler = type("Handler", (_Handler,), {"daemon_state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    token_file = token_file or token_path(server.server_address[1])
+    handler.token = write_token(token_file)
+    print(f"Serving moodle_mod_tools daemon on http://{host}:{server.server_address[1]} (token in {token_file})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        state.close_all()
+        with contextlib.suppress(OSError):
+            os.remove(token_file)
+
+
+def daemon_request(url: str, command: str, payload: Optional[dict] = None, token_file: Optional[str] = None) -> dict:
+    """Sends one command to a running daemon and returns its JSON reply.
+
+    The token is read from token_file, by default token_path() for the
+    port in url. Raises BackupError with the daemon's message if the command
+    failed.
+    """
+    token_file = token_file or token_path(urllib.parse.urlsplit(url).port or DEFAULT_PORT)
+    try:
+        with open(token_file, "r", encoding="utf-8") as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        raise BackupError(f"no daemon token in '{token_file}'; is the daemon running?")
+    request = urllib.request.Request(
+        url.rstrip("/") + "/" + command,
+        data=json.dumps(payload or {}).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise BackupError(json.loads(e.read()).get("error", str(e)))
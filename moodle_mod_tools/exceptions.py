@@ -0,0 +1,5 @@
+"""Exceptions raised by moodle_mod_tools."""
+
+
+class BackupError(Exception):
+    """A backup is missing something an operation needs, or cannot be written as asked."""
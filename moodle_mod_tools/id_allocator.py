@@ -0,0 +1,141 @@
+"""ID allocation for new sections, course modules and contexts in a Moodle backup."""
+
+import os
+import re
+from typing import Dict, Iterable, Optional, Tuple
+from . import metrics
+
+
+_CONTEXTID_RE = re.compile(rb'contextid="(\d+)"')
+_MODULEID_RE = re.compile(r"<moduleid>(\d+)</moduleid>")
+_MANIFEST_CONTEXTID_RE = re.compile(r"<original_\w*contextid>(\d+)</original_\w*contextid>")
+
+CONTEXT_HEAD_SIZE = 1024
+
+# Cached allocators keyed by backup directory; each entry remembers the
+# directory signature it was built from so external changes force a rescan.
+_CACHE: Dict[str, Tuple[tuple, "IdAllocator"]] = {}
+
+
+class IdAllocator:
+    """Hands out unused section, module and context IDs in O(1).
+
+    Module IDs share one space across all module types (page_, quiz_,
+    resource_, ...), so a new page can never collide with an existing
+    activity of another kind.
+    """
+
+    def __init__(self, section_ids: Iterable[int] = (), module_ids: Iterable[int] = (), context_ids: Iterable[int] = ()):
+        section_ids = list(section_ids)
+        self._next_section = max(section_ids) + 1 if section_ids else 30
+        self._next_module = max(module_ids, default=0) + 1
+        self._next_context = max(context_ids, default=0) + 1
+
+    def next_section_id(self) -> int:
+        new_id = self._next_section
+        self._next_section += 1
+        return new_id
+
+    def next_module_id(self) -> int:
+        new_id = self._next_module
+        self._next_module += 1
+        return new_id
+
+    def next_context_id(self) -> int:
+        new_id = self._next_context
+        self._next_context += 1
+        return new_id
+
+    @classmethod
+    def from_listing(cls, section_dirs: Iterable[str], activity_dirs: Iterable[str], manifest: str = "", context_ids: Iterable[int] = ()) -> "IdAllocator":
+        """Builds an allocator from directory names and the manifest text.
+
+        section_dirs and activity_dirs are entry names such as "section_3" and
+        "quiz_42"; anything else is ignored.
+        """
+        section_ids = []
+        for name in section_dirs:
+            if name.startswith("section_"):
+                attempt = name.split("_")[1]
+                if attempt.isdigit():
+                    section_ids.append(int(attempt))
+
+        module_ids = []
+        for name in activity_dirs:
+            modname, _, attempt = name.rpartition("_")
+            if modname and attempt.isdigit():
+                module_ids.append(int(attempt))
+        module_ids.extend(int(x) for x in _MODULEID_RE.findall(manifest))
+
+        context_ids = list(context_ids)
+        context_ids.extend(int(x) for x in _MANIFEST_CONTEXTID_RE.findall(manifest))
+        return cls(section_ids, module_ids, context_ids)
+
+    @classmethod
+    def scan(cls, backup_dir: str) -> "IdAllocator":
+        """Builds an allocator with a single pass over sections/, activities/ and moodle_backup.xml."""
+        sections_dir = os.path.join(backup_dir, "sections")
+        section_dirs = os.listdir(sections_dir) if os.path.isdir(sections_dir) else []
+
+        activity_dirs = []
+        context_ids = []
+        activities_dir = os.path.join(backup_dir, "activities")
+        if os.path.isdir(activities_dir):
+            for entry in os.scandir(activities_dir):
+                activity_dirs.append(entry.name)
+                modname = entry.name.rpartition("_")[0]
+                context_id = read_context_id(os.path.join(entry.path, f"{modname}.xml"))
+                if context_id is not None:
+                    context_ids.append(context_id)
+
+        manifest = ""
+        manifest_path = os.path.join(backup_dir, "moodle_backup.xml")
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r", encoding="UTF-8") as f:
+                manifest = f.read()
+
+        return cls.from_listing(section_dirs, activity_dirs, manifest, context_ids)
+
+
+def read_context_id(activity_xml_path: str) -> Optional[int]:
+    """Reads the contextid attribute from the head of an activity's main XML file."""
+    try:
+        with open(activity_xml_path, "rb") as f:
+            return context_id_from_head(f.read(CONTEXT_HEAD_SIZE))
+    except OSError:
+        return None
+
+
+def context_id_from_head(head: bytes) -> Optional[int]:
+    """Extracts the contextid attribute from the first bytes of an activity XML file."""
+    match = _CONTEXTID_RE.search(head)
+    return int(match.group(1)) if match else None
+
+
+def _signature(backup_dir: str) -> tuple:
+    signature = []
+    for name in ("sections", "activities", "moodle_backup.xml"):
+        try:
+            signature.append(os.stat(os.path.join(backup_dir, name)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def allocator_for(backup_dir: str) -> IdAllocator:
+    """Returns the cached allocator for backup_dir, rescanning only if the directory changed."""
+    key = os.path.realpath(backup_dir)
+    cached = _CACHE.get(key)
+    signature = _signature(backup_dir)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    metrics.incr("id_scans")
+    with metrics.span("id_scan"):
+        allocator = IdAllocator.scan(backup_dir)
+    _CACHE[key] = (signature, allocator)
+    return allocator
+
+
+def remember(backup_dir: str, allocator: IdAllocator) -> None:
+    """Re-keys the cache entry after the owner of allocator has written to backup_dir."""
+    _CACHE[os.path.realpath(backup_dir)] = (_signature(backup_dir), allocator)
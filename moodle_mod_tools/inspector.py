@@ -0,0 +1,84 @@
+"""Read-only inspection of a backup's moodle_backup.xml without extracting the archive."""
+
+import contextlib
+import os
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Dict, Union
+from . import metrics
+from .backup_session import MANIFEST
+from .exceptions import BackupError
+from .mbz_packager import iter_archive, member_name
+
+
+def _fields(elem: ET.Element) -> Dict[str, str]:
+    return {child.tag: (child.text or "") for child in elem}
+
+
+def parse_manifest(source: Union[str, BinaryIO]) -> dict:
+    """Parses moodle_backup.xml incrementally into plain dicts.
+
+    Returns {"information": {...}, "course": {...}, "sections": [...],
+    "activities": [...], "settings": [...]}. Each list entry maps child tag
+    names to their text, e.g. {"sectionid": "3", "title": "Week 1", ...}.
+    Entries are cleared as soon as they are read, so memory does not grow
+    with the number of activities or settings. Raises BackupError if the
+    manifest is not well-formed XML.
+    """
+    try:
+        return _parse_manifest(source)
+    except ET.ParseError as e:
+        raise BackupError(f"moodle_backup.xml is not well-formed XML: {e}.") from e
+
+
+def _parse_manifest(source: Union[str, BinaryIO]) -> dict:
+    result = {"information": {}, "course": {}, "sections": [], "activities": [], "settings": []}
+    path = []
+    metrics.incr("xml_parses")
+    with metrics.span("xml_parse"):
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                path.append(elem.tag)
+                continue
+            path.pop()
+            parent = path[-1] if path else None
+            if elem.tag == "activity" and parent == "activities":
+                result["activities"].append(_fields(elem))
+                elem.clear()
+            elif elem.tag == "section" and parent == "sections":
+                result["sections"].append(_fields(elem))
+                elem.clear()
+            elif elem.tag == "setting" and parent == "settings":
+                result["settings"].append(_fields(elem))
+                elem.clear()
+            elif elem.tag == "course" and parent == "contents":
+                result["course"] = _fields(elem)
+                elem.clear()
+            elif parent == "information" and len(elem) == 0:
+                result["information"][elem.tag] = elem.text or ""
+    return result
+
+
+def inspect_mbz(path: str) -> dict:
+    """Returns parse_manifest() for a .mbz archive or an extracted backup directory.
+
+    For an archive, the tar stream is read only up to moodle_backup.xml and
+    closed as soon as it has been parsed; later members, including files/,
+    are never decompressed. In a ZIP archive only moodle_backup.xml is.
+    """
+    if os.path.isdir(path):
+        manifest_path = os.path.join(path, MANIFEST)
+        if not os.path.isfile(manifest_path):
+            raise BackupError("moodle_backup.xml not found.")
+        return parse_manifest(manifest_path)
+
+    with metrics.span("inspect"), contextlib.closing(iter_archive(path)) as members:
+        for member, open_member in members:
+            if member_name(member) == MANIFEST and member.isfile():
+                with open_member() as f:
+                    return parse_manifest(f)
+    raise BackupError(f"moodle_backup.xml not found in '{path}'.")
+
+
+def find_section_ids(manifest: dict, name: str) -> list:
+    """Returns the IDs of all sections in a parsed manifest titled name."""
+    return [int(section["sectionid"]) for section in manifest["sections"] if section.get("title") == name and section.get("sectionid", "").isdigit()]
@@ -0,0 +1,109 @@
+"""Single-pass, chunked rewriting of moodle_backup.xml."""
+
+import re
+from typing import BinaryIO, List, Optional, Tuple
+
+
+CHUNK_SIZE = 1 << 16
+
+
+def _activities_edits(block: bytes) -> List[Tuple[bytes, bytes, str]]:
+    """Where new activity blocks go, in order of preference, as (pattern, replacement, mode).
+
+    Whichever marker comes first in the document wins; in a well-formed
+    manifest that is also the first one present in this list.
+    """
+    return [
+        (rb"</activities>", block, "before"),
+        (rb"<activities/>", b"<activities>" + block + b"</activities>", "replace"),
+        (rb"</contents>", b"<activities>" + block + b"</activities>\n", "before"),
+        (rb"</information>", b"<contents><activities>" + block + b"</activities></contents>\n", "before"),
+    ]
+
+
+class ManifestSplicer:
+    """Applies the edits a BackupSession makes to moodle_backup.xml while copying it.
+
+    Each edit matches once, at its first occurrence. Matches are found by
+    one combined regex over a sliding buffer. Every pattern starts with "<",
+    so a match still in progress at the end of the buffer must start at one of
+    the last few "<" (as many as the pattern contains); everything before
+    that can be written out. Memory therefore stays at one chunk plus a few
+    text nodes, whatever the size of the manifest.
+    """
+
+    def __init__(self):
+        # (pattern, replacement, mode, name); alternatives of one edit share a name.
+        self._edits: List[Tuple[bytes, bytes, str, str]] = []
+
+    def replace_first(self, pattern: bytes, replacement: bytes) -> str:
+        """Replaces the first match of the regex pattern (which must start with "<"). Returns the edit name."""
+        name = f"e{len(self._edits)}"
+        self._edits.append((pattern, replacement, "replace", name))
+        return name
+
+    def insert_before(self, marker: bytes, text: bytes) -> str:
+        """Inserts text before the first occurrence of marker. Returns the edit name."""
+        name = f"e{len(self._edits)}"
+        self._edits.append((re.escape(marker), text, "before", name))
+        return name
+
+    def insert_activities(self, block: bytes) -> str:
+        """Inserts activity blocks, creating <activities> or <contents> if the manifest lacks them."""
+        name = f"e{len(self._edits)}"
+        for pattern, replacement, mode in _activities_edits(block):
+            self._edits.append((pattern, replacement, mode, name))
+        return name
+
+    def splice(self, src: BinaryIO, dst: BinaryIO, chunk_size: int = CHUNK_SIZE) -> List[str]:
+        """Copies src to dst applying the edits. Returns the names of edits that never matched.
+
+        Edit names are those returned when the edits were added.
+        """
+        pending = list(range(len(self._edits)))
+        regex = self._compile(pending)
+        # A match can start at any of the last lookbehind "<" in the buffer.
+        lookbehind = max((edit[0].count(b"<") for edit in self._edits), default=1)
+        buf = b""
+        eof = False
+        while True:
+            match = regex.search(buf) if regex is not None else None
+            if match is not None:
+                index = pending[int(match.lastgroup[1:])]
+                pattern, replacement, mode, name = self._edits[index]
+                dst.write(buf[:match.start()])
+                dst.write(replacement)
+                if mode == "before":
+                    dst.write(match.group(0))
+                buf = buf[match.end():]
+                pending = [i for i in pending if self._edits[i][3] != name]
+                regex = self._compile(pending)
+                continue
+            if eof:
+                dst.write(buf)
+                break
+            if regex is None:
+                dst.write(buf)
+                buf = b""
+            else:
+                keep = len(buf)
+                for _ in range(lookbehind):
+                    keep = buf.rfind(b"<", 0, keep)
+                    if keep == -1:
+                        break
+                if keep == -1:
+                    keep = 0 if b"<" in buf else len(buf)
+                dst.write(buf[:keep])
+                buf = buf[keep:]
+            chunk = src.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf += chunk
+        return sorted({self._edits[i][3] for i in pending})
+
+    def _compile(self, pending: List[int]) -> Optional["re.Pattern"]:
+        if not pending:
+            return None
+        # Factor out the leading "<" so the regex engine can skip to candidates quickly.
+        alternatives = b"|".join(b"(?P<g%d>%s)" % (n, self._edits[i][0][1:]) for n, i in enumerate(pending))
+        return re.compile(b"<(?:" + alternatives + b")")
@@ -1,33 +1,579 @@
 """Module to package directories into .mbz archives without nesting."""
 
+import copy
+import functools
+import gzip
+import io
 import os
+import posixpath
 import tarfile
 import contextlib
 import tempfile
 import shutil
-from typing import Optional, ContextManager
+import time
+import zipfile
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, ContextManager, Set, Tuple
+from . import metrics
+from .backup_session import APPLIED_LOG, MANIFEST, MemoryBackupSession
+from .id_allocator import CONTEXT_HEAD_SIZE, IdAllocator, context_id_from_head
+from .parallel_extract import DEFAULT_MEMORY_CAP, DEFAULT_QUEUE_DEPTH, extract_parallel
+from .parallel_gzip import ParallelGzipWriter
+from .workspace import DEFAULT_SPILL_THRESHOLD, MemoryWorkspace
+from .zip_archive import extract_zip, is_zip_archive, update_zip_copy, write_zip, zip_entry_matches, zip_entry_name, zip_tarinfo
 
+FORMATS = ("tar", "zip")
 
-def package_mbz(source_dir: str, output_file: str) -> None:
-    """Create a .mbz archive from the contents of source_dir without nested subdirectories."""
-    with tarfile.open(output_file, "w:gz") as tar:
-        for item in os.listdir(source_dir):
-            path = os.path.join(source_dir, item)
-            tar.add(path, arcname=item)
 
+@contextlib.contextmanager
+def open_output_tar(output_file: str, threads: Optional[int] = None, compresslevel: int = 9) -> Iterator[tarfile.TarFile]:
+    """Opens output_file as a gzip'd tar for writing.
+
+    threads=None compresses on the calling thread through tarfile; any other
+    value compresses on a ParallelGzipWriter pool of that size (0 means one
+    thread per CPU).
+    """
+    if threads is None:
+        with tarfile.open(output_file, "w:gz", compresslevel=compresslevel) as tar:
+            yield tar
+        return
+    with open(output_file, "wb") as raw, ParallelGzipWriter(raw, compresslevel, threads) as gz, tarfile.open(fileobj=gz, mode="w|") as tar:
+        yield tar
+
+
+@contextlib.contextmanager
+def open_input_tar(archive_path: str) -> Iterator[tarfile.TarFile]:
+    """Opens a gzip'd tar .mbz for one sequential pass, like open_input_tar(archive_path).
+
+    tarfile's own stream reader stops at the end of the first gzip member;
+    this one reads them all, so archives written by package_mbz_incremental
+    (one gzip member per block) are read in full.
+    """
+    with gzip.open(archive_path, "rb") as gz, tarfile.open(fileobj=gz, mode="r|") as tar:
+        yield tar
+
+
+@contextlib.contextmanager
+def replacing_output(output_file: str) -> Iterator[str]:
+    """Yields a temporary path next to output_file that replaces it on a clean exit.
+
+    The temporary file is removed if the body fails, so output_file is never
+    left half-written, and it may be the archive the body is reading from.
+    """
+    if os.path.exists(output_file):
+        mode = os.stat(output_file).st_mode & 0o7777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".mbz", dir=os.path.dirname(os.path.abspath(output_file)))
+    os.close(fd)
+    try:
+        yield temp_path
+        # mkstemp creates the file 0600; give the archive the mode a plain open() would.
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, output_file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def iter_members(source_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yields (path, arcname) for everything under source_dir in the order TarFile.add would visit them."""
+    for item in os.listdir(source_dir):
+        yield from _walk(os.path.join(source_dir, item), item)
+
+
+def _walk(path: str, arcname: str) -> Iterator[Tuple[str, str]]:
+    yield path, arcname
+    if os.path.isdir(path) and not os.path.islink(path):
+        for entry in sorted(os.listdir(path)):
+            yield from _walk(os.path.join(path, entry), f"{arcname}/{entry}")
+
+
+def regular_tarinfo(tar: tarfile.TarFile, path: str, arcname: str) -> Optional[tarfile.TarInfo]:
+    """TarFile.gettarinfo, except that hardlinked files come back as regular members.
+
+    tree_clone may hardlink whole backups; tarfile would store every repeat
+    as a LNKTYPE member, which Moodle's restore does not reliably handle.
+    """
+    info = tar.gettarinfo(path, arcname)
+    if info is not None and info.islnk():
+        info.type = tarfile.REGTYPE
+        info.linkname = ""
+        info.size = os.path.getsize(path)
+    return info
+
+
+def add_member(tar: tarfile.TarFile, path: str, arcname: str) -> None:
+    """Adds one file or directory entry (not its contents) to tar; see regular_tarinfo."""
+    info = regular_tarinfo(tar, path, arcname)
+    if info is None:
+        return
+    if info.isreg():
+        with open(path, "rb") as f:
+            tar.addfile(info, f)
+    else:
+        tar.addfile(info)
+
+
+def package_mbz(source_dir: str, output_file: str, threads: Optional[int] = None, compresslevel: int = 9, block_cache: Optional[str] = None, verify: bool = False, format: str = "tar") -> None:
+    """Create a .mbz archive from the contents of source_dir without nested subdirectories.
+
+    Pass threads to compress on multiple cores; see open_output_tar. Pass
+    block_cache to reuse compressed members from earlier runs instead; see
+    package_mbz_incremental. With verify=True, source_dir is checked with
+    verifier.check_backup first and nothing is written if it fails.
+    format="zip" writes a ZIP archive instead of a gzip'd tar; threads and
+    block_cache then do not apply.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"unknown archive format '{format}'; expected one of {', '.join(FORMATS)}.")
+    if verify:
+        from .verifier import check_backup
+        check_backup(source_dir)
+    if format == "zip":
+        output_path = os.path.abspath(output_file)
+        write_zip(((path, arcname) for path, arcname in iter_members(source_dir) if os.path.abspath(path) != output_path), output_file, compresslevel)
+        return
+    if block_cache:
+        from .incremental_packager import package_mbz_incremental
+        package_mbz_incremental(source_dir, output_file, block_cache, compresslevel)
+        return
+    output_path = os.path.abspath(output_file)
+    with metrics.span("package"), open_output_tar(output_file, threads, compresslevel) as tar:
+        for path, arcname in iter_members(source_dir):
+            if os.path.abspath(path) != output_path:
+                add_member(tar, path, arcname)
+    metrics.incr("bytes_written", os.path.getsize(output_file))
 
-def decompress_mbz(archive_path: str, output_dir: str) -> None:
-    """Decompress a .mbz archive into output_dir."""
-    with tarfile.open(archive_path, "r:gz") as tar:
+
+def decompress_mbz(archive_path: str, output_dir: str, threads: Optional[int] = None, queue_depth: int = DEFAULT_QUEUE_DEPTH, memory_cap: int = DEFAULT_MEMORY_CAP) -> None:
+    """Decompress a .mbz archive into output_dir.
+
+    Pass threads to write files on a pool of that many threads (0 means one
+    per CPU), with queue_depth and memory_cap bounding the content waiting to
+    be written; see extract_parallel. ZIP archives are detected and
+    extracted with extract_zip; threads does not apply to them.
+    """
+    if is_zip_archive(archive_path):
+        extract_zip(archive_path, output_dir)
+        return
+    if threads is not None:
+        extract_parallel(archive_path, output_dir, threads, queue_depth, memory_cap)
+        return
+    metrics.incr("bytes_read", os.path.getsize(archive_path))
+    with metrics.span("extract"), tarfile.open(archive_path, "r:gz") as tar:
         tar.extractall(path=output_dir)
 
+class LazyExtractedDir(str):
+    """Path of a partially extracted backup that can materialize further members on demand.
+
+    Behaves as the directory path string, so it can be passed anywhere an
+    extracted backup directory is expected. materialized holds the member names
+    that exist on disk; everything else is still only in the source archive.
+    """
+
+    def __new__(cls, path: str, archive_path: str, materialized: Set[str]):
+        obj = super().__new__(cls, path)
+        obj.archive_path = archive_path
+        obj.materialized = materialized
+        obj._tar = None
+        return obj
+
+    def fetch(self, name: str) -> str:
+        """Extracts member name, or everything under it for a directory, and returns its path."""
+        with metrics.span("extract.fetch"):
+            prefix = name.strip("/")
+            if is_zip_archive(self.archive_path):
+                def wanted(current: str) -> bool:
+                    return current not in self.materialized and (current == prefix or current.startswith(prefix + "/"))
+                self.materialized.update(extract_zip(self.archive_path, self, wanted))
+                return os.path.join(self, prefix)
+            if self._tar is None:
+                self._tar = tarfile.open(self.archive_path, "r:gz")
+            for member in self._tar.getmembers():
+                current = member_name(member)
+                if current == prefix or current.startswith(prefix + "/"):
+                    if current not in self.materialized:
+                        self._tar.extract(member, path=self)
+                        self.materialized.add(current)
+        return os.path.join(self, prefix)
+
+    def close(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+
+
+def is_metadata_member(name: str) -> bool:
+    """True for the members the section and page adders read or write."""
+    return name in (MANIFEST, APPLIED_LOG) or name.split("/")[0] in ("sections", "activities")
+
+
+def extract_metadata(archive_path: str, output_dir: str) -> Set[str]:
+    """Extracts only moodle_backup.xml, sections/ and activities/ from archive_path.
+
+    Returns the names of the extracted members.
+    """
+    if is_zip_archive(archive_path):
+        return extract_zip(archive_path, output_dir, is_metadata_member)
+    extracted = set()
+    metrics.incr("bytes_read", os.path.getsize(archive_path))
+    with metrics.span("extract.metadata"), open_input_tar(archive_path) as tar:
+        for member in tar:
+            name = member_name(member)
+            if is_metadata_member(name):
+                tar.extract(member, path=output_dir)
+                extracted.add(name)
+    return extracted
+
+
+def repack_lazy(workspace: LazyExtractedDir, output_tar: str, threads: Optional[int] = None, compresslevel: int = 9) -> None:
+    """Writes output_tar from a lazily extracted workspace and its source archive.
+
+    Materialized members are taken from disk (and dropped if they were
+    deleted), untouched members are copied straight from the source archive,
+    and files created in the workspace are appended. The archive is written
+    through replacing_output, so output_tar may be the source archive itself.
+
+    A ZIP source is instead copied to output_tar (or updated in place if they
+    are the same file) with update_zip_copy: only materialized files that
+    differ from their entry and new files are appended, and materialized
+    members that were deleted are dropped.
+    """
+    if is_zip_archive(workspace.archive_path):
+        replacements, deletions = _lazy_zip_changes(workspace)
+        update_zip_copy(workspace.archive_path, output_tar, replacements, deletions, compresslevel)
+        return
+    seen = set()
+    metrics.incr("bytes_read", os.path.getsize(workspace.archive_path))
+    with replacing_output(output_tar) as temp_tar, metrics.span("package.lazy"), open_input_tar(workspace.archive_path) as src, open_output_tar(temp_tar, threads, compresslevel) as dst:
+        for member in src:
+            name = member_name(member)
+            seen.add(name)
+            if name in workspace.materialized:
+                path = os.path.join(workspace, name)
+                if os.path.lexists(path):
+                    add_member(dst, path, member.name)
+            elif member.isfile():
+                dst.addfile(member, src.extractfile(member))
+            else:
+                dst.addfile(member)
+
+        for root, dirs, files in os.walk(workspace):
+            dirs.sort()
+            for entry in dirs + sorted(files):
+                path = os.path.join(root, entry)
+                name = os.path.relpath(path, workspace).replace(os.sep, "/")
+                if name not in seen:
+                    add_member(dst, path, name)
+    metrics.incr("bytes_written", os.path.getsize(output_tar))
+
+
+def _lazy_zip_changes(workspace: LazyExtractedDir) -> Tuple[Dict[str, bytes], List[str]]:
+    """The files to write and entries to drop when repacking a lazy workspace over a ZIP."""
+    replacements = {}
+    with zipfile.ZipFile(workspace.archive_path) as zf:
+        names = {zip_entry_name(info.filename) for info in zf.infolist()}
+        deletions = sorted(name for name in workspace.materialized if name in names and not os.path.lexists(os.path.join(workspace, name)))
+        for root, dirs, files in os.walk(workspace):
+            dirs.sort()
+            for entry in sorted(files):
+                path = os.path.join(root, entry)
+                name = os.path.relpath(path, workspace).replace(os.sep, "/")
+                if name in names and (name not in workspace.materialized or zip_entry_matches(zf, name, path)):
+                    continue
+                with open(path, "rb") as f:
+                    replacements[name] = f.read()
+    return replacements, deletions
+
+
 @contextlib.contextmanager
-def with_extracted_tar(input_tar: str, output_tar: Optional[str] = None) -> ContextManager[str]:
+def with_extracted_tar(input_tar: str, output_tar: Optional[str] = None, threads: Optional[int] = None, compresslevel: int = 9, lazy: bool = False) -> ContextManager[str]:
+    """Extracts input_tar to a temporary directory and repackages it into output_tar on exit.
+
+    With lazy=True only the metadata subset is extracted and a
+    LazyExtractedDir is yielded; members that were never materialized are
+    copied from input_tar when repacking instead of being extracted.
+    """
     temp_dir = tempfile.mkdtemp()
     try:
-        decompress_mbz(input_tar, temp_dir)
-        yield temp_dir
-        if output_tar:
-            package_mbz(temp_dir, output_tar)
+        if lazy:
+            workspace = LazyExtractedDir(temp_dir, input_tar, extract_metadata(input_tar, temp_dir))
+            try:
+                yield workspace
+            finally:
+                workspace.close()
+            if output_tar:
+                repack_lazy(workspace, output_tar, threads, compresslevel)
+        else:
+            decompress_mbz(input_tar, temp_dir)
+            yield temp_dir
+            if output_tar:
+                package_mbz(temp_dir, output_tar, threads, compresslevel, format="zip" if is_zip_archive(input_tar) else "tar")
     finally:
         shutil.rmtree(temp_dir)
+
+
+def member_name(member: tarfile.TarInfo) -> str:
+    """Returns the member path relative to the backup root, e.g. "sections/section_3"."""
+    name = member.name
+    while name.startswith("./"):
+        name = name[2:]
+    return name.rstrip("/")
+
+
+def iter_archive(archive_path: str) -> Iterator[Tuple[tarfile.TarInfo, Callable[[], BinaryIO]]]:
+    """Yields (member, open_member) for every member of a tar or ZIP .mbz, in archive order.
+
+    ZIP entries are described by zip_tarinfo. open_member() returns a
+    readable file for a regular file's content; for a tar it is only valid
+    until the next member is yielded. Only the content actually opened of a
+    ZIP is read, whereas a tar is always decompressed in full.
+    """
+    if not is_zip_archive(archive_path):
+        metrics.incr("bytes_read", os.path.getsize(archive_path))
+        with open_input_tar(archive_path) as tar:
+            for member in tar:
+                yield member, functools.partial(tar.extractfile, member)
+        return
+    with zipfile.ZipFile(archive_path) as zf:
+        for info in zf.infolist():
+            yield zip_tarinfo(info), functools.partial(_open_zip_entry, zf, info)
+
+
+def _open_zip_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> BinaryIO:
+    metrics.incr("bytes_read", info.compress_size)
+    return zf.open(info)
+
+
+class MetadataCollector:
+    """Gathers what a MemoryBackupSession needs from archive members as they stream past.
+
+    Call observe() for every member. It returns "keep" for members whose
+    content must be passed to keep() (moodle_backup.xml, the applied-operations
+    log and everything under sections/), "head" for activity XML files whose
+    first CONTEXT_HEAD_SIZE bytes must be passed to head() for their context
+    ID, and None for everything else.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+        self.dirs: Set[str] = set()
+        self.section_dirs: Set[str] = set()
+        self.activity_dirs: Set[str] = set()
+        self.context_ids: List[int] = []
+
+    def observe(self, name: str, member: tarfile.TarInfo) -> Optional[str]:
+        parts = name.split("/")
+        if member.isdir():
+            self.dirs.add(name)
+        if parts[0] == "sections" and len(parts) > 1:
+            self.section_dirs.add(parts[1])
+            return "keep" if member.isfile() else None
+        if parts[0] == "activities" and len(parts) > 1:
+            self.activity_dirs.add(parts[1])
+            modname = parts[1].rpartition("_")[0]
+            if member.isfile() and len(parts) == 3 and parts[2] == f"{modname}.xml":
+                return "head"
+            return None
+        if name in (MANIFEST, APPLIED_LOG) and member.isfile():
+            return "keep"
+        return None
+
+    def keep(self, name: str, data: bytes) -> None:
+        self.files[name] = data
+
+    def head(self, data: bytes) -> None:
+        context_id = context_id_from_head(data[:CONTEXT_HEAD_SIZE])
+        if context_id is not None:
+            self.context_ids.append(context_id)
+
+    def session(self, backup_name: Optional[str] = None) -> MemoryBackupSession:
+        manifest = self.files.get(MANIFEST, b"").decode("UTF-8")
+        allocator = IdAllocator.from_listing(self.section_dirs, self.activity_dirs, manifest, self.context_ids)
+        return MemoryBackupSession(self.files, self.dirs, allocator, backup_name=backup_name)
+
+
+def load_metadata_session(input_tar: str, backup_name: Optional[str] = None) -> MemoryBackupSession:
+    """Streams input_tar once and returns a session over its metadata only.
+
+    Only moodle_backup.xml, the applied-operations log and the sections/
+    files are kept in memory; activity members contribute their directory
+    names and context IDs to the allocator. Everything else, including
+    files/, is skipped without being stored. See MetadataCollector. For a
+    ZIP archive the skipped entries are not even decompressed.
+    """
+    collector = MetadataCollector()
+    with metrics.span("extract.stream"):
+        for member, open_member in iter_archive(input_tar):
+            name = member_name(member)
+            action = collector.observe(name, member)
+            if action == "keep":
+                with open_member() as f:
+                    collector.keep(name, f.read())
+            elif action == "head":
+                with open_member() as f:
+                    collector.head(f.read(CONTEXT_HEAD_SIZE))
+    return collector.session(backup_name)
+
+
+def append_files(dst: tarfile.TarFile, files: Iterable[Tuple[str, bytes]], seen_dirs: Set[str], now: float) -> None:
+    """Appends new regular files to dst, each preceded by any parent directory not in seen_dirs.
+
+    Directories written here are added to seen_dirs.
+    """
+    for name, data in files:
+        missing = []
+        parent = posixpath.dirname(name)
+        while parent and parent not in seen_dirs:
+            missing.append(parent)
+            seen_dirs.add(parent)
+            parent = posixpath.dirname(parent)
+        for directory in reversed(missing):
+            dir_info = tarfile.TarInfo(directory)
+            dir_info.type = tarfile.DIRTYPE
+            dir_info.mode = 0o755
+            dir_info.mtime = now
+            dst.addfile(dir_info)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = now
+        dst.addfile(info, io.BytesIO(data))
+
+
+def rewrite_mbz(input_tar: str, output_tar: str, replacements: Dict[str, bytes], threads: Optional[int] = None, compresslevel: int = 9) -> None:
+    """Copies input_tar to output_tar member by member, substituting replacements.
+
+    replacements maps member names to new content. Existing members are
+    rewritten in place; the rest are appended, together with any parent
+    directories the archive does not already contain. Untouched members are
+    streamed straight through, so neither disk nor memory use grows with the
+    size of the archive. The archive is written through replacing_output, so
+    output_tar may be input_tar itself and is left untouched on failure.
+
+    A ZIP input_tar is handled by update_zip_copy instead: the output is a
+    copy of the input with only the replacements appended, and it may be the
+    input itself, in which case the archive is updated in place.
+    """
+    if is_zip_archive(input_tar):
+        update_zip_copy(input_tar, output_tar, replacements, (), compresslevel)
+        return
+    pending = dict(replacements)
+    seen_dirs = set()
+    now = time.time()
+    metrics.incr("bytes_read", os.path.getsize(input_tar))
+    with replacing_output(output_tar) as temp_tar, metrics.span("package.rewrite"), open_input_tar(input_tar) as src, open_output_tar(temp_tar, threads, compresslevel) as dst:
+        for member in src:
+            name = member_name(member)
+            if member.isdir():
+                seen_dirs.add(name)
+            if name in pending and member.isfile():
+                data = pending.pop(name)
+                info = copy.copy(member)
+                info.size = len(data)
+                info.mtime = now
+                dst.addfile(info, io.BytesIO(data))
+            elif member.isfile():
+                dst.addfile(member, src.extractfile(member))
+            else:
+                dst.addfile(member)
+
+        append_files(dst, pending.items(), seen_dirs, now)
+    metrics.incr("bytes_written", os.path.getsize(output_tar))
+
+
+@contextlib.contextmanager
+def with_streamed_tar(input_tar: str, output_tar: Optional[str] = None, backup_name: Optional[str] = None, threads: Optional[int] = None, compresslevel: int = 9) -> ContextManager[MemoryBackupSession]:
+    """Streaming counterpart of with_extracted_tar that never extracts the archive.
+
+    Yields a MemoryBackupSession over the archive metadata. On a clean exit the
+    session is committed and output_tar is produced with rewrite_mbz, so only
+    moodle_backup.xml, the touched section.xml files and new activity members
+    differ from the input.
+    """
+    session = load_metadata_session(input_tar, backup_name=backup_name)
+    yield session
+    if output_tar:
+        session.commit()
+        rewrite_mbz(input_tar, output_tar, session.written, threads, compresslevel)
+
+
+def load_workspace(input_tar: str, spill_threshold: Optional[int] = DEFAULT_SPILL_THRESHOLD) -> MemoryWorkspace:
+    """Streams input_tar once into a MemoryWorkspace holding every member.
+
+    Small backups are then edited and repacked without touching disk; once
+    the content read exceeds spill_threshold bytes the workspace moves it to
+    a temporary directory and keeps loading there.
+    """
+    workspace = MemoryWorkspace(spill_threshold=spill_threshold)
+    try:
+        with metrics.span("extract.memory"):
+            for member, open_member in iter_archive(input_tar):
+                name = member_name(member)
+                data = None
+                if member.isfile():
+                    with open_member() as f:
+                        data = f.read()
+                workspace.load_member(name, member, data)
+    except BaseException:
+        workspace.close()
+        raise
+    return workspace
+
+
+def package_workspace(workspace: MemoryWorkspace, output_tar: str, threads: Optional[int] = None, compresslevel: int = 9) -> None:
+    """Writes output_tar from a workspace returned by load_workspace.
+
+    Loaded members are written back in their original order, with the content
+    of any file rewritten since; new files follow, preceded by parent
+    directories the archive did not already contain. A workspace that spilled
+    to disk is packaged from its directory instead. Either way the archive is
+    written through replacing_output, so output_tar may be the archive the
+    workspace was loaded from.
+    """
+    if workspace.spilled_dir is not None:
+        with replacing_output(output_tar) as temp_tar:
+            package_mbz(workspace.spilled_dir, temp_tar, threads, compresslevel)
+        return
+
+    seen = set()
+    now = time.time()
+    with replacing_output(output_tar) as temp_tar, metrics.span("package.memory"), open_output_tar(temp_tar, threads, compresslevel) as dst:
+        for name, member in workspace.members.items():
+            seen.add(name)
+            if not member.isfile():
+                dst.addfile(member)
+            elif name in workspace.files:
+                data = workspace.files[name]
+                info = member
+                if name in workspace.written:
+                    info = copy.copy(member)
+                    info.size = len(data)
+                    info.mtime = now
+                dst.addfile(info, io.BytesIO(data))
+
+        append_files(dst, ((name, data) for name, data in workspace.files.items() if name not in seen), seen, now)
+    metrics.incr("bytes_written", os.path.getsize(output_tar))
+
+
+@contextlib.contextmanager
+def with_memory_tar(input_tar: str, output_tar: Optional[str] = None, spill_threshold: Optional[int] = DEFAULT_SPILL_THRESHOLD, threads: Optional[int] = None, compresslevel: int = 9) -> ContextManager[MemoryWorkspace]:
+    """In-memory counterpart of with_extracted_tar.
+
+    Yields a MemoryWorkspace loaded with load_workspace; pass it to
+    BackupSession to edit it. On a clean exit it is packaged into output_tar
+    with package_workspace, or for a ZIP input_tar by appending the written
+    files with update_zip_copy. Any spill directory is removed either way.
+    """
+    workspace = load_workspace(input_tar, spill_threshold)
+    try:
+        yield workspace
+        if output_tar and is_zip_archive(input_tar):
+            update_zip_copy(input_tar, output_tar, workspace.written, (), compresslevel)
+        elif output_tar:
+            package_workspace(workspace, output_tar, threads, compresslevel)
+    finally:
+        workspace.close()
@@ -0,0 +1,93 @@
+"""Lightweight timing spans and counters for profiling moodle_mod_tools runs.
+
+Instrumentation is off by default. While disabled, span() hands back a shared
+no-op context manager and incr() returns immediately, so instrumented code
+pays one function call per site.
+"""
+
+import contextlib
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Iterator
+
+_enabled = False
+_spans: Dict[str, list] = {}
+_counters: Dict[str, int] = defaultdict(int)
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable() -> None:
+    """Starts recording spans and counters."""
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Discards everything recorded so far."""
+    _spans.clear()
+    _counters.clear()
+
+
+@contextlib.contextmanager
+def _timed(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        entry = _spans.get(name)
+        if entry is None:
+            _spans[name] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+
+def span(name: str):
+    """Context manager timing one stage under name; a no-op while disabled."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _timed(name)
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """Adds amount to counter name; a no-op while disabled."""
+    if _enabled:
+        _counters[name] += amount
+
+
+def snapshot() -> dict:
+    """Returns the recorded spans (count, total and max seconds) and counters."""
+    return {
+        "spans": {name: {"count": count, "total_s": total, "max_s": longest} for name, (count, total, longest) in _spans.items()},
+        "counters": dict(_counters),
+    }
+
+
+def write_json(path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def format_report() -> str:
+    """Renders the recorded spans and counters as a plain-text table."""
+    lines = [f"{'span':<28} {'count':>7} {'total s':>10} {'max s':>10}"]
+    for name, (count, total, longest) in sorted(_spans.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<28} {count:>7} {total:>10.4f} {longest:>10.4f}")
+    if _counters:
+        lines.append("")
+        lines.append(f"{'counter':<28} {'value':>7}")
+        for name, value in sorted(_counters.items()):
+            lines.append(f"{name:<28} {value:>7}")
+    return "\n".join(lines)
@@ -3,136 +3,38 @@
 
 import os
 import sys
-import xml.etree.ElementTree as ET
-import shutil
-import re
+from . import metrics
+from .backup_session import BackupSession, PageText
+from .exceptions import BackupError
+from .streamed_content import ContentFile
+from .tree_clone import COPY_MODES, clone_tree
 
 
-def add_page_to_backup(extracted_backup_dir: str, section_id: str, page_title: str, page_description: str = "Placeholder description", page_content: str = "Placeholder content", output_dir: str = None) -> None:
-    """Adds a new page to the specified section in an extracted Moodle backup."""
-    # 
+def add_page_to_backup(extracted_backup_dir: str, section_id: str, page_title: str, page_description: PageText = "Placeholder description", page_content: PageText = "Placeholder content", output_dir: str = None, copy_mode: str = "auto") -> None:
+    """Adds a new page to the specified section in an extracted Moodle backup.
+
+    With output_dir, the backup is first cloned there; see tree_clone.clone_tree for copy_mode.
+    """
     if output_dir:
         if os.path.exists(output_dir):
-            print(f"Error: output directory '{output_dir}' already exists.")
-            sys.exit(1)
+            raise BackupError(f"output directory '{output_dir}' already exists.")
         print(f"Copying '{extracted_backup_dir}' to '{output_dir}'...")
-        shutil.copytree(extracted_backup_dir, output_dir)
+        with metrics.span("copy"):
+            clone_tree(extracted_backup_dir, output_dir, copy_mode)
         backup_dir = output_dir
     else:
         backup_dir = extracted_backup_dir
     
     section_path = os.path.join(backup_dir, "sections", f"section_{section_id}")
     if not os.path.isdir(section_path):
-        print(f"Error: section {section_id} does not exist.")
-        sys.exit(1)
+        raise BackupError(f"section {section_id} does not exist.")
 
     backup_xml_path = os.path.join(backup_dir, "moodle_backup.xml")
     if not os.path.isfile(backup_xml_path):
-        print("Error: moodle_backup.xml not found.")
-        sys.exit(1)
-
-    backup_tree = ET.parse(backup_xml_path)
-    backup_root = backup_tree.getroot()
-
-    activities_path = os.path.join(backup_dir, "activities")
-    max_id = 0
-    if os.path.isdir(activities_path):
-        for item in os.listdir(activities_path):
-            if item.startswith("page_"):
-                try:
-                    existing_id = int(item.split("_")[1])
-                    if existing_id > max_id:
-                        max_id = existing_id
-                except ValueError:
-                    pass
-    new_module_id = max_id + 1
-
-    page_dir = f"page_{new_module_id}"
-    new_page_path = os.path.join(activities_path, page_dir)
-    os.makedirs(new_page_path, exist_ok=True)
-
-    # Add page.xml
-    context_id = 13
-    page_xml = f'''<?xml version="1.0" encoding="UTF-8"?>\n<activity id="{new_module_id}" moduleid="{new_module_id + 1}" modulename="page" contextid="{context_id}">\n  <page id="{new_module_id}">\n    <name>{page_title}</name>\n    <intro>{page_description}</intro>\n    <introformat>1</introformat>\n    <content>{page_content}</content>\n    <contentformat>1</contentformat>\n    <legacyfiles>0</legacyfiles>\n    <legacyfileslast>$@NULL@$</legacyfileslast>\n    <display>5</display>\n    <displayoptions>a:2:{{s:10:"printintro";s:1:"0";s:17:"printlastmodified";s:1:"1";}}</displayoptions>\n    <revision>1</revision>\n    <timemodified>1743729253</timemodified>\n  </page>\n</activity>\n'''
-    with open(os.path.join(new_page_path, "page.xml"), "w", encoding="UTF-8") as f:
-        f.write(page_xml)
-
-    # Add module.xml
-    module_xml = f'''<?xml version="1.0" encoding="UTF-8"?>\n<module id="{new_module_id + 1}" version="2024100700">\n  <modulename>page</modulename>\n  <sectionid>{section_id}</sectionid>\n  <sectionnumber>1</sectionnumber>\n  <idnumber></idnumber>\n  <added>1743729253</added>\n  <score>0</score>\n  <indent>0</indent>\n  <visible>1</visible>\n  <visibleoncoursepage>1</visibleoncoursepage>\n  <visibleold>1</visibleold>\n  <groupmode>0</groupmode>\n  <groupingid>0</groupingid>\n  <completion>0</completion>\n  <completiongradeitemnumber>$@NULL@$</completiongradeitemnumber>\n  <completionpassgrade>0</completionpassgrade>\n  <completionview>0</completionview>\n  <completionexpected>0</completionexpected>\n  <availability>$@NULL@$</availability>\n  <showdescription>0</showdescription>\n  <downloadcontent>1</downloadcontent>\n  <lang></lang>\n  <tags></tags>\n</module>\n'''
-    with open(os.path.join(new_page_path, "module.xml"), "w", encoding="UTF-8") as f:
-        f.write(module_xml)
-
-    # placeholders
-    placeholders = {
-        "inforef.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<inforef>\n  <fileref/>\n  <graderef/>\n  <groupref/>\n  <groupingref/>\n  <userref/>\n</inforef>\n""",
-        "roles.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<roles></roles>\n""",
-        "grades.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<activity_grade_graders></activity_grade_graders>\n""",
-        "grade_history.xml": """<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<activity_grade_history></activity_grade_history>\n"""
-    }
-    for filename, content in placeholders.items():
-        with open(os.path.join(new_page_path, filename), "w", encoding="UTF-8") as f:
-            f.write(content)
-
-    # Insert <activity> block in moodle_backup.xml
-    info_elem = backup_root.find("./information")
-    if info_elem is not None:
-        contents_elem = info_elem.find("contents")
-        if contents_elem is None:
-            contents_elem = ET.SubElement(info_elem, "contents")
-        acts_elem = contents_elem.find("activities")
-        if acts_elem is None:
-            acts_elem = ET.SubElement(contents_elem, "activities")
-        new_act = ET.SubElement(acts_elem, "activity")
-
-        moduleid_elem = ET.SubElement(new_act, "moduleid")
-        moduleid_elem.text = str(new_module_id + 1)
-
-        sectionid_elem = ET.SubElement(new_act, "sectionid")
-        sectionid_elem.text = str(section_id)
-
-        modulename_elem = ET.SubElement(new_act, "modulename")
-        modulename_elem.text = "page"
-
-        title_elem = ET.SubElement(new_act, "title")
-        title_elem.text = page_title
+        raise BackupError("moodle_backup.xml not found.")
 
-        directory_elem = ET.SubElement(new_act, "directory")
-        directory_elem.text = f"activities/page_{new_module_id}"
-
-        insub_elem = ET.SubElement(new_act, "insubsection")
-        insub_elem.text = ""
-
-        import io
-        buffer = io.BytesIO()
-        backup_tree.write(buffer, encoding="UTF-8", xml_declaration=True, short_empty_elements=False)
-        content = buffer.getvalue().decode("UTF-8")
-        content = content.replace('\'', '"')
-        with open(backup_xml_path, "w", encoding="UTF-8") as f:
-            f.write(content)
-    else:
-        print("Warning: <information> block not found in moodle_backup.xml, skipping activity insertion.")
-
-    # Update <sequence>
-    section_xml_path = os.path.join(section_path, "section.xml")
-    if not os.path.isfile(section_xml_path):
-        print("Error: section.xml not found.")
-        sys.exit(1)
-
-    s_tree = ET.parse(section_xml_path)
-    s_root = s_tree.getroot()
-    seq_elem = s_root.find("sequence")
-    if seq_elem is None:
-        print("Error: no <sequence> found in section.xml")
-        sys.exit(1)
-    existing_seq = seq_elem.text.strip() if seq_elem.text else ""
-    if existing_seq:
-        new_seq = f"{existing_seq},{new_module_id}"
-    else:
-        new_seq = str(new_module_id)
-    seq_elem.text = new_seq
-    s_tree.write(section_xml_path, encoding="UTF-8", xml_declaration=True, short_empty_elements=False)
-
-    print(f"Added page with ID={new_module_id}, Title='{page_title}', Section={section_id}.")
+    with metrics.span("add_page"), BackupSession(backup_dir) as session:
+        session.add_page(section_id, page_title, page_description, page_content)
 
 
 def cli_main():
@@ -143,28 +45,70 @@ def cli_main():
     parser.add_argument("page_title")
     parser.add_argument("--page_description", default="Placeholder description")
     parser.add_argument("--page_content", default="Placeholder content")
+    parser.add_argument("--page_description_file", default=None)
+    parser.add_argument("--page_content_file", default=None)
     parser.add_argument("--output_dir", default=None)
+    parser.add_argument("--copy_mode", choices=COPY_MODES, default="auto")
     args = parser.parse_args()
 
-    add_page_to_backup(
-        extracted_backup_dir=args.extracted_backup_dir,
-        section_id=args.section_id,
-        page_title=args.page_title,
-        page_description=args.page_description,
-        page_content=args.page_content,
-        output_dir=args.output_dir
-    )
+    try:
+        add_page_to_backup(
+            extracted_backup_dir=args.extracted_backup_dir,
+            section_id=args.section_id,
+            page_title=args.page_title,
+            page_description=ContentFile(args.page_description_file) if args.page_description_file else args.page_description,
+            page_content=ContentFile(args.page_content_file) if args.page_content_file else args.page_content,
+            output_dir=args.output_dir,
+            copy_mode=args.copy_mode
+        )
+    except BackupError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 def add_page_from_tar(
     input_tar: str,
     output_tar: str,
     section_id: str,
     page_title: str,
-    page_description: str = "Placeholder description",
-    page_content: str = "Placeholder content"
+    page_description: PageText = "Placeholder description",
+    page_content: PageText = "Placeholder content",
+    streaming: bool = False,
+    in_memory: bool = False,
+    pipelined: bool = False
 ) -> None:
+    """Adds a page to a .mbz archive, writing the result to output_tar.
+
+    With streaming=True the archive is rewritten member by member; with
+    pipelined=True it is decompressed and recompressed concurrently in a
+    single pass (see pipeline.with_pipelined_tar); with in_memory=True it is
+    loaded into a MemoryWorkspace (see mbz_packager.with_memory_tar);
+    otherwise only its metadata is extracted to a temporary directory.
+    """
+    if pipelined:
+        from .pipeline import with_pipelined_tar
+        with with_pipelined_tar(input_tar, output_tar) as session:
+            session.add_page(section_id, page_title, page_description, page_content)
+        return
+
+    if in_memory:
+        from .mbz_packager import with_memory_tar
+        with with_memory_tar(input_tar, output_tar) as workspace:
+            if not workspace.isdir(f"sections/section_{section_id}"):
+                raise BackupError(f"section {section_id} does not exist.")
+            if not workspace.isfile("moodle_backup.xml"):
+                raise BackupError("moodle_backup.xml not found.")
+            with metrics.span("add_page"), BackupSession(workspace) as session:
+                session.add_page(section_id, page_title, page_description, page_content)
+        return
+
+    if streaming:
+        from .mbz_packager import with_streamed_tar
+        with with_streamed_tar(input_tar, output_tar) as session:
+            session.add_page(section_id, page_title, page_description, page_content)
+        return
+
     from .mbz_packager import with_extracted_tar
-    with with_extracted_tar(input_tar, output_tar) as extracted_dir:
+    with with_extracted_tar(input_tar, output_tar, lazy=True) as extracted_dir:
         add_page_to_backup(
             extracted_backup_dir=extracted_dir,
             section_id=section_id,
@@ -0,0 +1,159 @@
+"""Archive extraction with one decompressing reader and a pool of file-writing threads."""
+
+import os
+import shutil
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from . import metrics
+from .exceptions import BackupError
+
+
+DEFAULT_QUEUE_DEPTH = 64
+DEFAULT_MEMORY_CAP = 64 << 20
+CHUNK_SIZE = 1 << 20
+# TarFile.extract's "data" filter (Python 3.8.17+, 3.11.4+) re-checks links against the real paths.
+EXTRACT_FILTER = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+
+class _WriteBudget:
+    """Bounds the number and total size of file contents waiting to be written."""
+
+    def __init__(self, queue_depth: int, memory_cap: int):
+        self.queue_depth = queue_depth
+        self.memory_cap = memory_cap
+        self.count = 0
+        self.size = 0
+        self.error: Optional[BaseException] = None
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        with self._cond:
+            while self.error is None and self.count and (self.count >= self.queue_depth or self.size + size > self.memory_cap):
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+            self.count += 1
+            self.size += size
+
+    def release(self, size: int, error: Optional[BaseException] = None) -> None:
+        with self._cond:
+            self.count -= 1
+            self.size -= size
+            if error is not None and self.error is None:
+                self.error = error
+            self._cond.notify_all()
+
+    def drain(self) -> None:
+        """Waits until every queued write has finished, then re-raises the first failure."""
+        with self._cond:
+            while self.count:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+
+
+def _inside(output_dir: str, path: str) -> bool:
+    return path == output_dir or path.startswith(output_dir + os.sep)
+
+
+def _target(output_dir: str, member: tarfile.TarInfo, resolve: bool = False) -> str:
+    """The path member extracts to, checked to stay inside output_dir along with any link target.
+
+    With resolve=True the checks also follow symlinks already extracted,
+    which only matters once the archive has contained one.
+    """
+    def inside(path: str) -> bool:
+        return _inside(output_dir, os.path.realpath(path) if resolve else path)
+
+    path = os.path.normpath(os.path.join(output_dir, member.name))
+    if not _inside(output_dir, path) or not inside(os.path.dirname(path)):
+        raise BackupError(f"archive member '{member.name}' would be extracted outside '{output_dir}'.")
+    if member.issym():
+        link_target = os.path.join(os.path.dirname(path), member.linkname)
+    elif member.islnk():
+        # Hardlink targets are member names, relative to the archive root.
+        link_target = os.path.join(output_dir, member.linkname)
+    else:
+        return path
+    # realpath sees the unnormalized target, so ".." applies after any symlink before it.
+    if not _inside(output_dir, os.path.normpath(link_target)) or not inside(link_target):
+        raise BackupError(f"archive member '{member.name}' links outside '{output_dir}'.")
+    return path
+
+
+def _set_attributes(path: str, member: tarfile.TarInfo) -> None:
+    os.chmod(path, member.mode)
+    os.utime(path, (member.mtime, member.mtime))
+
+
+def _write_member(path: str, data: bytes, member: tarfile.TarInfo, budget: _WriteBudget) -> None:
+    error = None
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+        _set_attributes(path, member)
+    except BaseException as e:
+        error = e
+    budget.release(len(data), error)
+
+
+def extract_parallel(archive_path: str, output_dir: str, threads: int = 0, queue_depth: int = DEFAULT_QUEUE_DEPTH, memory_cap: int = DEFAULT_MEMORY_CAP) -> None:
+    """Extracts archive_path into output_dir, creating and writing files on a thread pool.
+
+    The calling thread decompresses the archive as a stream and creates
+    directories. Each regular file's content is read into memory and handed
+    to one of threads writer threads (0 means one per CPU), which create,
+    write and close it. At most queue_depth files, totalling at most
+    memory_cap bytes, wait to be written at any time; a file larger than
+    memory_cap is written by the reading thread once the queue drains. Links
+    and other special members are extracted by the reading thread after the
+    queue drains, so hardlink targets always exist.
+
+    Members that would land or link outside output_dir, directly or through
+    a symlink extracted earlier, are rejected; links also go through
+    TarFile's "data" filter where it exists. Directory modes and times are
+    applied last, as TarFile.extractall does.
+    """
+    from .mbz_packager import open_input_tar
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = os.path.realpath(output_dir)
+    budget = _WriteBudget(queue_depth, memory_cap)
+    directories: List[Tuple[str, tarfile.TarInfo]] = []
+    created = {output_dir}
+    saw_symlink = False
+    metrics.incr("bytes_read", os.path.getsize(archive_path))
+    with metrics.span("extract.parallel"), ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool, open_input_tar(archive_path) as tar:
+        try:
+            for member in tar:
+                path = _target(output_dir, member, saw_symlink)
+                saw_symlink = saw_symlink or member.issym()
+                if member.isdir():
+                    os.makedirs(path, exist_ok=True)
+                    created.add(path)
+                    directories.append((path, member))
+                elif member.isfile():
+                    parent = os.path.dirname(path)
+                    if parent not in created:
+                        os.makedirs(parent, exist_ok=True)
+                        created.add(parent)
+                    if member.size > memory_cap:
+                        budget.drain()
+                        with tar.extractfile(member) as src, open(path, "wb") as dst:
+                            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                        _set_attributes(path, member)
+                    else:
+                        budget.acquire(member.size)
+                        data = tar.extractfile(member).read()
+                        pool.submit(_write_member, path, data, member, budget)
+                    metrics.incr("files_written")
+                else:
+                    budget.drain()
+                    tar.extract(member, path=output_dir, set_attrs=False, **EXTRACT_FILTER)
+            budget.drain()
+        finally:
+            pool.shutdown(wait=True)
+
+    for path, member in reversed(directories):
+        _set_attributes(path, member)
@@ -0,0 +1,122 @@
+"""Runs a script of mixed backup operations against one workspace in one process."""
+
+import os
+from typing import Dict, Iterable, Optional
+from . import metrics
+from .backup_session import BackupSession
+from .bulk_adder import iter_config_records, page_text
+from .exceptions import BackupError
+
+
+def run_script(input_path: str, script_file: str, output_file: Optional[str] = None, backup_name: Optional[str] = None) -> Dict[str, int]:
+    """Executes the operations in script_file against input_path.
+
+    input_path is a .mbz archive or an extracted backup directory. An archive
+    is read once into an in-memory session over its metadata and never
+    extracted; a directory is edited in place. Either way the manifest and
+    section files are parsed once and written once, when the script packages
+    the backup or finishes. If output_file is given, the backup is packaged
+    there after the last operation. If an operation fails, everything since
+    the last "package" operation is rolled back; see BackupSession.rollback.
+
+    The script is a JSON list or a .jsonl file of operations, e.g.
+
+        {"op": "add-section", "section_name": "Week 1", "as": "week1"}
+        {"op": "lookup", "section_name": "Intro", "as": "intro"}
+        {"op": "add-page", "section_id": "$week1", "page_title": "Notes"}
+        {"op": "add-page", "section_name": "Intro", "page_title": "Welcome"}
+        {"op": "add-section", "section_name": "Intro", "if_missing": true}
+        {"op": "package", "output": "out.mbz"}
+
+    "as" stores the resulting section ID under a name that later operations
+    can reference as "$name". add-page accepts a section_name instead of a
+    section_id and adds to the first section with that title. add-section with
+    "if_missing" reuses an existing section of the same title. add-page
+    takes "page_content_file" / "page_description_file" like a bulk record.
+    Returns the named IDs.
+    """
+    if os.path.isdir(input_path):
+        if backup_name is None:
+            backup_name = os.path.basename(os.path.normpath(input_path)) + ".mbz"
+        session = BackupSession(input_path, backup_name=backup_name)
+    elif os.path.isfile(input_path):
+        from .mbz_packager import load_metadata_session
+        session = load_metadata_session(input_path, backup_name=backup_name or (os.path.basename(output_file) if output_file else None))
+    else:
+        raise BackupError(f"'{input_path}' does not exist.")
+
+    with metrics.span("run_script"):
+        try:
+            names = apply_script(session, input_path, iter_config_records(script_file))
+            if output_file:
+                _package(session, input_path, output_file)
+            else:
+                session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+    return names
+
+
+def apply_script(session: BackupSession, input_path: str, operations: Iterable[dict]) -> Dict[str, int]:
+    """Runs operations on session in order; see run_script for the format."""
+    names: Dict[str, int] = {}
+    for number, op in enumerate(operations, 1):
+        kind = op.get("op")
+        if kind == "add-section":
+            section_id = -1
+            if op.get("if_missing"):
+                section_id = session.find_section_id_by_name(op["section_name"])
+            if section_id == -1:
+                section_id = session.add_section(op["section_name"], _resolve(names, op.get("section_id"), number))
+            result = section_id
+        elif kind == "lookup":
+            result = session.find_section_id_by_name(op["section_name"])
+            if result == -1 and op.get("required", True):
+                raise BackupError(f"operation {number}: no section named '{op['section_name']}'.")
+        elif kind == "add-page":
+            section_id = _section_for_page(session, names, op, number)
+            result = session.add_page(
+                section_id=str(section_id),
+                page_title=op.get("page_title", "Untitled Page"),
+                page_description=page_text(op, "page_description"),
+                page_content=page_text(op, "page_content")
+            )
+        elif kind == "package":
+            _package(session, input_path, op["output"])
+            continue
+        else:
+            raise BackupError(f"operation {number}: unknown op '{kind}'.")
+        if op.get("as"):
+            names[op["as"]] = result
+        session.flush_new_files()
+    return names
+
+
+def _resolve(names: Dict[str, int], value, number: int):
+    if isinstance(value, str) and value.startswith("$"):
+        if value[1:] not in names:
+            raise BackupError(f"operation {number}: '{value}' is not defined.")
+        return names[value[1:]]
+    return value
+
+
+def _section_for_page(session: BackupSession, names: Dict[str, int], op: dict, number: int):
+    if op.get("section_id") is not None:
+        return _resolve(names, op["section_id"], number)
+    if op.get("section_name") is not None:
+        section_id = session.find_section_id_by_name(op["section_name"])
+        if section_id == -1:
+            raise BackupError(f"operation {number}: no section named '{op['section_name']}'.")
+        return section_id
+    raise BackupError(f"operation {number}: add-page needs a section_id or section_name.")
+
+
+def _package(session: BackupSession, input_path: str, output_file: str) -> None:
+    session.commit()
+    if os.path.isdir(input_path):
+        from .mbz_packager import package_mbz
+        package_mbz(input_path, output_file)
+    else:
+        from .mbz_packager import rewrite_mbz
+        rewrite_mbz(input_path, output_file, session.written)
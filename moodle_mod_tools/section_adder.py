@@ -2,72 +2,30 @@
 """Module for adding sections to a Moodle backup."""
 
 import os
-import shutil
 import argparse
-import time
-import re
-import xml.etree.ElementTree as ET
+import sys
+from typing import Optional
+from . import metrics
+from .backup_index import BackupIndex
+from .backup_session import BackupSession
+from .exceptions import BackupError
+from .tree_clone import COPY_MODES, clone_tree
 
 
-def add_section_to_backup(input_backup: str, output_backup: str, section_name: str, section_id: int = None) -> int:
+def add_section_to_backup(input_backup: str, output_backup: str, section_name: str, section_id: int = None, copy_mode: str = "auto", backup_name: Optional[str] = None) -> int:
     """Copies an uncompressed Moodle backup folder, adds a new section, and updates moodle_backup.xml.
-    Returns the newly created section ID.
+    Returns the newly created section ID. See tree_clone.clone_tree for copy_mode.
+    backup_name is the archive name recorded in the manifest; it defaults to
+    output_backup's directory name plus ".mbz".
     """
     if not os.path.exists(output_backup):
-        shutil.copytree(input_backup, output_backup)
+        with metrics.span("copy"):
+            clone_tree(input_backup, output_backup, copy_mode)
 
-    sections_dir = os.path.join(output_backup, 'sections')
-    existing_ids = []
-    if os.path.isdir(sections_dir):
-        for name in os.listdir(sections_dir):
-            if name.startswith('section_'):
-                attempt = name.split('_')[1]
-                if attempt.isdigit():
-                    existing_ids.append(int(attempt))
-    new_id = 30
-    if existing_ids:
-        new_id = max(existing_ids) + 1
-
-
-    new_section_path = os.path.join(sections_dir, f'section_{new_id}')
-    os.makedirs(new_section_path, exist_ok=True)
-
-    now = int(time.time())
-    section_number = new_id - 8  # naive guess
-
-    section_xml = f"""<?xml version="1.0" encoding="UTF-8"?>\n<section id="{new_id}">\n  <number>{section_number}</number>\n  <name>{section_name}</name>\n  <summary></summary>\n  <summaryformat>1</summaryformat>\n  <sequence></sequence>\n  <visible>1</visible>\n  <availabilityjson>$@NULL@$</availabilityjson>\n  <component>$@NULL@$</component>\n  <itemid>$@NULL@$</itemid>\n  <timemodified>{now}</timemodified>\n</section>\n"""
-    with open(os.path.join(new_section_path, 'section.xml'), 'w', encoding='UTF-8') as f:
-        f.write(section_xml)
-
-    inforef_xml = """<?xml version="1.0" encoding="UTF-8"?>\n<inforef>\n</inforef>\n"""
-    with open(os.path.join(new_section_path, 'inforef.xml'), 'w', encoding='UTF-8') as f:
-        f.write(inforef_xml)
-
-    backup_xml_path = os.path.join(output_backup, 'moodle_backup.xml')
-    with open(backup_xml_path, 'r', encoding='UTF-8') as f:
-        data = f.read()
-
-    new_backup_name = os.path.basename(output_backup) + ".mbz"
-    data = re.sub(r'<name>[^<]*</name>', f'<name>{new_backup_name}</name>', data, 1)
-    data = re.sub(r'<value>[^<]*.mbz</value>', f'<value>{new_backup_name}</value>', data, 1)
-
-    new_section_block = f"""
-        <section>\n          <sectionid>{new_id}</sectionid>\n          <title>{section_name}</title>\n          <directory>sections/section_{new_id}</directory>\n          <parentcmid></parentcmid>\n          <modname></modname>\n        </section>\n    """.strip()
-
-    x = data.find('</sections>')
-    if x != -1:
-        data = data[:x] + new_section_block + "\n" + data[x:]
-
-    new_settings_block = f"""
-      <setting>\n        <level>section</level>\n        <section>section_{new_id}</section>\n        <name>section_{new_id}_included</name>\n        <value>1</value>\n      </setting>\n      <setting>\n        <level>section</level>\n        <section>section_{new_id}</section>\n        <name>section_{new_id}_userinfo</name>\n        <value>0</value>\n      </setting>\n    """.strip()
-    y = data.find('</settings>')
-    if y != -1:
-        data = data[:y] + new_settings_block + "\n" + data[y:]
-
-    with open(backup_xml_path, 'w', encoding='UTF-8') as f:
-        f.write(data)
-
-    print(f"Section created with ID {new_id} and name '{section_name}'")
+    if backup_name is None:
+        backup_name = os.path.basename(output_backup) + ".mbz"
+    with metrics.span("add_section"), BackupSession(output_backup, backup_name=backup_name) as session:
+        new_id = session.add_section(section_name, section_id)
     return new_id
 
 
@@ -75,21 +33,22 @@ def find_section_id_by_name(backup_dir: str, name: str) -> int:
     """
     Searches moodle_backup.xml for a section with <title> == name
     and returns the <sectionid>. Returns -1 if not found.
+
+    Uses the cached BackupIndex, so repeated lookups do not re-parse the
+    manifest until it changes on disk.
     """
-    backup_xml_path = os.path.join(backup_dir, 'moodle_backup.xml')
-    if not os.path.isfile(backup_xml_path):
+    index = BackupIndex.for_backup(backup_dir)
+    if index is None:
         return -1
+    return index.section_id(name)
 
-    tree = ET.parse(backup_xml_path)
-    root = tree.getroot()
-    sections = root.findall("./contents/sections/section")
-    for sect in sections:
-        sec_id_elem = sect.find("sectionid")
-        title_elem = sect.find("title")
-        if sec_id_elem is not None and title_elem is not None:
-            if title_elem.text == name:
-                return int(sec_id_elem.text)
-    return -1
+
+def find_section_ids_by_name(backup_dir: str, names) -> dict:
+    """Bulk form of find_section_id_by_name: maps each name to its section ID, or -1."""
+    index = BackupIndex.for_backup(backup_dir)
+    if index is None:
+        return {name: -1 for name in names}
+    return index.section_ids(names)
 
 def cli_main():
     parser = argparse.ArgumentParser(description="Add a new section to an uncompressed Moodle backup.")
@@ -97,14 +56,20 @@ def cli_main():
     parser.add_argument('--output', required=True)
     parser.add_argument('--section_name', required=True)
     parser.add_argument('--section_id', type=int, default=None)
+    parser.add_argument('--copy_mode', choices=COPY_MODES, default='auto')
     args = parser.parse_args()
 
-    new_id = add_section_to_backup(
-        input_backup=args.input,
-        output_backup=args.output,
-        section_name=args.section_name,
-        section_id=args.section_id
-    )
+    try:
+        new_id = add_section_to_backup(
+            input_backup=args.input,
+            output_backup=args.output,
+            section_name=args.section_name,
+            section_id=args.section_id,
+            copy_mode=args.copy_mode
+        )
+    except BackupError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     print(f"Section with name {args.section_name} has ID = {new_id}")
 
 
@@ -112,15 +77,46 @@ def add_section_from_tar(
     input_tar: str,
     output_tar: str,
     section_name: str,
-    section_id: int = None
+    section_id: int = None,
+    streaming: bool = False,
+    in_memory: bool = False,
+    pipelined: bool = False
 ) -> int:
+    """Adds a section to a .mbz archive, writing the result to output_tar.
+
+    With streaming=True the archive is rewritten member by member; with
+    pipelined=True it is decompressed and recompressed concurrently in a
+    single pass (see pipeline.with_pipelined_tar); with in_memory=True it is
+    loaded into a MemoryWorkspace (see mbz_packager.with_memory_tar);
+    otherwise only its metadata is extracted to a temporary directory.
+    """
+    if pipelined:
+        from .pipeline import with_pipelined_tar
+        with with_pipelined_tar(input_tar, output_tar, backup_name=os.path.basename(output_tar)) as session:
+            new_id = session.add_section(section_name, section_id)
+        return new_id
+
+    if in_memory:
+        from .mbz_packager import with_memory_tar
+        with with_memory_tar(input_tar, output_tar) as workspace:
+            with metrics.span("add_section"), BackupSession(workspace, backup_name=os.path.basename(output_tar)) as session:
+                new_id = session.add_section(section_name, section_id)
+        return new_id
+
+    if streaming:
+        from .mbz_packager import with_streamed_tar
+        with with_streamed_tar(input_tar, output_tar, backup_name=os.path.basename(output_tar)) as session:
+            new_id = session.add_section(section_name, section_id)
+        return new_id
+
     from .mbz_packager import with_extracted_tar
-    with with_extracted_tar(input_tar, output_tar) as extracted_dir:
+    with with_extracted_tar(input_tar, output_tar, lazy=True) as extracted_dir:
         new_id = add_section_to_backup(
             input_backup=extracted_dir,
             output_backup=extracted_dir,
             section_name=section_name,
-            section_id=section_id
+            section_id=section_id,
+            backup_name=os.path.basename(output_tar)
         )
     return new_id
 
@@ -0,0 +1,119 @@
+"""Page text read from files or streams and escaped into XML chunk by chunk."""
+
+import codecs
+import os
+from typing import BinaryIO, Callable, Iterator, List, TextIO, Union
+from xml.sax.saxutils import escape
+
+
+CHUNK_SIZE = 1 << 16
+
+# Marks where a streamed value goes in a rendered template. Renders never
+# contain "\x01", and it is distinct from the slots of a compiled BulkPlan.
+_MARK = "\x01"
+
+
+class ContentFile:
+    """Page text stored in a file, opened only when the page is written."""
+
+    def __init__(self, path: Union[str, os.PathLike], encoding: str = "utf-8"):
+        self.path = os.fspath(path)
+        self.encoding = encoding
+
+    def __repr__(self) -> str:
+        return f"ContentFile({self.path!r})"
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+        with open(self.path, "r", encoding=self.encoding) as f:
+            yield from _read_chunks(f, chunk_size)
+
+
+class ContentStream:
+    """Page text from a readable text or binary (UTF-8) stream, read once when the page is written.
+
+    The stream is read to its end but not closed.
+    """
+
+    def __init__(self, stream: Union[TextIO, BinaryIO]):
+        self.stream = stream
+
+    def __repr__(self) -> str:
+        return f"ContentStream({self.stream!r})"
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+        yield from _read_chunks(self.stream, chunk_size)
+
+
+def _read_chunks(stream: Union[TextIO, BinaryIO], chunk_size: int) -> Iterator[str]:
+    decoder = None
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            # An incremental decoder keeps characters split across reads intact.
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder("utf-8")()
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if decoder is not None:
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+
+ContentSource = Union[ContentFile, ContentStream]
+
+
+def as_content(value) -> Union[str, ContentSource]:
+    """Returns value unchanged if it is a str or a ContentSource; wraps streams in ContentStream."""
+    if isinstance(value, (str, ContentFile, ContentStream)):
+        return value
+    if hasattr(value, "read"):
+        return ContentStream(value)
+    raise TypeError(f"page text must be a str, a ContentFile or a readable stream, not {type(value).__name__}")
+
+
+class StreamedText:
+    """A file's content as literal text parts and ContentSource parts.
+
+    Literal parts are written as they are; sources are read, XML-escaped and
+    written one chunk at a time, so a page body is never held in memory whole.
+    """
+
+    def __init__(self, parts: List[Union[str, ContentSource]]):
+        self.parts = parts
+
+    @classmethod
+    def render(cls, template: Callable[..., str], **values) -> Union[str, "StreamedText"]:
+        """Calls template(**values) with each ContentSource replaced by a marker, then splits on the markers.
+
+        Returns a plain str if no value is a ContentSource.
+        """
+        sources = {}
+        for name, value in values.items():
+            if isinstance(value, (ContentFile, ContentStream)):
+                values[name] = f"{_MARK}{name}{_MARK}"
+                sources[name] = value
+        text = template(**values)
+        if not sources:
+            return text
+        pieces = text.split(_MARK)
+        return cls([sources[piece] if i % 2 else piece for i, piece in enumerate(pieces)])
+
+    def map_text(self, func: Callable[[str], str]) -> "StreamedText":
+        """Returns a copy with func applied to every literal part."""
+        return StreamedText([func(part) if isinstance(part, str) else part for part in self.parts])
+
+    def __mod__(self, values) -> "StreamedText":
+        # Lets a compiled BulkPlan fill its slots the same way as for str templates.
+        return self.map_text(lambda part: part % values)
+
+    def write_to(self, f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+        """Writes the UTF-8 encoded content to f."""
+        for part in self.parts:
+            if isinstance(part, str):
+                f.write(part.encode("UTF-8"))
+                continue
+            for chunk in part.chunks(chunk_size):
+                f.write(escape(chunk).encode("UTF-8"))
@@ -0,0 +1,81 @@
+"""Copy-on-write cloning of extracted backup directories."""
+
+import os
+import shutil
+import sys
+from typing import Callable
+from .exceptions import BackupError
+
+
+# ioctl request number of FICLONE (linux/fs.h): share all extents of one file with another.
+FICLONE = 0x40049409
+
+COPY_MODES = ("auto", "reflink", "hardlink", "copy")
+
+
+def _reflink(src: str, dst: str) -> None:
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _auto_copier() -> Callable[[str, str], None]:
+    """Returns a copy function that settles on the cheapest method that works.
+
+    Reflinks are tried first (Linux only), then hardlinks, then a full copy.
+    Once a method fails it is not tried again for the rest of the tree.
+    """
+    methods = [os.link, shutil.copy2]
+    if sys.platform.startswith("linux"):
+        methods.insert(0, _reflink)
+
+    def copy(src: str, dst: str) -> None:
+        while len(methods) > 1:
+            try:
+                methods[0](src, dst)
+                return
+            except OSError:
+                methods.pop(0)
+        methods[0](src, dst)
+
+    return copy
+
+
+def clone_tree(src: str, dst: str, mode: str = "auto") -> None:
+    """Creates dst as a copy of the backup directory src that shares file data where possible.
+
+    mode is one of:
+      "auto"      reflink each file if the filesystem supports it, otherwise
+                  hardlink it, otherwise copy it
+      "reflink"   reflink every file (btrfs, XFS, ...), failing if unsupported
+      "hardlink"  hardlink every file, failing across filesystems
+      "copy"      a plain shutil.copytree
+
+    Directories are always created afresh, so the cost is one metadata
+    operation per entry rather than a read and write of every byte. Hardlinked
+    files are shared with src, which is safe because BackupSession replaces
+    files rather than writing into them; anything else editing dst in place
+    would also change src.
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"unknown copy mode '{mode}'.")
+    if mode == "copy":
+        copy_function = shutil.copy2
+    elif mode == "reflink":
+        copy_function = _reflink
+    elif mode == "hardlink":
+        copy_function = os.link
+    else:
+        copy_function = _auto_copier()
+    try:
+        shutil.copytree(src, dst, copy_function=copy_function)
+    except shutil.Error as e:
+        shutil.rmtree(dst, ignore_errors=True)
+        source, _, reason = e.args[0][0]
+        raise BackupError(f"could not {mode} '{source}' into '{dst}': {reason}")
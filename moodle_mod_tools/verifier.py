@@ -0,0 +1,202 @@
+"""Cross-checks of a backup's manifest, section.xml sequences and module.xml files."""
+
+import os
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Dict, List, Optional, Set, Union
+from . import metrics
+from .backup_session import MANIFEST
+from .exceptions import BackupError
+from .inspector import parse_manifest
+from .mbz_packager import iter_archive, member_name
+
+
+def _trailing_id(directory: str) -> Optional[str]:
+    """"page_116" -> "116"; None if the name does not end in an ID."""
+    tail = directory.rpartition("_")[2]
+    return tail if tail.isdigit() else None
+
+
+class IntegrityIndex:
+    """Indexes of one backup, filled in one pass and cross-checked with dict lookups.
+
+    Holds the manifest's sections and activities, each section.xml's ID and
+    sequence, each module.xml's ID and section ID, and the section and
+    activity directories present. A sequence entry may name an activity by
+    its directory suffix ("page_116") or by its module.xml ID; backups
+    written by this package use the former, Moodle's own use both.
+    """
+
+    def __init__(self):
+        self.manifest: Optional[dict] = None
+        self.directories: Set[str] = set()
+        self.section_ids: Dict[str, str] = {}
+        self.sequences: Dict[str, List[str]] = {}
+        self.module_ids: Dict[str, str] = {}
+        self.module_sections: Dict[str, str] = {}
+        # Files that are not well-formed XML, with the parser's message.
+        self.malformed: Dict[str, str] = {}
+
+    def add_directory(self, name: str) -> None:
+        """Records a directory such as "sections/section_3" (and nothing deeper)."""
+        parts = name.split("/")
+        if len(parts) >= 2 and parts[0] in ("sections", "activities"):
+            self.directories.add("/".join(parts[:2]))
+
+    def _parse(self, rel: str, data: bytes) -> Optional[ET.Element]:
+        try:
+            return ET.fromstring(data)
+        except ET.ParseError as e:
+            self.malformed[rel] = str(e)
+            return None
+
+    def add_manifest(self, source: Union[str, BinaryIO]) -> None:
+        try:
+            self.manifest = parse_manifest(source)
+        except BackupError as e:
+            # parse_manifest only fails on malformed XML; keep the parser's own message.
+            self.malformed[MANIFEST] = str(e.__cause__ or e)
+
+    def add_section_xml(self, directory: str, data: bytes) -> None:
+        root = self._parse(f"{directory}/section.xml", data)
+        if root is None:
+            return
+        self.section_ids[directory] = root.get("id", "")
+        sequence = root.findtext("sequence") or ""
+        self.sequences[directory] = [entry.strip() for entry in sequence.split(",") if entry.strip()]
+
+    def add_module_xml(self, directory: str, data: bytes) -> None:
+        root = self._parse(f"{directory}/module.xml", data)
+        if root is None:
+            return
+        self.module_ids[directory] = root.get("id", "")
+        self.module_sections[directory] = (root.findtext("sectionid") or "").strip()
+
+    def problems(self) -> List[str]:
+        """Returns a description of every inconsistency found, in a stable order."""
+        problems = [f"'{rel}' is not well-formed XML: {message}." for rel, message in sorted(self.malformed.items())]
+        if self.manifest is None:
+            return problems or ["moodle_backup.xml not found."]
+        manifest_sections = set()
+        for section in self.manifest["sections"]:
+            section_id = section.get("sectionid", "")
+            directory = section.get("directory", "")
+            manifest_sections.add(section_id)
+            if directory not in self.directories:
+                problems.append(f"manifest section {section_id}: directory '{directory}' does not exist.")
+            elif directory not in self.section_ids and f"{directory}/section.xml" not in self.malformed:
+                problems.append(f"manifest section {section_id}: '{directory}/section.xml' does not exist.")
+        manifest_activities = set()
+        for activity in self.manifest["activities"]:
+            module_id = activity.get("moduleid", "")
+            directory = activity.get("directory", "")
+            manifest_activities.add(directory)
+            if directory not in self.directories:
+                problems.append(f"manifest activity {module_id}: directory '{directory}' does not exist.")
+            if activity.get("sectionid", "") not in manifest_sections:
+                problems.append(f"manifest activity {module_id}: section {activity.get('sectionid', '')} is not in the manifest.")
+        for directory in sorted(self.directories):
+            if directory.startswith("activities/") and directory not in manifest_activities:
+                problems.append(f"activity '{directory}' is not in the manifest.")
+
+        # Every name a sequence entry may use for an activity directory.
+        activities: Dict[str, str] = {}
+        for directory in sorted(self.directories):
+            if directory.startswith("activities/"):
+                suffix = _trailing_id(directory)
+                if suffix is not None:
+                    activities.setdefault(suffix, directory)
+        for directory, module_id in sorted(self.module_ids.items()):
+            activities.setdefault(module_id, directory)
+
+        listed_in: Dict[str, str] = {}
+        section_by_id: Dict[str, str] = {}
+        for directory in sorted(self.section_ids):
+            section_id = self.section_ids[directory]
+            section_by_id[section_id] = directory
+            for entry in self.sequences[directory]:
+                activity = activities.get(entry)
+                if activity is None:
+                    problems.append(f"section {section_id}: sequence lists {entry}, which has no activity directory.")
+                elif activity in listed_in:
+                    problems.append(f"section {section_id}: sequence lists {entry}, already listed by section {self.section_ids[listed_in[activity]]}.")
+                else:
+                    listed_in[activity] = directory
+
+        for directory in sorted(self.module_sections):
+            section_id = self.module_sections[directory]
+            if section_id not in section_by_id:
+                problems.append(f"activity '{directory}': module.xml names section {section_id}, which does not exist.")
+            elif directory in listed_in and listed_in[directory] != section_by_id[section_id]:
+                problems.append(f"activity '{directory}': module.xml names section {section_id} but it is listed by section {self.section_ids[listed_in[directory]]}.")
+            elif directory not in listed_in:
+                problems.append(f"activity '{directory}': module.xml names section {section_id}, whose sequence does not list it.")
+        return problems
+
+
+def index_directory(backup_dir: str) -> IntegrityIndex:
+    """Builds an IntegrityIndex from an extracted backup, reading only the files it checks."""
+    index = IntegrityIndex()
+    manifest_path = os.path.join(backup_dir, MANIFEST)
+    if os.path.isfile(manifest_path):
+        index.add_manifest(manifest_path)
+    for top, xml_name, add in (("sections", "section.xml", index.add_section_xml), ("activities", "module.xml", index.add_module_xml)):
+        top_path = os.path.join(backup_dir, top)
+        if not os.path.isdir(top_path):
+            continue
+        for entry in os.scandir(top_path):
+            if not entry.is_dir():
+                continue
+            directory = f"{top}/{entry.name}"
+            index.add_directory(directory)
+            xml_path = os.path.join(entry.path, xml_name)
+            if os.path.isfile(xml_path):
+                with open(xml_path, "rb") as f:
+                    add(directory, f.read())
+                metrics.incr("files_read")
+    return index
+
+
+def index_archive(archive_path: str) -> IntegrityIndex:
+    """Builds an IntegrityIndex from one streaming pass over a tar or ZIP .mbz archive.
+
+    Only moodle_backup.xml, section.xml and module.xml are decompressed into
+    memory; every other member is skipped.
+    """
+    index = IntegrityIndex()
+    for member, open_member in iter_archive(archive_path):
+        name = member_name(member)
+        index.add_directory(name if member.isdir() else name.rpartition("/")[0])
+        if not member.isfile():
+            continue
+        parts = name.split("/")
+        if name == MANIFEST:
+            with open_member() as f:
+                index.add_manifest(f)
+        elif len(parts) == 3 and parts[0] == "sections" and parts[2] == "section.xml":
+            with open_member() as f:
+                index.add_section_xml("/".join(parts[:2]), f.read())
+        elif len(parts) == 3 and parts[0] == "activities" and parts[2] == "module.xml":
+            with open_member() as f:
+                index.add_module_xml("/".join(parts[:2]), f.read())
+    return index
+
+
+def verify_backup(path: str) -> List[str]:
+    """Checks a .mbz archive or extracted backup directory. Returns the problems found (empty if none).
+
+    Checks that manifest sections and activities point at existing
+    directories, that manifest activities belong to manifest sections, that
+    every activity directory is in the manifest, that every section.xml
+    sequence entry names an existing activity listed by no other section,
+    and that every module.xml names an existing section that lists it.
+    """
+    with metrics.span("verify"):
+        index = index_directory(path) if os.path.isdir(path) else index_archive(path)
+        return index.problems()
+
+
+def check_backup(path: str) -> None:
+    """Raises BackupError listing the problems verify_backup finds, if any."""
+    problems = verify_backup(path)
+    if problems:
+        raise BackupError(f"'{path}' failed verification:\n  " + "\n  ".join(problems))
@@ -0,0 +1,314 @@
+"""Storage backends for the files of a backup being edited.
+
+A workspace maps backup-relative paths ("sections/section_3/section.xml") to
+file content. BackupSession does all of its I/O through one, so the same
+editing code runs against an extracted directory or against files held in
+memory.
+"""
+
+import abc
+import contextlib
+import io
+import itertools
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+from typing import BinaryIO, ContextManager, Dict, Iterable, Iterator, Optional
+from . import metrics
+from .id_allocator import CONTEXT_HEAD_SIZE, IdAllocator, allocator_for, context_id_from_head, remember
+
+
+# Above this many bytes of content a MemoryWorkspace moves its files to disk.
+DEFAULT_SPILL_THRESHOLD = 50 << 20
+
+
+class Workspace(abc.ABC):
+    """Interface shared by DirectoryWorkspace and MemoryWorkspace.
+
+    A backend missing any abstract method cannot be instantiated.
+    """
+
+    @abc.abstractmethod
+    def read(self, rel: str) -> bytes:
+        """The content of file rel."""
+
+    @abc.abstractmethod
+    def open(self, rel: str) -> BinaryIO:
+        """File rel opened for binary reading."""
+
+    @abc.abstractmethod
+    def isfile(self, rel: str) -> bool:
+        """True if rel is a file."""
+
+    @abc.abstractmethod
+    def isdir(self, rel: str) -> bool:
+        """True if rel is a directory."""
+
+    @abc.abstractmethod
+    def open_for_write(self, rel: str) -> ContextManager[BinaryIO]:
+        """Yields a file to write rel's new content into; it replaces rel on a clean exit."""
+
+    def write(self, rel: str, data: bytes) -> None:
+        with self.open_for_write(rel) as f:
+            f.write(data)
+
+    @abc.abstractmethod
+    def remove(self, rel: str) -> None:
+        """Deletes file rel, and any parent directories it leaves empty below the top level."""
+
+    @abc.abstractmethod
+    def allocator(self) -> IdAllocator:
+        """An IdAllocator over the IDs already used in this workspace."""
+
+    def remember_ids(self, allocator: IdAllocator) -> None:
+        """Called after a commit so the allocator can be reused for this workspace."""
+
+    def close(self) -> None:
+        """Releases any temporary storage."""
+
+
+class DirectoryWorkspace(Workspace):
+    """An extracted backup directory on disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f"DirectoryWorkspace({self.path!r})"
+
+    def read(self, rel: str) -> bytes:
+        with open(os.path.join(self.path, rel), "rb") as f:
+            data = f.read()
+        metrics.incr("files_read")
+        metrics.incr("bytes_read", len(data))
+        return data
+
+    def open(self, rel: str) -> BinaryIO:
+        metrics.incr("files_read")
+        return open(os.path.join(self.path, rel), "rb")
+
+    def isfile(self, rel: str) -> bool:
+        return os.path.isfile(os.path.join(self.path, rel))
+
+    def isdir(self, rel: str) -> bool:
+        return os.path.isdir(os.path.join(self.path, rel))
+
+    @contextlib.contextmanager
+    def open_for_write(self, rel: str) -> Iterator[BinaryIO]:
+        """Writes through a sibling temp file that is renamed over the target.
+
+        A file hardlinked from another backup (see tree_clone) is therefore
+        replaced, never modified, and readers never see a partial file.
+        """
+        path = os.path.join(self.path, rel)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+                size = f.tell()
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        metrics.incr("files_written")
+        metrics.incr("bytes_written", size)
+
+    def remove(self, rel: str) -> None:
+        os.remove(os.path.join(self.path, rel))
+        parent = posixpath.dirname(rel)
+        while "/" in parent:
+            try:
+                os.rmdir(os.path.join(self.path, parent))
+            except OSError:
+                break
+            parent = posixpath.dirname(parent)
+
+    def allocator(self) -> IdAllocator:
+        return allocator_for(self.path)
+
+    def remember_ids(self, allocator: IdAllocator) -> None:
+        remember(self.path, allocator)
+
+
+class MemoryWorkspace(Workspace):
+    """Backup files held in a dict, moved to a temporary directory once they outgrow spill_threshold.
+
+    files maps paths to content; dirs lists directories known to exist
+    (parents of files are added automatically). Every write is also recorded
+    in written, in the order it happened. members optionally maps paths to the
+    TarInfo they came from, so a packaged copy keeps their modes and times.
+
+    With spill_threshold set, the first write that takes the total content
+    past it copies everything into a temporary directory; from then on the
+    workspace behaves as a DirectoryWorkspace over that directory (spilled_dir)
+    until close() removes it.
+    """
+
+    def __init__(self, files: Optional[Dict[str, bytes]] = None, dirs: Iterable[str] = (), spill_threshold: Optional[int] = None, members: Optional[Dict[str, tarfile.TarInfo]] = None):
+        self.files: Dict[str, bytes] = files if files is not None else {}
+        self.dirs = set(dirs)
+        self.members: Dict[str, tarfile.TarInfo] = members if members is not None else {}
+        self.written: Dict[str, bytes] = {}
+        self.spill_threshold = spill_threshold
+        self.size = sum(len(data) for data in self.files.values())
+        self._spilled: Optional[DirectoryWorkspace] = None
+        for name in self.files:
+            self._add_parents(name)
+        self._check_spill()
+
+    def __repr__(self) -> str:
+        if self._spilled is not None:
+            return f"MemoryWorkspace(spilled to {self._spilled.path!r})"
+        return f"MemoryWorkspace({len(self.files)} files, {self.size} bytes)"
+
+    @property
+    def spilled_dir(self) -> Optional[str]:
+        """The directory the files were moved to, or None while they are in memory."""
+        return self._spilled.path if self._spilled is not None else None
+
+    def _add_parents(self, name: str) -> None:
+        parent = posixpath.dirname(name)
+        while parent and parent not in self.dirs:
+            self.dirs.add(parent)
+            parent = posixpath.dirname(parent)
+
+    def _check_spill(self) -> None:
+        if self._spilled is None and self.spill_threshold is not None and self.size > self.spill_threshold:
+            self.spill()
+
+    def spill(self) -> None:
+        """Moves every file to a temporary directory and serves further I/O from there."""
+        path = tempfile.mkdtemp()
+        with metrics.span("workspace.spill"):
+            for name in sorted(self.dirs):
+                os.makedirs(os.path.join(path, name), exist_ok=True)
+            for name, data in self.files.items():
+                self._spill_file(path, name, data)
+            for name, info in self.members.items():
+                if info.issym() or info.islnk():
+                    self._spill_link(path, name, info)
+        self._spilled = DirectoryWorkspace(path)
+        self.files = {}
+        metrics.incr("workspace_spills")
+
+    def _spill_file(self, path: str, name: str, data: bytes) -> None:
+        target = os.path.join(path, name)
+        with open(target, "wb") as f:
+            f.write(data)
+        info = self.members.get(name)
+        if info is not None:
+            os.chmod(target, info.mode)
+            os.utime(target, (info.mtime, info.mtime))
+
+    @staticmethod
+    def _spill_link(path: str, name: str, info: tarfile.TarInfo) -> None:
+        target = os.path.join(path, name)
+        if info.issym():
+            os.symlink(info.linkname, target)
+        else:
+            linkname = info.linkname
+            while linkname.startswith("./"):
+                linkname = linkname[2:]
+            os.link(os.path.join(path, linkname), target)
+
+    def load_member(self, name: str, info: tarfile.TarInfo, data: Optional[bytes] = None) -> None:
+        """Adds an archive member read from the source backup, without recording it as written.
+
+        data is the content of a regular file. Members are kept in the order
+        they are loaded so package_workspace can write them back in it.
+        """
+        self.members[name] = info
+        if info.isdir():
+            self.dirs.add(name)
+            self._add_parents(name)
+            if self._spilled is not None:
+                os.makedirs(os.path.join(self._spilled.path, name), exist_ok=True)
+        elif data is not None:
+            self._add_parents(name)
+            if self._spilled is not None:
+                os.makedirs(os.path.dirname(os.path.join(self._spilled.path, name)), exist_ok=True)
+                self._spill_file(self._spilled.path, name, data)
+                return
+            self.files[name] = data
+            self.size += len(data)
+            self._check_spill()
+        elif self._spilled is not None and (info.issym() or info.islnk()):
+            self._spill_link(self._spilled.path, name, info)
+
+    def read(self, rel: str) -> bytes:
+        if self._spilled is not None:
+            return self._spilled.read(rel)
+        if rel not in self.files:
+            raise FileNotFoundError(f"{rel} not found.")
+        return self.files[rel]
+
+    def open(self, rel: str) -> BinaryIO:
+        if self._spilled is not None:
+            return self._spilled.open(rel)
+        return io.BytesIO(self.read(rel))
+
+    def isfile(self, rel: str) -> bool:
+        if self._spilled is not None:
+            return self._spilled.isfile(rel)
+        return rel in self.files
+
+    def isdir(self, rel: str) -> bool:
+        if self._spilled is not None:
+            return self._spilled.isdir(rel)
+        return rel in self.dirs
+
+    @contextlib.contextmanager
+    def open_for_write(self, rel: str) -> Iterator[BinaryIO]:
+        buffer = io.BytesIO()
+        yield buffer
+        self.write(rel, buffer.getvalue())
+
+    def write(self, rel: str, data: bytes) -> None:
+        self.written[rel] = data
+        if self._spilled is not None:
+            self._spilled.write(rel, data)
+            return
+        self.size += len(data) - len(self.files.get(rel, b""))
+        self.files[rel] = data
+        self._add_parents(rel)
+        self._check_spill()
+
+    def remove(self, rel: str) -> None:
+        self.written.pop(rel, None)
+        if self._spilled is not None:
+            self._spilled.remove(rel)
+            return
+        self.size -= len(self.files.pop(rel))
+        parent = posixpath.dirname(rel)
+        while "/" in parent and not any(name.startswith(parent + "/") for name in itertools.chain(self.files, self.dirs)):
+            self.dirs.discard(parent)
+            parent = posixpath.dirname(parent)
+
+    def allocator(self) -> IdAllocator:
+        if self._spilled is not None:
+            return self._spilled.allocator()
+        section_dirs = set()
+        activity_dirs = set()
+        for name in self.dirs:
+            parts = name.split("/")
+            if len(parts) == 2 and parts[0] == "sections":
+                section_dirs.add(parts[1])
+            elif len(parts) == 2 and parts[0] == "activities":
+                activity_dirs.add(parts[1])
+        context_ids = []
+        for entry in activity_dirs:
+            head = self.files.get(f"activities/{entry}/{entry.rpartition('_')[0]}.xml", b"")[:CONTEXT_HEAD_SIZE]
+            context_id = context_id_from_head(head)
+            if context_id is not None:
+                context_ids.append(context_id)
+        manifest = self.files.get("moodle_backup.xml", b"").decode("UTF-8")
+        return IdAllocator.from_listing(section_dirs, activity_dirs, manifest, context_ids)
+
+    def close(self) -> None:
+        if self._spilled is not None:
+            shutil.rmtree(self._spilled.path, ignore_errors=True)
@@ -0,0 +1,133 @@
+"""ZIP-format .mbz archives: random-access reads and append-only in-place updates."""
+
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+import zlib
+from typing import Dict, Iterable, Set, Tuple
+from . import metrics
+
+
+# Leading bytes of a ZIP: a local file header, or the end record of an empty archive.
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+
+
+def is_zip_archive(path: str) -> bool:
+    """True if path is a ZIP archive rather than a gzip'd tar (Moodle restores both).
+
+    Decided by the leading magic bytes. zipfile.is_zipfile looks for an end
+    record anywhere near the end of the file, which compressed tar data can
+    contain by chance.
+    """
+    with open(path, "rb") as f:
+        return f.read(4) in ZIP_MAGIC
+
+
+def zip_entry_name(filename: str) -> str:
+    """Entry name relative to the backup root, as mbz_packager.member_name gives for tar members."""
+    while filename.startswith("./"):
+        filename = filename[2:]
+    return filename.rstrip("/")
+
+
+def zip_tarinfo(info: zipfile.ZipInfo) -> tarfile.TarInfo:
+    """A TarInfo describing a ZIP entry, so tar-oriented code can treat both formats alike."""
+    member = tarfile.TarInfo(info.filename)
+    member.size = info.file_size
+    member.mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+    if info.is_dir():
+        member.type = tarfile.DIRTYPE
+        member.mode = (info.external_attr >> 16) & 0o7777 or 0o755
+    else:
+        member.mode = (info.external_attr >> 16) & 0o7777 or 0o644
+    return member
+
+
+def write_zip(entries: Iterable[Tuple[str, str]], output_file: str, compresslevel: int = 9) -> None:
+    """Writes the (path, arcname) pairs of entries, as from mbz_packager.iter_members, to a new ZIP."""
+    with metrics.span("package.zip"), zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        for path, arcname in entries:
+            zf.write(path, arcname)
+    metrics.incr("bytes_written", os.path.getsize(output_file))
+
+
+def extract_zip(archive_path: str, output_dir: str, wanted=None) -> Set[str]:
+    """Extracts the entries of archive_path for which wanted(name) is true (all by default).
+
+    Returns the names extracted, without trailing slashes. ZipFile.extract
+    already keeps every entry inside output_dir.
+    """
+    extracted = set()
+    with metrics.span("extract.zip"), zipfile.ZipFile(archive_path) as zf:
+        for info in zf.infolist():
+            name = zip_entry_name(info.filename)
+            if wanted is None or wanted(name):
+                zf.extract(info, output_dir)
+                metrics.incr("bytes_read", info.compress_size)
+                extracted.add(name)
+    return extracted
+
+
+def update_zip(path: str, replacements: Dict[str, bytes], deletions: Iterable[str] = (), compresslevel: int = 9) -> None:
+    """Applies replacements (name -> new content) and deletions to the ZIP at path in place.
+
+    Names are relative to the backup root, as given by member_name. New and
+    changed entries are compressed and appended after the existing
+    data, followed by a fresh central directory that omits replaced and
+    deleted entries. Nothing already in the file is read, recompressed or
+    overwritten, so the cost is the size of the change plus the central
+    directory. Superseded entries stay behind as unreferenced bytes until
+    the archive is next packaged from scratch. If the update fails, the file
+    is truncated back to its original length.
+    """
+    original_size = os.path.getsize(path)
+    date_time = time.localtime()[:6]
+    dropped = set(deletions) | set(replacements)
+    try:
+        with metrics.span("package.zip_update"), zipfile.ZipFile(path, "a", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+            # ZipFile appends over the old central directory; start past it
+            # instead so the original bytes stay valid until the new end record lands.
+            zf.fp.seek(0, os.SEEK_END)
+            zf.start_dir = zf.fp.tell()
+            removed = [info for info in zf.filelist if zip_entry_name(info.filename) in dropped]
+            modes = {zip_entry_name(info.filename): info.external_attr for info in removed}
+            zf.filelist = [info for info in zf.filelist if zip_entry_name(info.filename) not in dropped]
+            for info in removed:
+                zf.NameToInfo.pop(info.filename, None)
+            if dropped:
+                # Make sure a deletion-only update still writes a new central directory.
+                zf._didModify = True
+            for name, data in replacements.items():
+                info = zipfile.ZipInfo(name, date_time)
+                info.external_attr = modes.get(name, 0o644 << 16)
+                zf.writestr(info, data, zipfile.ZIP_DEFLATED, compresslevel)
+    except BaseException:
+        with open(path, "r+b") as f:
+            f.truncate(original_size)
+        raise
+    metrics.incr("bytes_written", os.path.getsize(path) - original_size)
+
+
+def update_zip_copy(input_zip: str, output_zip: str, replacements: Dict[str, bytes], deletions: Iterable[str] = (), compresslevel: int = 9) -> None:
+    """update_zip applied to output_zip, which is first made a copy of input_zip unless they are the same file."""
+    if not (os.path.exists(output_zip) and os.path.samefile(input_zip, output_zip)):
+        with metrics.span("package.copy"):
+            shutil.copyfile(input_zip, output_zip)
+    update_zip(output_zip, replacements, deletions, compresslevel)
+
+
+def zip_entry_matches(zf: zipfile.ZipFile, name: str, path: str) -> bool:
+    """True if the file at path has the same size and CRC-32 as entry name, without decompressing the entry."""
+    try:
+        info = zf.getinfo(name)
+    except KeyError:
+        return False
+    if info.file_size != os.path.getsize(path):
+        return False
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc == info.CRC
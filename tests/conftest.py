@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from synthetic_backup import generate_backup  # noqa: E402
+
+
+@pytest.fixture
+def backup_dir(tmp_path):
+    """A small synthetic extracted backup: two sections, six activities, no files/."""
+    return generate_backup(str(tmp_path / "backup"), sections=2, activities=6, files=0)
+
+
+def snapshot(path):
+    """Maps every file under path to its content."""
+    tree = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            with open(full, "rb") as f:
+                tree[os.path.relpath(full, path).replace(os.sep, "/")] = f.read()
+    return tree
@@ -0,0 +1,62 @@
+"""Re-running a bulk config applies only the entries that are new or changed since the last run."""
+
+import json
+import os
+
+from moodle_mod_tools.applied_log import EntryKeys, entry_hash
+from moodle_mod_tools.backup_session import APPLIED_LOG
+from moodle_mod_tools.bulk_adder import bulk_add_from_json
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.verifier import verify_backup
+
+from conftest import snapshot
+
+
+def run(backup_dir, tmp_path, config):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    bulk_add_from_json(backup_dir, backup_dir, str(path))
+    assert verify_backup(backup_dir) == []
+    info = inspect_mbz(backup_dir)
+    return [section["title"] for section in info["sections"]], [activity["title"] for activity in info["activities"]]
+
+
+def test_rerun_applies_only_the_delta(backup_dir, tmp_path):
+    config = [{"section_name": "Week A", "pages": [{"page_title": "One"}, {"page_title": "One"}]}]
+    sections, pages = run(backup_dir, tmp_path, config)
+    # An identical entry repeated in one config is applied each time it appears.
+    assert sections.count("Week A") == 1 and pages.count("One") == 2
+    first = snapshot(backup_dir)
+
+    assert run(backup_dir, tmp_path, config) == (sections, pages)
+    assert snapshot(backup_dir) == first
+
+    config[0]["pages"].append({"page_title": "Two"})
+    assert run(backup_dir, tmp_path, config) == (sections, pages + ["Two"])
+
+
+def test_changed_section_is_applied_again(backup_dir, tmp_path):
+    run(backup_dir, tmp_path, [{"section_name": "Week A", "pages": [{"page_title": "One"}]}])
+    sections, pages = run(backup_dir, tmp_path, [{"section_name": "Week B", "pages": [{"page_title": "One"}]}])
+    # What the old entry created is left in place.
+    assert sections[-2:] == ["Week A", "Week B"]
+    assert pages.count("One") == 2
+    with open(os.path.join(backup_dir, APPLIED_LOG), encoding="utf-8") as f:
+        log = json.load(f)
+    assert log["version"] == 1
+    assert sorted(entry["type"] for entry in log["applied"].values()) == ["page", "page", "section", "section"]
+
+
+def test_entry_keys(tmp_path):
+    body = tmp_path / "body.html"
+    body.write_text("<p>x</p>", encoding="utf-8")
+    page = {"page_title": "One", "page_content_file": str(body)}
+    assert entry_hash(page, "s1") != entry_hash(page, "s2")
+    assert entry_hash(dict(page, type="page"), "s1") == entry_hash(page, "s1")
+    before = entry_hash(page, "s1")
+    body.write_text("<p>y</p>", encoding="utf-8")
+    assert entry_hash(page, "s1") != before
+
+    keys = EntryKeys()
+    first, second = keys.key(page, "s1"), keys.key(page, "s1")
+    assert second == first + "#1"
@@ -0,0 +1,41 @@
+"""BackupIndex lookups, cached per backup and rebuilt when moodle_backup.xml changes."""
+
+import os
+
+from moodle_mod_tools.backup_index import BackupIndex
+from moodle_mod_tools.section_adder import add_section_to_backup, find_section_id_by_name, find_section_ids_by_name
+
+
+def test_lookups(backup_dir):
+    index = BackupIndex.for_backup(backup_dir)
+    assert index.section_ids(["Section 1", "Section 2", "Missing"]) == {"Section 1": 1, "Section 2": 2, "Missing": -1}
+    assert index.section_directories([1, 99]) == {1: "sections/section_1", 99: None}
+    assert index.section_activities([1, 2, 99]) == {1: [1000, 1002, 1004], 2: [1001, 1003, 1005], 99: []}
+
+
+def test_index_is_cached_until_the_manifest_changes(backup_dir):
+    index = BackupIndex.for_backup(backup_dir)
+    assert BackupIndex.for_backup(backup_dir) is index
+    section_id = add_section_to_backup(backup_dir, backup_dir, "Week A")
+    assert BackupIndex.for_backup(backup_dir) is not index
+    assert find_section_id_by_name(backup_dir, "Week A") == section_id
+    assert find_section_ids_by_name(backup_dir, ["Week A", "Section 2"]) == {"Week A": section_id, "Section 2": 2}
+
+
+def test_replaced_manifest_is_reread(backup_dir):
+    assert find_section_id_by_name(backup_dir, "Section 1") == 1
+    manifest = os.path.join(backup_dir, "moodle_backup.xml")
+    with open(manifest, encoding="utf-8") as f:
+        text = f.read()
+    # Same size, so only the mtime or inode can tell the two manifests apart.
+    with open(manifest + ".new", "w", encoding="utf-8") as f:
+        f.write(text.replace("<title>Section 1</title>", "<title>Section X</title>"))
+    os.replace(manifest + ".new", manifest)
+    assert find_section_id_by_name(backup_dir, "Section 1") == -1
+    assert find_section_id_by_name(backup_dir, "Section X") == 1
+
+
+def test_backup_without_manifest(tmp_path):
+    assert BackupIndex.for_backup(str(tmp_path)) is None
+    assert find_section_id_by_name(str(tmp_path), "Section 1") == -1
+    assert find_section_ids_by_name(str(tmp_path), ["Section 1"]) == {"Section 1": -1}
@@ -0,0 +1,76 @@
+"""bulk_add_many: many archives through one compiled plan, output checks and per-archive errors."""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from moodle_mod_tools.batch_runner import bulk_add_many, check_outputs, expand_inputs
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import package_mbz
+from moodle_mod_tools.verifier import verify_backup
+
+
+@pytest.fixture
+def archives(backup_dir, tmp_path):
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    paths = []
+    for name in ("a.mbz", "b.mbz", "c.mbz"):
+        package_mbz(backup_dir, str(inputs / name))
+        paths.append(str(inputs / name))
+    return paths
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps([{"section_name": "Week A", "pages": [{"page_title": "Batch page"}]}]), encoding="utf-8")
+    return str(path)
+
+
+def test_bulk_add_many(archives, config, tmp_path):
+    output_dir = str(tmp_path / "out")
+    results = bulk_add_many(config, archives, output_dir, workers=2)
+    assert [result["status"] for result in results] == ["ok"] * 3
+    assert [result["input"] for result in results] == archives
+    for result in results:
+        assert verify_backup(result["output"]) == []
+        info = inspect_mbz(result["output"])
+        assert info["information"]["name"] == os.path.basename(result["input"])
+        assert "Batch page" in [activity["title"] for activity in info["activities"]]
+
+
+def test_failing_archive_does_not_stop_the_batch(archives, config, tmp_path):
+    broken = tmp_path / "in" / "broken.mbz"
+    broken.write_bytes(b"not an archive")
+    inputs = [archives[0], str(broken), archives[1]]
+    results = bulk_add_many(config, inputs, str(tmp_path / "out"), workers=2)
+    assert [result["status"] for result in results] == ["ok", "error", "ok"]
+    assert results[1]["error"]
+    assert not os.path.exists(results[1]["output"])
+    assert verify_backup(results[2]["output"]) == []
+
+
+def test_colliding_outputs_are_rejected(archives, config, tmp_path):
+    other = tmp_path / "other"
+    other.mkdir()
+    duplicate = str(other / "a.mbz")
+    shutil.copy(archives[0], duplicate)
+    with pytest.raises(BackupError, match="would both be written"):
+        bulk_add_many(config, [archives[0], duplicate], str(tmp_path / "out"))
+    assert not os.path.exists(tmp_path / "out")
+
+
+def test_output_over_input_is_rejected(archives):
+    with pytest.raises(BackupError, match="overwritten by its own output"):
+        check_outputs(archives, archives)
+
+
+def test_expand_inputs(archives, tmp_path):
+    manifest = tmp_path / "list.txt"
+    manifest.write_text(f"# courses\n\n{archives[2]}\n{archives[0]}\n", encoding="utf-8")
+    pattern = os.path.join(os.path.dirname(archives[0]), "*.mbz")
+    assert expand_inputs([pattern], str(manifest)) == archives
@@ -0,0 +1,102 @@
+"""Bulk configs: streamed JSONL records, failed runs and the archive modes."""
+
+import json
+
+import pytest
+
+from moodle_mod_tools.backup_session import BackupSession
+from moodle_mod_tools.bulk_adder import apply_bulk_records, bulk_add_from_json, bulk_add_from_tar, iter_config_records
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import package_mbz
+from moodle_mod_tools.section_adder import add_section_from_tar
+from moodle_mod_tools.workspace import MemoryWorkspace
+from moodle_mod_tools.verifier import verify_backup
+
+from conftest import snapshot
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+    return str(path)
+
+
+FAILS_ON_LINE_3 = [
+    {"section_name": "Week A", "pages": [{"page_title": "One"}]},
+    {"page_title": "Two"},
+    {"page_title": "Nowhere", "section_id": 99},
+]
+
+
+def test_jsonl_records_are_read_lazily(tmp_path):
+    config = tmp_path / "config.jsonl"
+    config.write_text('{"section_name": "A"}\nnot json\n', encoding="utf-8")
+    records = iter_config_records(str(config))
+    assert next(records) == {"section_name": "A"}
+    with pytest.raises(BackupError, match=":2: invalid JSON record"):
+        next(records)
+
+
+def test_jsonl_run(backup_dir, tmp_path):
+    config = write_jsonl(tmp_path / "config.jsonl", FAILS_ON_LINE_3[:2])
+    bulk_add_from_json(backup_dir, backup_dir, config)
+    assert verify_backup(backup_dir) == []
+    with open(f"{backup_dir}/moodle_backup.xml", encoding="utf-8") as f:
+        manifest = f.read()
+    assert "<title>One</title>" in manifest and "<title>Two</title>" in manifest
+
+
+def test_failed_run_leaves_backup_untouched(backup_dir, tmp_path):
+    before = snapshot(backup_dir)
+    config = write_jsonl(tmp_path / "config.jsonl", FAILS_ON_LINE_3)
+    with pytest.raises(BackupError, match="section 99 does not exist"):
+        bulk_add_from_json(backup_dir, backup_dir, config)
+    assert snapshot(backup_dir) == before
+    assert verify_backup(backup_dir) == []
+
+
+def test_failed_run_keeps_checkpointed_records(backup_dir, tmp_path):
+    config = write_jsonl(tmp_path / "config.jsonl", FAILS_ON_LINE_3)
+    with pytest.raises(BackupError):
+        bulk_add_from_json(backup_dir, backup_dir, config, checkpoint_every=1)
+    assert verify_backup(backup_dir) == []
+    checkpointed = snapshot(backup_dir)
+    assert b"<title>Two</title>" in checkpointed["moodle_backup.xml"]
+
+    fixed = write_jsonl(tmp_path / "fixed.jsonl", FAILS_ON_LINE_3[:2])
+    bulk_add_from_json(backup_dir, backup_dir, fixed)
+    assert snapshot(backup_dir) == checkpointed
+
+
+def test_failed_session_rolls_back_memory_workspace():
+    workspace = MemoryWorkspace({"sections/section_1/section.xml": b"<section><sequence></sequence></section>"})
+    files_before = dict(workspace.files)
+    with pytest.raises(BackupError):
+        with BackupSession(workspace) as session:
+            apply_bulk_records(session, [{"page_title": "Kept until failure", "section_id": 1}, {"page_title": "Fails", "section_id": 7}], idempotent=False)
+    assert workspace.files == files_before
+    assert {name for name in workspace.dirs if name.startswith("activities/")} == set()
+    assert workspace.written == {}
+
+
+ARCHIVE_MODES = {
+    "lazy": {},
+    "streaming": {"streaming": True},
+    "in_memory": {"in_memory": True},
+    "pipelined": {"pipelined": True},
+}
+
+
+@pytest.mark.parametrize("mode", list(ARCHIVE_MODES))
+@pytest.mark.parametrize("adder", ["bulk_add", "add_section"])
+def test_every_mode_records_the_output_name(backup_dir, tmp_path, mode, adder):
+    archive = str(tmp_path / "input.mbz")
+    package_mbz(backup_dir, archive)
+    output = str(tmp_path / "renamed.mbz")
+    if adder == "bulk_add":
+        bulk_add_from_tar(archive, output, write_jsonl(tmp_path / "config.jsonl", FAILS_ON_LINE_3[:2]), **ARCHIVE_MODES[mode])
+    else:
+        add_section_from_tar(archive, output, "Week A", **ARCHIVE_MODES[mode])
+    manifest = inspect_mbz(output)
+    assert manifest["information"]["name"] == "renamed.mbz"
+    assert [setting["value"] for setting in manifest["settings"] if setting.get("name") == "filename"] == ["renamed.mbz"]
@@ -0,0 +1,59 @@
+"""Compiled bulk plans produce the same backups as applying the config directly."""
+
+import json
+import re
+
+import pytest
+
+from moodle_mod_tools.bulk_adder import bulk_add_from_json
+from moodle_mod_tools.bulk_plan import apply_plan_to_dir, apply_plan_to_tar, compile_plan
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import decompress_mbz, package_mbz
+from moodle_mod_tools.tree_clone import clone_tree
+
+from conftest import snapshot
+
+
+def _mask_times(tree):
+    return {name: re.sub(rb"<timemodified>\d+</timemodified>", b"<timemodified>0</timemodified>", data) for name, data in tree.items()}
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps([
+        {"section_name": "Week A", "pages": [{"page_title": "One", "page_content": "<p>100% & more</p>"}, {"page_title": "Two"}]},
+        {"section_name": "Week B", "section_id": 2, "pages": [{"page_title": "Into section 2"}]},
+    ]), encoding="utf-8")
+    return str(path)
+
+
+def test_plan_matches_direct_apply(backup_dir, tmp_path, config):
+    direct = str(tmp_path / "direct")
+    clone_tree(backup_dir, direct, "copy")
+    bulk_add_from_json(direct, direct, config, backup_name="course.mbz")
+    planned = str(tmp_path / "planned")
+    clone_tree(backup_dir, planned, "copy")
+    plan = compile_plan(config)
+    apply_plan_to_dir(plan, planned, backup_name="course.mbz")
+    assert _mask_times(snapshot(planned)) == _mask_times(snapshot(direct))
+
+    # The applied log makes a second application a no-op.
+    before = snapshot(planned)
+    apply_plan_to_dir(plan, planned, backup_name="course.mbz")
+    assert snapshot(planned) == before
+
+
+def test_one_plan_many_backups(backup_dir, tmp_path, config):
+    plan = compile_plan(config)
+    archive = str(tmp_path / "input.mbz")
+    package_mbz(backup_dir, archive)
+    trees = []
+    for n, mode in enumerate([{}, {"streaming": True}, {"in_memory": True}, {"pipelined": True}]):
+        output = str(tmp_path / f"course_{n}.mbz")
+        apply_plan_to_tar(plan, archive, output, **mode)
+        assert inspect_mbz(output)["information"]["name"] == f"course_{n}.mbz"
+        decompress_mbz(output, str(tmp_path / f"course_{n}"))
+        tree = _mask_times(snapshot(str(tmp_path / f"course_{n}")))
+        trees.append({name: data.replace(f"course_{n}.mbz".encode(), b"course.mbz") for name, data in tree.items()})
+    assert all(tree == trees[0] for tree in trees[1:])
@@ -0,0 +1,141 @@
+"""The backup daemon over HTTP: authentication, edits, and what happens to unsaved changes."""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from moodle_mod_tools.daemon import daemon_request, serve
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import package_mbz
+from moodle_mod_tools.verifier import verify_backup
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    """A running daemon on a free port; yields (url, token_file) and shuts it down afterwards."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    token_file = str(tmp_path / "daemon.token")
+    thread = threading.Thread(target=serve, args=("127.0.0.1", port, token_file), daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not os.path.exists(token_file):
+        assert time.time() < deadline, "daemon did not start"
+        time.sleep(0.01)
+    url = f"http://127.0.0.1:{port}"
+    yield url, token_file
+    if thread.is_alive():
+        daemon_request(url, "shutdown", token_file=token_file)
+        thread.join(10)
+
+
+def send(url, token_file, command, **payload):
+    return daemon_request(url, command, payload, token_file)
+
+
+def raw_post(url, headers, body=b"{}"):
+    request = urllib.request.Request(url + "/open", data=body, headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def section_titles(path):
+    return [section["title"] for section in inspect_mbz(path)["sections"]]
+
+
+def test_requests_without_the_token_are_refused(daemon):
+    url, token_file = daemon
+    with open(token_file, encoding="utf-8") as f:
+        token = f.read()
+    assert oct(os.stat(token_file).st_mode & 0o777) == "0o600"
+    json_type = {"Content-Type": "application/json"}
+    assert raw_post(url, json_type)[0] == 401
+    assert raw_post(url, {**json_type, "Authorization": "Bearer wrong"})[0] == 401
+    assert raw_post(url, {"Content-Type": "text/plain", "Authorization": f"Bearer {token}"})[0] == 415
+    assert raw_post(url, {**json_type, "Authorization": f"Bearer {token}", "Origin": "http://example.com"})[0] == 403
+    assert raw_post(url, {**json_type, "Authorization": f"Bearer {token}"}, b"[]") == (400, {"error": "the request body must be a JSON object."})
+
+
+def test_errors_come_back_as_backup_errors(daemon, backup_dir):
+    url, token_file = daemon
+    with pytest.raises(BackupError, match="section 99 does not exist"):
+        send(url, token_file, "add-page", path=backup_dir, section_id=99, page_title="Nowhere")
+    with pytest.raises(BackupError, match="unknown command"):
+        send(url, token_file, "frobnicate", path=backup_dir)
+
+
+def test_add_page_then_package(daemon, backup_dir, tmp_path):
+    url, token_file = daemon
+    section_id = send(url, token_file, "add-section", path=backup_dir, section_name="Week A")["section_id"]
+    assert send(url, token_file, "lookup", path=backup_dir, section_name="Week A")["section_id"] == section_id
+    reply = send(url, token_file, "add-page", path=backup_dir, section_id=section_id, page_title="Daemon page")
+    assert "Daemon page" in reply["output"]
+    output = str(tmp_path / "out.mbz")
+    send(url, token_file, "package", path=backup_dir, output=output, verify=True)
+    assert verify_backup(output) == []
+    assert "Week A" in section_titles(output)
+    assert any(activity["title"] == "Daemon page" for activity in inspect_mbz(output)["activities"])
+
+
+@pytest.mark.parametrize("target", ["directory", "archive"])
+def test_close_without_package_saves_changes(daemon, backup_dir, tmp_path, target):
+    url, token_file = daemon
+    path = backup_dir
+    if target == "archive":
+        path = str(tmp_path / "course.mbz")
+        package_mbz(backup_dir, path)
+    send(url, token_file, "add-section", path=path, section_name="Kept")
+    send(url, token_file, "close", path=path)
+    assert "Kept" in section_titles(path)
+    assert verify_backup(path) == []
+
+
+def test_close_with_discard_drops_changes(daemon, backup_dir, tmp_path):
+    url, token_file = daemon
+    path = str(tmp_path / "course.mbz")
+    package_mbz(backup_dir, path)
+    with open(path, "rb") as f:
+        before = f.read()
+    send(url, token_file, "add-section", path=path, section_name="Dropped")
+    send(url, token_file, "close", path=path, discard=True)
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+
+def test_shutdown_saves_changes(daemon, backup_dir, tmp_path):
+    url, token_file = daemon
+    path = str(tmp_path / "course.mbz")
+    package_mbz(backup_dir, path)
+    send(url, token_file, "add-section", path=path, section_name="Saved on shutdown")
+    send(url, token_file, "shutdown")
+    deadline = time.time() + 10
+    while os.path.exists(token_file):
+        assert time.time() < deadline, "daemon did not stop"
+        time.sleep(0.01)
+    assert "Saved on shutdown" in section_titles(path)
+
+
+def test_cli_commit(daemon, backup_dir, tmp_path):
+    url, token_file = daemon
+    path = str(tmp_path / "course.mbz")
+    package_mbz(backup_dir, path)
+    cli = [sys.executable, "-m", "moodle_mod_tools.cli", "--daemon", url, "--daemon_token_file", token_file]
+    subprocess.run(cli + ["add-section", "--input", path, "--output", path, "--section_name", "From the CLI"], check=True, capture_output=True)
+    assert "From the CLI" not in section_titles(path)
+    subprocess.run(cli + ["commit", path], check=True, capture_output=True)
+    assert "From the CLI" in section_titles(path)
+    assert verify_backup(path) == []
@@ -0,0 +1,57 @@
+"""IdAllocator: IDs shared across module types, cached between runs and rescanned after outside changes."""
+
+import os
+
+from moodle_mod_tools import metrics
+from moodle_mod_tools.id_allocator import IdAllocator, allocator_for
+from moodle_mod_tools.page_adder import add_page_to_backup
+from moodle_mod_tools.section_adder import add_section_to_backup
+from moodle_mod_tools.verifier import verify_backup
+
+
+def activity_ids(backup_dir):
+    return sorted(int(name.rpartition("_")[2]) for name in os.listdir(os.path.join(backup_dir, "activities")))
+
+
+def test_from_listing():
+    allocator = IdAllocator.from_listing(
+        ["section_1", "section_7", "sections.xml"],
+        ["page_10", "quiz_42", "resource_x"],
+        "<moduleid>50</moduleid><original_course_contextid>90</original_course_contextid>",
+        context_ids=[80],
+    )
+    assert (allocator.next_section_id(), allocator.next_section_id()) == (8, 9)
+    assert allocator.next_module_id() == 51
+    assert allocator.next_context_id() == 91
+    assert IdAllocator().next_section_id() == 30
+
+
+def test_module_ids_are_shared_across_types(backup_dir):
+    # The synthetic backup's highest activity is resource_1005.
+    add_page_to_backup(backup_dir, "1", "New page")
+    assert activity_ids(backup_dir)[-1] == 1006
+    assert verify_backup(backup_dir) == []
+
+
+def test_allocator_is_cached_between_edits(backup_dir):
+    metrics.reset()
+    metrics.enable()
+    try:
+        for number in range(3):
+            add_page_to_backup(backup_dir, "1", f"Page {number}")
+        add_section_to_backup(backup_dir, backup_dir, "Week A")
+        scans = metrics.snapshot()["counters"].get("id_scans", 0)
+    finally:
+        metrics.disable()
+        metrics.reset()
+    assert scans <= 1
+    # Each page takes a module ID and a course module ID.
+    assert activity_ids(backup_dir)[-3:] == [1006, 1008, 1010]
+
+
+def test_outside_changes_force_a_rescan(backup_dir):
+    add_page_to_backup(backup_dir, "1", "First")
+    cached = allocator_for(backup_dir)
+    os.mkdir(os.path.join(backup_dir, "activities", "quiz_5000"))
+    assert allocator_for(backup_dir) is not cached
+    assert allocator_for(backup_dir).next_module_id() == 5001
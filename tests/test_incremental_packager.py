@@ -0,0 +1,86 @@
+"""package_mbz(block_cache=...): same archive contents as package_mbz, with unchanged blocks reused."""
+
+import json
+
+import pytest
+
+from moodle_mod_tools import metrics
+from moodle_mod_tools.bulk_adder import bulk_add_from_tar
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import decompress_mbz, iter_archive, member_name, package_mbz
+from moodle_mod_tools.page_adder import add_page_to_backup
+from moodle_mod_tools.verifier import verify_backup
+
+from conftest import generate_backup
+
+
+def archive_tree(path):
+    tree = {}
+    for member, open_member in iter_archive(path):
+        if member.isfile():
+            with open_member() as f:
+                tree[member_name(member)] = f.read()
+        else:
+            tree[member_name(member)] = member.type
+    return tree
+
+
+def package_counting(source_dir, output, cache):
+    metrics.reset()
+    metrics.enable()
+    try:
+        package_mbz(source_dir, output, block_cache=cache)
+        return metrics.snapshot()["counters"]
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+
+def test_incremental_package_matches_plain_package(tmp_path):
+    backup_dir = generate_backup(str(tmp_path / "backup"), sections=2, activities=12, files=2, file_size=6 << 20)
+    plain = str(tmp_path / "plain.mbz")
+    incremental = str(tmp_path / "incremental.mbz")
+    package_mbz(backup_dir, plain)
+    package_mbz(backup_dir, incremental, block_cache=str(tmp_path / "cache"))
+    assert archive_tree(incremental) == archive_tree(plain)
+    assert verify_backup(incremental) == []
+
+
+def test_second_run_reuses_unchanged_blocks(backup_dir, tmp_path):
+    cache = str(tmp_path / "cache")
+    first = package_counting(backup_dir, str(tmp_path / "first.mbz"), cache)
+    assert first.get("block_cache_hits", 0) == 0
+    blocks = first["block_cache_misses"]
+
+    second = package_counting(backup_dir, str(tmp_path / "second.mbz"), cache)
+    assert second == {"block_cache_hits": blocks, "bytes_written": second["bytes_written"]}
+    with open(tmp_path / "first.mbz", "rb") as a, open(tmp_path / "second.mbz", "rb") as b:
+        assert a.read() == b.read()
+
+    add_page_to_backup(backup_dir, "1", "Edited", "Description", "Content")
+    third = package_counting(backup_dir, str(tmp_path / "third.mbz"), cache)
+    # The new activity, the manifest and section 1 change; the other blocks are reused.
+    assert 0 < third["block_cache_misses"] < blocks
+    assert third["block_cache_hits"] > 0
+    assert archive_tree(str(tmp_path / "third.mbz")) == archive_tree(package_plain(backup_dir, tmp_path))
+
+
+def package_plain(backup_dir, tmp_path):
+    output = str(tmp_path / "plain.mbz")
+    package_mbz(backup_dir, output)
+    return output
+
+
+@pytest.mark.parametrize("mode", [{}, {"streaming": True}, {"in_memory": True}, {"pipelined": True}])
+def test_incremental_archive_is_read_in_full(backup_dir, tmp_path, mode):
+    # Every gzip member of the archive must be read, not just the first one.
+    archive = str(tmp_path / "incremental.mbz")
+    package_mbz(backup_dir, archive, block_cache=str(tmp_path / "cache"))
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps([{"section_name": "Week A", "pages": [{"page_title": "New page"}]}]), encoding="utf-8")
+    output = str(tmp_path / "out.mbz")
+    bulk_add_from_tar(archive, output, str(config), **mode)
+    assert verify_backup(output) == []
+    assert len(inspect_mbz(output)["activities"]) == 7
+    decompress_mbz(output, str(tmp_path / "parallel"), threads=2)
+    assert verify_backup(str(tmp_path / "parallel")) == []
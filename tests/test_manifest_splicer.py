@@ -0,0 +1,95 @@
+"""ManifestSplicer: the same output whatever the chunk size, including matches split across chunks."""
+
+import io
+import os
+
+import pytest
+
+from moodle_mod_tools.manifest_splicer import ManifestSplicer
+
+
+def splice(data, chunk_size, build):
+    splicer = ManifestSplicer()
+    build(splicer)
+    out = io.BytesIO()
+    unmatched = splicer.splice(io.BytesIO(data), out, chunk_size)
+    return out.getvalue(), unmatched
+
+
+def session_edits(splicer):
+    # The edits BackupSession.commit makes.
+    splicer.replace_first(rb"<name>[^<]*</name>", b"<name>renamed.mbz</name>")
+    splicer.replace_first(rb"<value>[^<]*.mbz</value>", b"<value>renamed.mbz</value>")
+    splicer.insert_activities(b"<activity>new</activity>\n")
+    splicer.insert_before(b"</sections>", b"<section>new</section>\n")
+    splicer.insert_before(b"</settings>", b"<setting>new</setting>\n")
+
+
+@pytest.fixture
+def manifest(backup_dir):
+    with open(os.path.join(backup_dir, "moodle_backup.xml"), "rb") as f:
+        return f.read()
+
+
+def test_real_manifest_at_every_chunk_size(manifest):
+    expected, unmatched = splice(manifest, len(manifest) + 1, session_edits)
+    assert unmatched == []
+    assert expected.count(b"renamed.mbz") == 2
+    assert b"synthetic.mbz" not in expected
+    assert expected.index(b"<activity>new</activity>") < expected.index(b"</activities>")
+    assert expected.index(b"<section>new</section>") < expected.index(b"</sections>")
+    assert expected.index(b"<setting>new</setting>") < expected.index(b"</settings>")
+    for chunk_size in list(range(1, 64)) + [97, 512, 4096]:
+        assert splice(manifest, chunk_size, session_edits) == (expected, [])
+
+
+# Each pattern starts exactly at a chunk boundary, straddles one, or ends at one, for every chunk size tried.
+DOCUMENT = (
+    b"<moodle_backup><information><name>old.mbz</name>"
+    b"<contents><activities><activity>a</activity></activities>"
+    b"<sections><section>s</section></sections></contents>"
+    b"<settings><setting><value>old.mbz</value></setting></settings>"
+    b"</information></moodle_backup>"
+)
+
+
+@pytest.mark.parametrize("chunk_size", range(1, len(DOCUMENT) + 2))
+def test_matches_straddling_chunk_boundaries(chunk_size):
+    expected = (
+        DOCUMENT
+        .replace(b"<name>old.mbz</name>", b"<name>renamed.mbz</name>")
+        .replace(b"<value>old.mbz</value>", b"<value>renamed.mbz</value>")
+        .replace(b"</activities>", b"<activity>new</activity>\n</activities>")
+        .replace(b"</sections>", b"<section>new</section>\n</sections>")
+        .replace(b"</settings>", b"<setting>new</setting>\n</settings>")
+    )
+    assert splice(DOCUMENT, chunk_size, session_edits) == (expected, [])
+
+
+@pytest.mark.parametrize("document, expected", [
+    (b"<information><contents><activities/><sections></sections></contents></information>",
+     b"<information><contents><activities><activity>new</activity>\n</activities><sections></sections></contents></information>"),
+    (b"<information><contents><sections></sections></contents></information>",
+     b"<information><contents><sections></sections><activities><activity>new</activity>\n</activities>\n</contents></information>"),
+    (b"<information><name>x</name></information>",
+     b"<information><name>x</name><contents><activities><activity>new</activity>\n</activities></contents>\n</information>"),
+])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, 1000])
+def test_missing_activities_element_is_created(document, expected, chunk_size):
+    assert splice(document, chunk_size, lambda s: s.insert_activities(b"<activity>new</activity>\n")) == (expected, [])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+def test_each_edit_matches_once_and_unmatched_edits_are_reported(chunk_size):
+    def build(splicer):
+        splicer.replace_first(rb"<b>[^<]*</b>", b"<b>x</b>")
+        splicer.insert_before(b"</missing>", b"never")
+
+    output, unmatched = splice(b"<a><b>1</b><b>2</b></a>", chunk_size, build)
+    assert output == b"<a><b>x</b><b>2</b></a>"
+    assert unmatched == ["e1"]
+
+
+def test_text_without_markup_passes_through():
+    data = b"plain text " * 1000
+    assert splice(data, 7, lambda s: s.insert_before(b"</x>", b"y")) == (data, ["e0"])
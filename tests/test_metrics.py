@@ -0,0 +1,64 @@
+"""Timing spans and counters: no-ops while disabled, recorded and reported once enabled."""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from moodle_mod_tools import metrics
+from moodle_mod_tools.mbz_packager import package_mbz
+
+
+@pytest.fixture
+def recording():
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_disabled_records_nothing():
+    metrics.reset()
+    with metrics.span("stage"):
+        metrics.incr("things", 3)
+    assert not metrics.is_enabled()
+    assert metrics.snapshot() == {"spans": {}, "counters": {}}
+
+
+def test_spans_and_counters(recording):
+    for _ in range(3):
+        with metrics.span("stage"):
+            metrics.incr("things", 2)
+    with pytest.raises(RuntimeError):
+        with metrics.span("failing"):
+            raise RuntimeError()
+    data = metrics.snapshot()
+    assert data["counters"] == {"things": 6}
+    assert data["spans"]["stage"]["count"] == 3
+    assert data["spans"]["stage"]["max_s"] <= data["spans"]["stage"]["total_s"]
+    assert data["spans"]["failing"]["count"] == 1
+    report = metrics.format_report()
+    assert "stage" in report and "things" in report
+
+
+def test_package_is_instrumented(recording, backup_dir, tmp_path):
+    output = str(tmp_path / "out.mbz")
+    package_mbz(backup_dir, output)
+    data = metrics.snapshot()
+    assert data["spans"]["package"]["count"] == 1
+    assert data["counters"]["bytes_written"] == os.path.getsize(output)
+
+
+def test_cli_writes_metrics_json(backup_dir, tmp_path):
+    metrics_file = str(tmp_path / "metrics.json")
+    result = subprocess.run(
+        [sys.executable, "-m", "moodle_mod_tools.cli", "--metrics-json", metrics_file, "--profile", "package-mbz", backup_dir, str(tmp_path / "out.mbz")],
+        check=True, capture_output=True, text=True,
+    )
+    with open(metrics_file, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["spans"]["package"]["count"] == 1
+    assert "package" in result.stderr
@@ -0,0 +1,70 @@
+"""extract_parallel: a faithful copy of the archive, and nothing written outside output_dir."""
+
+import io
+import os
+import tarfile
+
+import pytest
+
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.mbz_packager import decompress_mbz, package_mbz
+from moodle_mod_tools.parallel_extract import extract_parallel
+
+from conftest import snapshot
+
+
+def write_tar(path, members):
+    """Writes a .tar.gz from (TarInfo, data or None) pairs."""
+    with tarfile.open(path, "w:gz") as tar:
+        for info, data in members:
+            if data is not None:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            else:
+                tar.addfile(info)
+    return path
+
+
+def regular(name, data):
+    return tarfile.TarInfo(name), data
+
+
+def link(name, target, kind=tarfile.SYMTYPE):
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.linkname = target
+    return info, None
+
+
+@pytest.mark.parametrize("memory_cap", [64 << 20, 100], ids=["queued", "large_files_inline"])
+def test_extracts_same_tree_as_decompress_mbz(backup_dir, tmp_path, memory_cap):
+    archive = str(tmp_path / "backup.mbz")
+    package_mbz(backup_dir, archive)
+    extract_parallel(archive, str(tmp_path / "parallel"), threads=4, queue_depth=3, memory_cap=memory_cap)
+    decompress_mbz(archive, str(tmp_path / "serial"))
+    assert snapshot(str(tmp_path / "parallel")) == snapshot(str(tmp_path / "serial")) == snapshot(backup_dir)
+
+
+def test_hardlink_inside_is_extracted(tmp_path):
+    archive = write_tar(str(tmp_path / "a.mbz"), [regular("a/file", b"shared"), link("a/copy", "a/file", tarfile.LNKTYPE)])
+    extract_parallel(archive, str(tmp_path / "out"), threads=2)
+    with open(tmp_path / "out" / "a" / "copy", "rb") as f:
+        assert f.read() == b"shared"
+
+
+@pytest.mark.parametrize("members", [
+    [regular("../escaped", b"x")],
+    [link("a/up", "../../victim")],
+    [link("a/up", "../../victim", tarfile.LNKTYPE), regular("a/up", b"overwritten")],
+    # Each link looks inside on its own; "a/b/c" only escapes because "a/b" is a symlink.
+    [link("a/b", ".."), link("a/b/c", ".."), regular("a/b/c/victim", b"overwritten")],
+], ids=["name", "symlink", "hardlink", "symlink_chain"])
+def test_members_outside_output_dir_are_rejected(tmp_path, members):
+    victim = tmp_path / "victim"
+    victim.write_bytes(b"original")
+    output_dir = tmp_path / "sandbox" / "out"
+    archive = write_tar(str(tmp_path / "evil.mbz"), members)
+    with pytest.raises(BackupError, match="outside"):
+        extract_parallel(archive, str(output_dir), threads=2)
+    assert victim.read_bytes() == b"original"
+    assert not (tmp_path / "sandbox" / "escaped").exists()
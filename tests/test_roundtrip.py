@@ -0,0 +1,172 @@
+"""Round trips of bulk_add_from_tar through every archive mode, on tar and ZIP backups."""
+
+import json
+import os
+import re
+import shutil
+import zipfile
+
+import pytest
+
+from moodle_mod_tools.bulk_adder import bulk_add_from_json, bulk_add_from_tar
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import decompress_mbz, iter_archive, member_name, package_mbz
+from moodle_mod_tools.pipeline import with_pipelined_tar
+from moodle_mod_tools.verifier import verify_backup
+from moodle_mod_tools.zip_archive import is_zip_archive
+
+from conftest import generate_backup
+
+
+MODES = {
+    "lazy": {},
+    "streaming": {"streaming": True},
+    "in_memory": {"in_memory": True},
+    "pipelined": {"pipelined": True},
+}
+
+# The only part of a backup that legitimately differs between runs: the time new sections were written.
+_TIMEMODIFIED = re.compile(rb"<timemodified>\d+</timemodified>")
+
+
+def _normalise(data: bytes) -> bytes:
+    return _TIMEMODIFIED.sub(b"<timemodified>0</timemodified>", data)
+
+
+def archive_tree(path):
+    """Maps each regular file in a tar or ZIP archive to its normalised content."""
+    tree = {}
+    for member, open_member in iter_archive(path):
+        if member.isfile():
+            with open_member() as f:
+                tree[member_name(member)] = _normalise(f.read())
+    return tree
+
+
+def directory_tree(path):
+    tree = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            with open(full, "rb") as f:
+                tree[os.path.relpath(full, path).replace(os.sep, "/")] = _normalise(f.read())
+    return tree
+
+
+@pytest.fixture(scope="module")
+def source(tmp_path_factory):
+    """A synthetic backup as a directory, a .tar.gz and a ZIP, plus a bulk config.
+
+    It is big enough that a reader cannot buffer the whole archive, so
+    writing over the input while reading it would show up as corruption.
+    """
+    root = tmp_path_factory.mktemp("source")
+    backup_dir = generate_backup(str(root / "backup"), sections=3, activities=150, files=2, file_size=4096)
+    package_mbz(backup_dir, str(root / "backup.mbz"))
+    package_mbz(backup_dir, str(root / "backup.zip"), format="zip")
+
+    body = root / "body.html"
+    body.write_text("<p>Streamed & escaped</p>\n" * 100, encoding="utf-8")
+    config = root / "config.json"
+    config.write_text(json.dumps([
+        {"section_name": "Week A", "pages": [
+            {"page_title": "Inline", "page_content": "<p>A & B</p>"},
+            {"page_title": "From file", "page_content_file": str(body)},
+        ]},
+        {"section_name": "Week B", "section_id": 2, "pages": [{"page_title": "Into section 2"}]},
+    ]), encoding="utf-8")
+    return {"dir": backup_dir, "tar": str(root / "backup.mbz"), "zip": str(root / "backup.zip"), "config": str(config)}
+
+
+@pytest.fixture(scope="module")
+def expected(source, tmp_path_factory):
+    """The config applied to a fully extracted copy of the backup."""
+    work = str(tmp_path_factory.mktemp("expected") / "backup")
+    decompress_mbz(source["tar"], work)
+    bulk_add_from_json(work, work, source["config"])
+    return directory_tree(work)
+
+
+@pytest.mark.parametrize("same_file", [False, True], ids=["copy", "in_place"])
+@pytest.mark.parametrize("archive_format", ["tar", "zip"])
+@pytest.mark.parametrize("mode", list(MODES))
+def test_bulk_add_round_trip(source, expected, tmp_path, mode, archive_format, same_file):
+    # Input and output share a file name, which the expected tree records as "backup.mbz".
+    os.makedirs(tmp_path / "in")
+    os.makedirs(tmp_path / "out")
+    input_path = str(tmp_path / "in" / "backup.mbz")
+    shutil.copyfile(source[archive_format], input_path)
+    output_path = input_path if same_file else str(tmp_path / "out" / "backup.mbz")
+
+    if same_file and archive_format == "tar" and mode == "pipelined":
+        # The pipeline starts writing the output before the input is fully read, so it refuses to overwrite it.
+        with pytest.raises(ValueError):
+            bulk_add_from_tar(input_path, output_path, source["config"], **MODES[mode])
+        with open(input_path, "rb") as f, open(source["tar"], "rb") as original:
+            assert f.read() == original.read()
+        return
+
+    bulk_add_from_tar(input_path, output_path, source["config"], **MODES[mode])
+
+    assert is_zip_archive(output_path) == (archive_format == "zip")
+    assert verify_backup(output_path) == []
+    assert inspect_mbz(output_path)["information"]["name"] == "backup.mbz"
+    assert archive_tree(output_path) == expected
+    for directory in ("in", "out"):
+        assert [name for name in os.listdir(tmp_path / directory) if name.startswith(".tmp-")] == []
+
+
+@pytest.mark.parametrize("archive_format", ["tar", "zip"])
+def test_rerun_applies_nothing(source, tmp_path, archive_format):
+    path = str(tmp_path / "in.mbz")
+    shutil.copyfile(source[archive_format], path)
+    bulk_add_from_tar(path, path, source["config"])
+    first = archive_tree(path)
+    bulk_add_from_tar(path, path, source["config"])
+    assert archive_tree(path) == first
+
+
+def test_touched_content_file_is_not_applied_twice(source, tmp_path):
+    path = str(tmp_path / "in.mbz")
+    shutil.copyfile(source["tar"], path)
+    bulk_add_from_tar(path, path, source["config"])
+    first = archive_tree(path)
+    with open(source["config"], encoding="utf-8") as f:
+        body = json.load(f)[0]["pages"][1]["page_content_file"]
+    stat = os.stat(body)
+    os.utime(body, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    bulk_add_from_tar(path, path, source["config"])
+    assert archive_tree(path) == first
+
+
+def test_zip_update_only_appends(source, tmp_path):
+    path = str(tmp_path / "in.mbz")
+    shutil.copyfile(source["zip"], path)
+    with zipfile.ZipFile(path) as zf:
+        data_end = zf.start_dir
+    with open(path, "rb") as f:
+        before = f.read(data_end)
+    bulk_add_from_tar(path, path, source["config"], streaming=True)
+    with open(path, "rb") as f:
+        assert f.read(data_end) == before
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+
+
+def test_pipeline_error_removes_output(source, tmp_path):
+    output_path = str(tmp_path / "out.mbz")
+    with pytest.raises(RuntimeError):
+        with with_pipelined_tar(source["tar"], output_path) as session:
+            session.add_section("Never written")
+            raise RuntimeError("abort")
+    assert not os.path.exists(output_path)
+
+
+def test_tar_with_zip_signature_in_tail_is_not_zip(source, tmp_path):
+    path = str(tmp_path / "odd.mbz")
+    with open(source["tar"], "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data + b"PK\x05\x06" + b"\0" * 18)
+    assert zipfile.is_zipfile(path)
+    assert not is_zip_archive(path)
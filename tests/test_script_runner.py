@@ -0,0 +1,85 @@
+"""run-script: mixed operations against one backup, named results, packaging and failures."""
+
+import json
+import os
+
+import pytest
+
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.inspector import inspect_mbz
+from moodle_mod_tools.mbz_packager import package_mbz
+from moodle_mod_tools.script_runner import run_script
+from moodle_mod_tools.verifier import verify_backup
+
+from conftest import snapshot
+
+
+def write_script(path, operations):
+    path.write_text("".join(json.dumps(op) + "\n" for op in operations), encoding="utf-8")
+    return str(path)
+
+
+def page_titles(path):
+    return [activity["title"] for activity in inspect_mbz(path)["activities"] if activity.get("modulename") == "page"]
+
+
+def test_directory_script(backup_dir, tmp_path):
+    body = tmp_path / "body.html"
+    body.write_text("<p>From a file</p>", encoding="utf-8")
+    script = write_script(tmp_path / "ops.jsonl", [
+        {"op": "add-section", "section_name": "Week A", "as": "week"},
+        {"op": "lookup", "section_name": "Section 1", "as": "first"},
+        {"op": "add-page", "section_id": "$week", "page_title": "By name reference"},
+        {"op": "add-page", "section_name": "Section 1", "page_title": "By section title", "page_content_file": str(body)},
+        {"op": "add-section", "section_name": "Week A", "if_missing": True, "as": "again"},
+        {"op": "package", "output": str(tmp_path / "mid.mbz")},
+        {"op": "add-page", "section_id": "$again", "page_title": "After packaging"},
+    ])
+    names = run_script(backup_dir, script)
+    assert names["first"] == 1 and names["again"] == names["week"]
+    assert verify_backup(backup_dir) == []
+    assert page_titles(backup_dir)[-3:] == ["By name reference", "By section title", "After packaging"]
+    assert "After packaging" not in page_titles(str(tmp_path / "mid.mbz"))
+    with open(os.path.join(backup_dir, "moodle_backup.xml"), encoding="utf-8") as f:
+        assert f.read().count("<title>Week A</title>") == 1
+
+
+def test_archive_script_leaves_input_untouched(backup_dir, tmp_path):
+    archive = str(tmp_path / "course.mbz")
+    package_mbz(backup_dir, archive)
+    with open(archive, "rb") as f:
+        before = f.read()
+    script = write_script(tmp_path / "ops.jsonl", [
+        {"op": "add-section", "section_name": "Week A", "as": "week"},
+        {"op": "add-page", "section_id": "$week", "page_title": "Archived page"},
+    ])
+    output = str(tmp_path / "out.mbz")
+    run_script(archive, script, output_file=output)
+    with open(archive, "rb") as f:
+        assert f.read() == before
+    assert verify_backup(output) == []
+    assert inspect_mbz(output)["information"]["name"] == "out.mbz"
+    assert "Archived page" in page_titles(output)
+
+
+@pytest.mark.parametrize("bad_op, message", [
+    ({"op": "add-page", "section_id": "$missing", "page_title": "x"}, "operation 3: '\\$missing' is not defined"),
+    ({"op": "lookup", "section_name": "No such section"}, "operation 3: no section named"),
+    ({"op": "add-page", "page_title": "x"}, "operation 3: add-page needs a section_id or section_name"),
+    ({"op": "frobnicate"}, "operation 3: unknown op 'frobnicate'"),
+])
+def test_failing_operation_rolls_back(backup_dir, tmp_path, bad_op, message):
+    before = snapshot(backup_dir)
+    script = write_script(tmp_path / "ops.jsonl", [
+        {"op": "add-section", "section_name": "Week A", "as": "week"},
+        {"op": "add-page", "section_id": "$week", "page_title": "Flushed before the failure"},
+        bad_op,
+    ])
+    with pytest.raises(BackupError, match=message):
+        run_script(backup_dir, script)
+    assert snapshot(backup_dir) == before
+
+
+def test_optional_lookup_yields_minus_one(backup_dir, tmp_path):
+    script = write_script(tmp_path / "ops.jsonl", [{"op": "lookup", "section_name": "No such section", "required": False, "as": "missing"}])
+    assert run_script(backup_dir, script) == {"missing": -1}
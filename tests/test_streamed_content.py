@@ -0,0 +1,63 @@
+"""Page text streamed from files and streams: the same page.xml as inline text, escaped chunk by chunk."""
+
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from moodle_mod_tools.page_adder import add_page_to_backup
+from moodle_mod_tools.streamed_content import ContentFile, ContentStream, StreamedText, as_content
+
+# Multi-byte characters and markup, so chunks split both UTF-8 sequences and entities.
+TEXT = "<p>Crème brûlée & “quotes” — 日本語 🙂</p>\n" * 50
+
+
+def page_xml(backup_dir):
+    newest = max(os.listdir(os.path.join(backup_dir, "activities")), key=lambda name: int(name.rpartition("_")[2]))
+    with open(os.path.join(backup_dir, "activities", newest, "page.xml"), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 16])
+def test_byte_stream_chunks_decode_split_characters(chunk_size):
+    data = TEXT.encode("utf-8")
+    assert "".join(ContentStream(io.BytesIO(data)).chunks(chunk_size)) == TEXT
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+def test_write_to_escapes_each_chunk(tmp_path, chunk_size):
+    path = tmp_path / "body.html"
+    path.write_text(TEXT, encoding="utf-8")
+    text = StreamedText.render(lambda body: f"<content>{body}</content>", body=ContentFile(path))
+    out = io.BytesIO()
+    text.write_to(out, chunk_size)
+    assert ET.fromstring(out.getvalue()).text == TEXT
+
+
+@pytest.mark.parametrize("source", ["file", "bytes", "text"])
+def test_streamed_page_matches_inline_page(backup_dir, tmp_path, source):
+    path = tmp_path / "body.html"
+    path.write_text(TEXT, encoding="utf-8")
+    content = {
+        "file": ContentFile(path),
+        "bytes": io.BytesIO(TEXT.encode("utf-8")),
+        "text": io.StringIO(TEXT),
+    }[source]
+    inline_dir = str(tmp_path / "inline")
+    add_page_to_backup(backup_dir, "1", "Page", "Description", TEXT, output_dir=inline_dir)
+    add_page_to_backup(backup_dir, "1", "Page", "Description", content, output_dir=str(tmp_path / "streamed"))
+    assert page_xml(str(tmp_path / "streamed")) == page_xml(inline_dir)
+    assert ET.fromstring(page_xml(inline_dir)).find(".//content").text == TEXT
+
+
+def test_as_content():
+    stream = io.StringIO("x")
+    assert as_content("x") == "x"
+    assert as_content(stream).stream is stream
+    with pytest.raises(TypeError, match="page text must be"):
+        as_content(42)
+
+
+def test_render_without_sources_is_a_plain_string():
+    assert StreamedText.render(lambda body: f"<content>{body}</content>", body="a") == "<content>a</content>"
@@ -0,0 +1,78 @@
+"""The streaming archive mode: load_metadata_session and rewrite_mbz."""
+
+import os
+import shutil
+
+import pytest
+
+from moodle_mod_tools import mbz_packager
+from moodle_mod_tools.mbz_packager import iter_archive, load_metadata_session, member_name, package_mbz, rewrite_mbz, with_streamed_tar
+from moodle_mod_tools.verifier import verify_backup
+
+
+@pytest.fixture
+def archive(backup_dir, tmp_path):
+    path = str(tmp_path / "backup.mbz")
+    package_mbz(backup_dir, path)
+    return path
+
+
+def members(path):
+    contents = {}
+    for member, open_member in iter_archive(path):
+        name = member_name(member)
+        if member.isfile():
+            with open_member() as f:
+                contents[name] = f.read()
+        else:
+            contents[name] = None
+    return contents
+
+
+def test_metadata_session_holds_only_metadata(archive):
+    session = load_metadata_session(archive)
+    assert "moodle_backup.xml" in session.files
+    assert "sections/section_1/section.xml" in session.files
+    assert not any(name.startswith(("activities/", "course/")) for name in session.files)
+    # Activity directories still count for ID allocation.
+    assert session.ids.next_module_id() > 1005
+
+
+def test_rewrite_replaces_and_appends(archive, tmp_path):
+    output = str(tmp_path / "out.mbz")
+    rewrite_mbz(archive, output, {"course/course.xml": b"<course/>", "new_dir/deeper/file.txt": b"new"})
+    before, after = members(archive), members(output)
+    assert after["course/course.xml"] == b"<course/>"
+    assert after["new_dir/deeper/file.txt"] == b"new"
+    assert "new_dir" in after and after["new_dir"] is None and "new_dir/deeper" in after
+    assert {name: data for name, data in after.items() if not name.startswith(("course/course.xml", "new_dir"))} == {
+        name: data for name, data in before.items() if name != "course/course.xml"
+    }
+    names = list(after)
+    assert names.index("new_dir") < names.index("new_dir/deeper") < names.index("new_dir/deeper/file.txt")
+
+
+def test_streamed_session_in_place(archive):
+    with with_streamed_tar(archive, archive, backup_name="backup.mbz") as session:
+        session.add_page(session.add_section("Streamed"), "Streamed page")
+    assert verify_backup(archive) == []
+    assert b"<title>Streamed page</title>" in members(archive)["moodle_backup.xml"]
+
+
+@pytest.mark.parametrize("same_file", [False, True], ids=["copy", "in_place"])
+def test_failed_rewrite_leaves_output_intact(archive, tmp_path, monkeypatch, same_file):
+    output = archive if same_file else str(tmp_path / "out.mbz")
+    if not same_file:
+        shutil.copyfile(archive, output)
+    with open(archive, "rb") as f:
+        original = f.read()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(mbz_packager, "append_files", fail)
+    with pytest.raises(RuntimeError):
+        rewrite_mbz(archive, output, {"new.txt": b"x"})
+    with open(output, "rb") as f:
+        assert f.read() == original
+    assert [name for name in os.listdir(tmp_path) if name.startswith(".tmp-")] == []
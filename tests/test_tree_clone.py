@@ -0,0 +1,73 @@
+"""clone_tree modes, and edits through a clone leaving the source backup untouched."""
+
+import json
+import os
+
+import pytest
+
+from moodle_mod_tools import tree_clone
+from moodle_mod_tools.bulk_adder import bulk_add_from_json
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.page_adder import add_page_to_backup
+from moodle_mod_tools.section_adder import add_section_to_backup
+from moodle_mod_tools.tree_clone import clone_tree
+from moodle_mod_tools.verifier import verify_backup
+
+from conftest import generate_backup, snapshot
+
+
+@pytest.fixture
+def source(tmp_path):
+    return generate_backup(str(tmp_path / "source"), sections=2, activities=6, files=2, file_size=2048)
+
+
+@pytest.mark.parametrize("mode", ["auto", "hardlink", "copy"])
+def test_clone_matches_source(source, tmp_path, mode):
+    dst = str(tmp_path / "clone")
+    clone_tree(source, dst, mode)
+    assert snapshot(dst) == snapshot(source)
+    if mode != "auto":
+        shared = os.path.samefile(os.path.join(source, "moodle_backup.xml"), os.path.join(dst, "moodle_backup.xml"))
+        assert shared == (mode == "hardlink")
+
+
+@pytest.mark.parametrize("mode", ["auto", "hardlink", "copy"])
+def test_edits_through_a_clone_leave_the_source_untouched(source, tmp_path, mode):
+    before = snapshot(source)
+    add_page_to_backup(source, "1", "Cloned page", output_dir=str(tmp_path / "page"), copy_mode=mode)
+    add_section_to_backup(source, str(tmp_path / "section"), "Cloned section", copy_mode=mode)
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps([{"section_name": "Week A", "pages": [{"page_title": "Bulk page"}]}]), encoding="utf-8")
+    bulk_add_from_json(source, str(tmp_path / "bulk"), str(config), copy_mode=mode)
+    assert snapshot(source) == before
+    for name in ("page", "section", "bulk"):
+        assert verify_backup(str(tmp_path / name)) == []
+        assert snapshot(str(tmp_path / name)) != before
+
+
+def test_auto_falls_back_to_a_copy(source, tmp_path, monkeypatch):
+    def unsupported(src, dst):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(tree_clone, "_reflink", unsupported)
+    monkeypatch.setattr(os, "link", unsupported)
+    dst = str(tmp_path / "clone")
+    clone_tree(source, dst)
+    assert snapshot(dst) == snapshot(source)
+    assert not os.path.samefile(os.path.join(source, "moodle_backup.xml"), os.path.join(dst, "moodle_backup.xml"))
+
+
+def test_failed_clone_is_removed(source, tmp_path, monkeypatch):
+    def unsupported(src, dst):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(os, "link", unsupported)
+    dst = str(tmp_path / "clone")
+    with pytest.raises(BackupError, match="could not hardlink"):
+        clone_tree(source, dst, "hardlink")
+    assert not os.path.exists(dst)
+
+
+def test_unknown_mode(source, tmp_path):
+    with pytest.raises(ValueError, match="unknown copy mode"):
+        clone_tree(source, str(tmp_path / "clone"), "symlink")
@@ -0,0 +1,107 @@
+"""verify_backup on consistent backups and on each kind of inconsistency it reports."""
+
+import os
+import re
+import shutil
+
+import pytest
+
+from moodle_mod_tools.exceptions import BackupError
+from moodle_mod_tools.mbz_packager import package_mbz
+from moodle_mod_tools.verifier import check_backup, verify_backup
+
+
+def edit(path, pattern, replacement, count=0):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    new_text = re.sub(pattern, replacement, text, count=count)
+    assert new_text != text
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(new_text)
+
+
+def section_xml(backup_dir, section_id):
+    return os.path.join(backup_dir, "sections", f"section_{section_id}", "section.xml")
+
+
+@pytest.mark.parametrize("archive_format", [None, "tar", "zip"])
+def test_consistent_backup_has_no_problems(backup_dir, tmp_path, archive_format):
+    path = backup_dir
+    if archive_format:
+        path = str(tmp_path / "backup.mbz")
+        package_mbz(backup_dir, path, format=archive_format)
+    assert verify_backup(path) == []
+    check_backup(path)
+
+
+def test_activity_missing_from_every_sequence(backup_dir, tmp_path):
+    # Section 1 lists 1000,1002,1004 and section 2 lists 1001,1003,1005.
+    edit(section_xml(backup_dir, 1), r"<sequence>\d+,", "<sequence>")
+    edit(section_xml(backup_dir, 2), r"<sequence>\d+,", "<sequence>")
+    expected = [
+        "activity 'activities/page_1000': module.xml names section 1, whose sequence does not list it.",
+        "activity 'activities/quiz_1001': module.xml names section 2, whose sequence does not list it.",
+    ]
+    assert verify_backup(backup_dir) == expected
+    archive = str(tmp_path / "backup.mbz")
+    package_mbz(backup_dir, archive)
+    assert verify_backup(archive) == expected
+
+
+def test_activity_directory_missing_from_manifest(backup_dir):
+    shutil.copytree(os.path.join(backup_dir, "activities", "page_1000"), os.path.join(backup_dir, "activities", "page_2000"))
+    problems = verify_backup(backup_dir)
+    assert "activity 'activities/page_2000' is not in the manifest." in problems
+
+
+def test_manifest_activity_without_directory(backup_dir):
+    shutil.rmtree(os.path.join(backup_dir, "activities", "quiz_1004"))
+    problems = verify_backup(backup_dir)
+    assert "manifest activity 1004: directory 'activities/quiz_1004' does not exist." in problems
+    assert "section 1: sequence lists 1004, which has no activity directory." in problems
+
+
+def test_manifest_section_without_directory(backup_dir):
+    shutil.rmtree(os.path.join(backup_dir, "sections", "section_2"))
+    problems = verify_backup(backup_dir)
+    assert "manifest section 2: directory 'sections/section_2' does not exist." in problems
+    assert "activity 'activities/quiz_1001': module.xml names section 2, which does not exist." in problems
+
+
+def test_activity_listed_by_two_sections(backup_dir):
+    edit(section_xml(backup_dir, 2), r"<sequence>", "<sequence>1000,")
+    assert verify_backup(backup_dir) == ["section 2: sequence lists 1000, already listed by section 1."]
+
+
+def test_activity_listed_by_the_wrong_section(backup_dir):
+    edit(section_xml(backup_dir, 1), r"<sequence>1000,", "<sequence>")
+    edit(section_xml(backup_dir, 2), r"<sequence>", "<sequence>1000,")
+    assert verify_backup(backup_dir) == ["activity 'activities/page_1000': module.xml names section 1 but it is listed by section 2."]
+
+
+def test_malformed_section_xml_is_reported_once(backup_dir):
+    edit(section_xml(backup_dir, 2), r"</section>", "")
+    problems = verify_backup(backup_dir)
+    assert problems[0].startswith("'sections/section_2/section.xml' is not well-formed XML: ")
+    assert not any("section_2/section.xml' does not exist" in problem for problem in problems)
+
+
+def test_malformed_manifest(backup_dir):
+    edit(os.path.join(backup_dir, "moodle_backup.xml"), r"</activities>", "", count=1)
+    problems = verify_backup(backup_dir)
+    assert len(problems) == 1 and problems[0].startswith("'moodle_backup.xml' is not well-formed XML: ")
+
+
+def test_missing_manifest(backup_dir):
+    os.remove(os.path.join(backup_dir, "moodle_backup.xml"))
+    assert verify_backup(backup_dir) == ["moodle_backup.xml not found."]
+    with pytest.raises(BackupError, match="failed verification"):
+        check_backup(backup_dir)
+
+
+def test_package_mbz_verify_writes_nothing_on_failure(backup_dir, tmp_path):
+    edit(section_xml(backup_dir, 1), r"<sequence>\d+,", "<sequence>")
+    output = str(tmp_path / "out.mbz")
+    with pytest.raises(BackupError):
+        package_mbz(backup_dir, output, verify=True)
+    assert not os.path.exists(output)
@@ -0,0 +1,78 @@
+"""MemoryWorkspace and the in-memory archive mode built on it."""
+
+import os
+import shutil
+
+import pytest
+
+from moodle_mod_tools import mbz_packager
+from moodle_mod_tools.backup_session import BackupSession
+from moodle_mod_tools.mbz_packager import load_workspace, package_mbz, package_workspace, with_memory_tar
+from moodle_mod_tools.verifier import verify_backup
+from moodle_mod_tools.workspace import MemoryWorkspace, Workspace
+
+from conftest import snapshot
+
+
+@pytest.fixture
+def archive(backup_dir, tmp_path):
+    path = str(tmp_path / "backup.mbz")
+    package_mbz(backup_dir, path)
+    return path
+
+
+def test_backend_must_implement_the_interface():
+    class Partial(Workspace):
+        def read(self, rel):
+            return b""
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_memory_workspace_write_read_remove():
+    workspace = MemoryWorkspace({"moodle_backup.xml": b"<moodle_backup/>"})
+    workspace.write("activities/page_1/page.xml", b"<page/>")
+    assert workspace.isdir("activities/page_1") and workspace.read("activities/page_1/page.xml") == b"<page/>"
+    assert workspace.size == len(b"<moodle_backup/><page/>")
+    workspace.remove("activities/page_1/page.xml")
+    assert not workspace.isfile("activities/page_1/page.xml") and not workspace.isdir("activities/page_1")
+    assert workspace.written == {} and workspace.size == len(b"<moodle_backup/>")
+
+
+@pytest.mark.parametrize("spill_threshold", [None, 0], ids=["in_memory", "spilled"])
+def test_edit_and_package_round_trip(archive, tmp_path, spill_threshold):
+    output = str(tmp_path / "out.mbz")
+    with with_memory_tar(archive, output, spill_threshold=spill_threshold) as workspace:
+        assert (workspace.spilled_dir is not None) == (spill_threshold == 0)
+        with BackupSession(workspace, backup_name="out.mbz") as session:
+            section_id = session.add_section("Added")
+            session.add_page(section_id, "New page")
+        spilled_dir = workspace.spilled_dir
+    assert spilled_dir is None or not os.path.exists(spilled_dir)
+    assert verify_backup(output) == []
+    mbz_packager.decompress_mbz(output, str(tmp_path / "out"))
+    tree = snapshot(str(tmp_path / "out"))
+    assert b"<title>New page</title>" in tree["moodle_backup.xml"]
+
+
+@pytest.mark.parametrize("spill_threshold", [None, 0], ids=["in_memory", "spilled"])
+def test_failed_packaging_leaves_output_intact(archive, tmp_path, monkeypatch, spill_threshold):
+    output = str(tmp_path / "out.mbz")
+    shutil.copyfile(archive, output)
+    workspace = load_workspace(archive, spill_threshold=spill_threshold)
+    BackupSession(workspace).add_section("Never packaged")
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(mbz_packager, "append_files", fail)
+    monkeypatch.setattr(mbz_packager, "add_member", fail)
+    try:
+        with pytest.raises(RuntimeError):
+            package_workspace(workspace, output)
+    finally:
+        workspace.close()
+    with open(output, "rb") as f, open(archive, "rb") as original:
+        assert f.read() == original.read()
+    assert [name for name in os.listdir(tmp_path) if name.startswith(".tmp-")] == []